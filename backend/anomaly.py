@@ -0,0 +1,223 @@
+'''
+   Streaming leak and sensor-fault detection over the fleet's MQTT readings
+
+   Keeps a few numbers per (node, metric): EWMA mean and variance, the last
+   value and time, the EWMA rate of change, the baseline's slope and a
+   stuck-value counter, so memory is constant per node however long it runs.
+   Each reading is checked as it arrives and raises:
+
+     leak           soil moisture or humidity jumps well above its own baseline,
+                    or soil moisture crosses the wet threshold
+     sensor_fault   NaN/inf, out of range, stuck on one value, or a humidity
+                    reading that is really the temperature
+     battery_drain  battery voltage falling faster than the drain limit
+
+   python3 anomaly.py --broker 192.168.1.10            # live, alerts on stdout and <model>/<node>/alert
+   python3 anomaly.py --replay captured.txt            # "<unix time> <topic> <payload>" lines
+   python3 anomaly.py --synthetic 1000                 # benchmark: a simulated day for 1000 nodes
+'''
+import argparse
+import json
+import math
+import random
+import time
+
+import fleet
+
+LEAK_METRICS = {("Soil", "Moisture"), ("AHT20", "Humidity"), ("SHT40", "Humidity"),
+                ("BME280", "Humidity"), ("BME680", "Humidity")}
+BATTERY_METRICS = {("Battery", "Voltage"), ("BFF", "BatteryADC"), ("LC709203F", "BatteryVoltage"), ("INA260", "Battery")}
+RANGES = {"Humidity": (0.0, 100.0), "Moisture": (-5.0, 105.0), "Temp": (-40.0, 185.0)}
+
+
+class SeriesState:
+    __slots__ = ("mean", "var", "last", "last_ts", "rate", "trend", "stuck", "count")
+
+    def __init__(self, value, ts):
+        self.mean = value
+        self.var = 0.0
+        self.last = value
+        self.last_ts = ts
+        self.rate = 0.0
+        self.trend = 0.0
+        self.stuck = 0
+        self.count = 1
+
+
+class Detector:
+    def __init__(self, alpha=0.05, rate_alpha=0.3, z_limit=6.0, wet_threshold=80.0, leak_rise_per_hour=15.0,
+                 stuck_limit=24, drain_volts_per_hour=0.05, warmup=12, cooldown=3600):
+        self.alpha = alpha
+        self.rate_alpha = rate_alpha
+        self.z_limit = z_limit
+        self.wet_threshold = wet_threshold
+        self.leak_rise_per_hour = leak_rise_per_hour
+        self.stuck_limit = stuck_limit
+        self.drain_volts_per_hour = drain_volts_per_hour
+        self.warmup = warmup
+        self.cooldown = cooldown
+        self.states = {}
+        self.temps = {}        # (model, node, measurement) -> last temperature, for the humidity check
+        self.last_alert = {}
+        self.alerts = 0
+
+    def alert(self, kind, model, node, measurement, field, value, ts, reason):
+        key = (model, node, measurement, field, kind)
+        if ts - self.last_alert.get(key, -math.inf) < self.cooldown:
+            return None
+        self.last_alert[key] = ts
+        self.alerts += 1
+        return {"kind": kind, "model": model, "node": node, "metric": "{}/{}".format(measurement, field),
+                "value": value, "ts": ts, "reason": reason}
+
+    def update(self, model, node, measurement, field, value, ts):
+        """ Fold one reading into its state; returns the alerts it raised """
+        alerts = []
+        if not math.isfinite(value):
+            found = self.alert("sensor_fault", model, node, measurement, field, value, ts, "not a number")
+            return [found] if found else alerts
+        low, high = RANGES.get(field, (-math.inf, math.inf))
+        if not low <= value <= high:
+            found = self.alert("sensor_fault", model, node, measurement, field, value, ts, "out of range")
+            if found:
+                alerts.append(found)
+        if field == "Temp":
+            self.temps[(model, node, measurement)] = value
+        elif field == "Humidity":
+            temp = self.temps.get((model, node, measurement))
+            if temp is not None and abs(temp - value) < 0.005:
+                found = self.alert("sensor_fault", model, node, measurement, field, value, ts, "humidity equals temperature")
+                if found:
+                    alerts.append(found)
+
+        key = (model, node, measurement, field)
+        state = self.states.get(key)
+        if state is None:
+            self.states[key] = SeriesState(value, ts)
+            return alerts
+
+        hours = max(ts - state.last_ts, 1.0) / 3600.0
+        rate = (value - state.last) / hours
+        state.rate += self.rate_alpha * (rate - state.rate)
+        state.stuck = state.stuck + 1 if value == state.last else 0
+        deviation = value - state.mean
+        z = deviation / math.sqrt(state.var) if state.var > 1e-9 else 0.0
+        state.count += 1
+
+        if state.count > self.warmup:
+            if state.stuck == self.stuck_limit:
+                found = self.alert("sensor_fault", model, node, measurement, field, value, ts, "stuck value")
+                if found:
+                    alerts.append(found)
+            if (measurement, field) in LEAK_METRICS:
+                rising = z > self.z_limit and rate > self.leak_rise_per_hour
+                wet = measurement == "Soil" and value >= self.wet_threshold and state.mean < self.wet_threshold
+                if rising or wet:
+                    found = self.alert("leak", model, node, measurement, field, value, ts,
+                                       "z={:.1f} rate={:.1f}/h".format(z, rate) if rising else "above wet threshold")
+                    if found:
+                        alerts.append(found)
+
+        # a reading that raised a leak still moves the baseline, slowly
+        step = self.alpha * deviation
+        state.mean += step
+        state.var = (1 - self.alpha) * (state.var + self.alpha * deviation * deviation)
+        state.last = value
+        state.last_ts = ts
+        # the baseline's slope, far less noisy than reading to reading rates
+        state.trend += self.rate_alpha * (step / hours - state.trend)
+        if state.count > self.warmup and (measurement, field) in BATTERY_METRICS:
+            if state.trend < -self.drain_volts_per_hour:
+                found = self.alert("battery_drain", model, node, measurement, field, value, ts,
+                                   "{:.3f} V/h".format(state.trend))
+                if found:
+                    alerts.append(found)
+        return alerts
+
+    def feed(self, topic, payload, now):
+        alerts = []
+        try:
+            readings = fleet.decode(topic, payload)
+        except ValueError:
+            return alerts
+        for model, node, measurement, field, value, ts in readings:
+            alerts.extend(self.update(model, node, measurement, field, value, now if ts is None else ts))
+        return alerts
+
+
+def synthetic_day(nodes, interval=300, leak_nodes=3, seed=1):
+    """ (ts, topic, payload) for a day of fleet traffic with a few leaks, faults and drains """
+    rng = random.Random(seed)
+    start = 1_700_000_000
+    steps = 86400 // interval
+    for step in range(steps):
+        for n in range(nodes):
+            ts = start + step * interval + (n % interval)
+            prefix = "qtpy/{}".format(n)
+            temp = 70.0 + 5 * math.sin(step / steps * 2 * math.pi) + rng.gauss(0, 0.2)
+            humidity = 45.0 + rng.gauss(0, 0.5)
+            soil = 20.0 + rng.gauss(0, 0.8)
+            battery = 12.6 - 0.0001 * step + rng.gauss(0, 0.005)
+            if n < leak_nodes and step > steps // 2:
+                soil = min(100.0, 20.0 + (step - steps // 2) * 8.0)
+            if n == leak_nodes:
+                humidity = temp                      # the old SHT40 bug
+            if n == leak_nodes + 1 and step > steps // 3:
+                battery = 12.6 - (step - steps // 3) * 0.02
+            yield ts, prefix + "/SHT40/Temp", "{:.2f}".format(temp)
+            yield ts, prefix + "/SHT40/Humidity", "{:.2f}".format(humidity)
+            yield ts, prefix + "/Soil/Moisture", "{:.2f}".format(soil)
+            yield ts, prefix + "/Battery/Voltage", "{:.3f}".format(battery)
+
+
+def run(detector, messages, show=True):
+    started = time.monotonic()
+    count = 0
+    for ts, topic, payload in messages:
+        count += 1
+        for found in detector.feed(topic, payload, ts):
+            if show:
+                print(json.dumps(found))
+    return count, time.monotonic() - started
+
+
+def replay_lines(path):
+    with open(path) as f:
+        for text in f:
+            parts = text.rstrip("\n").split(" ", 2)
+            if len(parts) == 3:
+                yield float(parts[0]), parts[1], parts[2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--replay", help="captured '<unix time> <topic> <payload>' lines")
+    parser.add_argument("--synthetic", type=int, metavar="NODES", help="benchmark on a simulated day")
+    parser.add_argument("--quiet", action="store_true", help="count alerts without printing them")
+    args = parser.parse_args()
+
+    detector = Detector()
+    if args.replay or args.synthetic:
+        messages = replay_lines(args.replay) if args.replay else synthetic_day(args.synthetic)
+        count, seconds = run(detector, messages, not args.quiet)
+        print("{} readings, {} series, {} alerts in {:.2f}s ({:.0f} readings/s)".format(
+            count, len(detector.states), detector.alerts, seconds, count / max(seconds, 1e-9)))
+        return
+
+    client = fleet.mqtt_client("fleet-anomaly")
+
+    def on_message(client, userdata, message):
+        for found in detector.feed(message.topic, message.payload, time.time()):
+            print(json.dumps(found))
+            client.publish("{}/{}/alert".format(found["model"], found["node"]), json.dumps(found))
+
+    client.on_message = on_message
+    client.on_connect = lambda client, userdata, flags, rc: client.subscribe("+/+/#")
+    client.connect(args.broker, args.port)
+    client.loop_forever()
+
+
+if __name__ == "__main__":
+    main()
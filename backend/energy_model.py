@@ -0,0 +1,65 @@
+'''
+   Host-side runs of the QtPy energy model (leak_detector_scripts/mod_energy.py)
+
+   Compares configurations before they are flashed. Profiles come from a JSON
+   list, or from the "PROFILE: {...}" lines code.py writes to the SD log.
+   Those are written with LOG_PROFILE = 1 in settings.toml, the default,
+   whatever LOG_SD_LEVEL is; with LOG_PROFILE = 0 only at LOG_SD_LEVEL = "debug".
+
+   python3 energy_model.py profiles_example.json
+   python3 energy_model.py /Volumes/SD/testlog.log --capacity 2000 --percent 80
+'''
+import argparse
+import ast
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "leak_detector_scripts"))
+import mod_energy  # noqa: E402
+
+
+def load_profiles(path):
+    """ A JSON list of profiles, or PROFILE lines from a device log """
+    with open(path) as f:
+        text = f.read()
+    if path.endswith(".json"):
+        return json.loads(text)
+    profiles = []
+    for line in text.splitlines():
+        marker = line.find("PROFILE: ")
+        if marker >= 0:
+            profile = ast.literal_eval(line[marker + len("PROFILE: "):])
+            profile.setdefault("name", "wake {}".format(len(profiles) + 1))
+            profiles.append(profile)
+    return profiles
+
+
+def evaluate(profile, capacity, percent):
+    cycle = mod_energy.cycle_energy(
+        profile["phases"],
+        profile.get("sleep_time", 300),
+        profile.get("powerdown_method", "TPL5110"),
+        profile.get("current_model"),
+    )
+    cycle["runtime_h"] = mod_energy.runtime_hours(percent, capacity, cycle)
+    return cycle
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("profiles", help="profiles .json or a device log")
+    parser.add_argument("--capacity", type=float, default=1200.0, help="battery capacity, mAh")
+    parser.add_argument("--percent", type=float, default=100.0, help="battery state of charge, percent")
+    args = parser.parse_args()
+
+    print("{:<28} {:>8} {:>8} {:>10} {:>10} {:>10}".format("profile", "awake s", "radio s", "mAh/cycle", "mWh/cycle", "days"))
+    for profile in load_profiles(args.profiles):
+        cycle = evaluate(profile, args.capacity, args.percent)
+        print("{:<28} {:>8.2f} {:>8.2f} {:>10.4f} {:>10.4f} {:>10.1f}".format(
+            profile.get("name", "?"), cycle["awake_s"], cycle["radio_s"],
+            cycle["charge_mAh"], cycle["energy_mWh"], cycle["runtime_h"] / 24))
+
+
+if __name__ == "__main__":
+    main()
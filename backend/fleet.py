@@ -0,0 +1,160 @@
+'''
+   The fleet's MQTT topic layout and payload formats, shared by the host tools
+
+   Topics are <model>/<node>/<Sensor>/<Metric>, as code.py publishes them from
+   leak_detector_scripts/mod_record.py, which is imported here so the device
+   and the backend can't drift apart. Besides one plain number per topic,
+   <model>/<node>/batch carries a JSON object of suffix -> value and
+   <model>/<node>/lp carries InfluxDB line protocol. <model>/<node>/diag is the
+JSON diagnostics record of an earlier wake (mod_diag.py); its numbers are
+readings of the Diag measurement. <model>/<node>/stats holds the min, max,
+std and sample count of each slot read several times in the wake
+(mod_sampling.py), as <field>_min and so on next to the slot's own field.
+'''
+import json
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "leak_detector_scripts"))
+import mod_record  # noqa: E402
+
+# topic suffix -> (measurement, field, unit)
+SCHEMA = {}
+for _suffix, _unit in zip(mod_record.TOPICS, mod_record.UNITS):
+    _parts = _suffix.split("/", 1)
+    SCHEMA[_suffix] = (_parts[0], _parts[1] if len(_parts) > 1 else "value", _unit)
+
+# device control traffic, not measurements
+IGNORED = ("config", "ota", "logship")
+BATCH = "batch"
+LINE_PROTOCOL = "lp"
+DIAG = "diag"
+STATS = "stats"
+STATS_FIELDS = ("mean", "min", "max", "std", "n")
+
+
+def split_topic(topic):
+    """ (model, node, suffix) or None for topics outside the fleet layout """
+    parts = topic.split("/", 2)
+    # <model>/config and <model>/ota/... are fleet wide, <model>/<node>/config per node
+    if len(parts) < 3 or parts[1] in IGNORED or parts[2].split("/", 1)[0] in IGNORED:
+        return None
+    return parts[0], parts[1], parts[2]
+
+
+def series(suffix):
+    """ (measurement, field) for a topic suffix, unknown ones are split at the first / """
+    known = SCHEMA.get(suffix)
+    if known:
+        return known[0], known[1]
+    parts = suffix.split("/", 1)
+    return parts[0], parts[1].replace("/", "_") if len(parts) > 1 else "value"
+
+
+def is_number(value):
+    # NaN or inf would make InfluxDB reject the whole batch it is in
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def json_object(payload):
+    """ A JSON object payload, anything else is a ValueError like bad JSON """
+    record = json.loads(payload)
+    if not isinstance(record, dict):
+        raise ValueError("expected a JSON object, got {}".format(type(record).__name__))
+    return record
+
+
+def decode(topic, payload):
+    """ Readings in a message as (model, node, measurement, field, value, timestamp or None)
+
+        A malformed payload raises ValueError and nothing else; values that
+        are not numbers (a null for a sensor that failed) are left out.
+    """
+    where = split_topic(topic)
+    if where is None:
+        return []
+    model, node, suffix = where
+    if isinstance(payload, bytes):
+        payload = payload.decode("utf-8", "replace")
+    if suffix == BATCH:
+        record = json_object(payload)
+        ts = record.pop("ts", None)
+        if ts is not None and not is_number(ts):
+            raise ValueError("batch timestamp {!r}".format(ts))
+        return [(model, node) + series(key) + (float(value), ts) for key, value in record.items() if is_number(value)]
+    if suffix == DIAG:
+        record = json_object(payload)
+        return [(model, node, "Diag", key, float(value), None) for key, value in record.items() if is_number(value)]
+    if suffix == STATS:
+        # {suffix: [mean, min, max, std, n]}, the mean is on the slot's own topic already
+        readings = []
+        for key, numbers in json_object(payload).items():
+            if not isinstance(numbers, list):
+                raise ValueError("stats for {} are not a list".format(key))
+            measurement, field = series(key)
+            for name, value in zip(STATS_FIELDS[1:], numbers[1:]):
+                if is_number(value):
+                    readings.append((model, node, measurement, "{}_{}".format(field, name), float(value), None))
+        return readings
+    if suffix == LINE_PROTOCOL:
+        return [(model, node) + reading for reading in parse_line_protocol(payload)]
+    try:
+        value = float(payload)
+    except ValueError:
+        return []
+    if not math.isfinite(value):
+        return []
+    return [(model, node) + series(suffix) + (value, None)]
+
+
+def parse_line_protocol(text):
+    """ (measurement, field, value, timestamp) from simple line protocol, tags are ignored """
+    readings = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        head, _, rest = line.partition(" ")
+        fields, _, ts = rest.partition(" ")
+        measurement = head.split(",", 1)[0]
+        timestamp = int(ts) if ts else None
+        for pair in fields.split(","):
+            key, _, value = pair.partition("=")
+            number = float(value.rstrip("i"))
+            if math.isfinite(number):
+                readings.append((measurement, key, number, timestamp))
+    return readings
+
+
+def encode_batch(values, ts=None):
+    """ {suffix: value} -> the batch payload """
+    record = dict(values)
+    if ts is not None:
+        record["ts"] = ts
+    return json.dumps(record, separators=(",", ":"))
+
+
+def encode_line_protocol(values, ts=None):
+    """ {suffix: value} -> line protocol, one line per measurement """
+    grouped = {}
+    for suffix, value in values.items():
+        measurement, field = series(suffix)
+        grouped.setdefault(measurement, []).append("{}={}".format(field, value))
+    suffix = " {}".format(ts) if ts is not None else ""
+    return "\n".join("{} {}{}".format(m, ",".join(f), suffix) for m, f in grouped.items())
+
+
+def line(measurement, tags, fields, ts):
+    """ One InfluxDB line, ts in seconds """
+    tag_text = "".join(",{}={}".format(k, v) for k, v in sorted(tags.items()))
+    field_text = ",".join("{}={}".format(k, repr(float(v))) for k, v in fields.items())
+    return "{}{} {} {}".format(measurement, tag_text, field_text, int(ts))
+
+
+def mqtt_client(client_id=""):
+    """ A paho-mqtt client with the 1.x callback signatures on paho 1.x or 2.x """
+    import paho.mqtt.client as mqtt
+    if hasattr(mqtt, "CallbackAPIVersion"):
+        return mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id=client_id)
+    return mqtt.Client(client_id=client_id)
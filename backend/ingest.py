@@ -0,0 +1,282 @@
+'''
+   Fleet ingestion: MQTT -> InfluxDB with batching, backpressure and rollups
+
+   Subscribes to +/+/# on mosquitto, decodes plain, batch and line protocol
+   payloads (fleet.py), and writes InfluxDB lines in batches from a writer
+   thread. The queue between them is bounded: when InfluxDB falls behind,
+   the MQTT callback blocks (holding back the broker connection) and only
+   drops readings after --block seconds. Readings are also rolled up with
+   NumPy into 5 minute, hourly and daily mean/min/max/count series
+   (<measurement>_5m, _1h, _1d) once each bucket has closed.
+
+   python3 ingest.py --broker 192.168.1.10 --influx http://192.168.1.10:8086 --db sensors
+   python3 ingest.py --replay captured.txt --standin
+'''
+import argparse
+import queue
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+import numpy as np
+
+import fleet
+import standins
+
+ROLLUPS = (("5m", 300), ("1h", 3600), ("1d", 86400))
+
+
+class InfluxWriter:
+    """ InfluxDB HTTP writes: 1.x with --db, 2.x with --bucket/--org/--token """
+    def __init__(self, url, db=None, bucket=None, org=None, token=None):
+        if bucket:
+            query = urllib.parse.urlencode({"bucket": bucket, "org": org or "", "precision": "s"})
+            self.endpoint = "{}/api/v2/write?{}".format(url.rstrip("/"), query)
+        else:
+            query = urllib.parse.urlencode({"db": db, "precision": "s"})
+            self.endpoint = "{}/write?{}".format(url.rstrip("/"), query)
+        self.headers = {"Content-Type": "text/plain; charset=utf-8"}
+        if token:
+            self.headers["Authorization"] = "Token {}".format(token)
+
+    def write(self, lines):
+        request = urllib.request.Request(self.endpoint, "\n".join(lines).encode(), self.headers)
+        with urllib.request.urlopen(request, timeout=10) as response:
+            response.read()
+
+
+class SeriesIndex:
+    """ Small integer ids for (measurement, field, model, node) so rollups stay in NumPy """
+    def __init__(self):
+        self.ids = {}
+        self.keys = []
+
+    def id(self, key):
+        found = self.ids.get(key)
+        if found is None:
+            found = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+        return found
+
+
+class RollupLevel:
+    """ Buffers (series, time, sum, min, max, count) rows and aggregates closed buckets """
+    def __init__(self, name, period):
+        self.name = name
+        self.period = period
+        self.pending = []
+
+    def add(self, rows):
+        if len(rows[0]):
+            self.pending.append(rows)
+
+    def flush(self, now):
+        """ Aggregate every bucket that ended before now, keep the open ones """
+        if not self.pending:
+            return None
+        series, ts, sums, mins, maxs, counts = (np.concatenate(column) for column in zip(*self.pending))
+        buckets = (ts // self.period).astype(np.int64)
+        closed = (buckets + 1) * self.period <= now
+        self.pending = [tuple(column[~closed] for column in (series, ts, sums, mins, maxs, counts))]
+        if not closed.any():
+            return None
+        return aggregate(series[closed], buckets[closed], sums[closed], mins[closed], maxs[closed], counts[closed], self.period)
+
+
+def aggregate(series, buckets, sums, mins, maxs, counts, period):
+    """ Group rows by (series, bucket) in one sort; returns rows at the bucket start """
+    order = np.lexsort((buckets, series))
+    series, buckets = series[order], buckets[order]
+    starts = np.flatnonzero(np.concatenate(([True], (series[1:] != series[:-1]) | (buckets[1:] != buckets[:-1]))))
+    return (
+        series[starts],
+        (buckets[starts] * period).astype(np.float64),
+        np.add.reduceat(sums[order], starts),
+        np.minimum.reduceat(mins[order], starts),
+        np.maximum.reduceat(maxs[order], starts),
+        np.add.reduceat(counts[order], starts),
+    )
+
+
+class Ingestor:
+    def __init__(self, writer, batch_size=5000, flush_interval=1.0, max_pending=100000, block=5.0):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block = block
+        self.lines = queue.Queue(maxsize=max_pending)
+        self.index = SeriesIndex()
+        self.levels = [RollupLevel(name, period) for name, period in ROLLUPS]
+        self.raw = ([], [], [])   # series ids, times, values since the last rollup
+        self.raw_lock = threading.Lock()
+        self.stats = {"messages": 0, "readings": 0, "written": 0, "dropped": 0, "write_errors": 0, "rollups": 0,
+                      "malformed": 0}
+        self.running = False
+
+    # MQTT side ---------------------------------------------------------------
+    def on_message(self, client, userdata, message):
+        self.ingest(message.topic, message.payload)
+
+    def ingest(self, topic, payload, now=None):
+        self.stats["messages"] += 1
+        try:
+            readings = fleet.decode(topic, payload)
+        except ValueError:
+            # a malformed publish costs that message only, never the MQTT network thread
+            self.stats["malformed"] += 1
+            return
+        if now is None:
+            now = time.time()
+        for model, node, measurement, field, value, ts in readings:
+            ts = now if ts is None else ts
+            self.put(fleet.line(measurement, {"model": model, "node": node}, {field: value}, ts))
+            with self.raw_lock:
+                self.raw[0].append(self.index.id((measurement, field, model, node)))
+                self.raw[1].append(ts)
+                self.raw[2].append(value)
+        self.stats["readings"] += len(readings)
+
+    def put(self, item):
+        try:
+            # blocking here stalls the MQTT network loop, which is the backpressure
+            self.lines.put(item, timeout=self.block)
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    # InfluxDB side -----------------------------------------------------------
+    def drain(self, limit):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < limit:
+            try:
+                batch.append(self.lines.get(timeout=max(deadline - time.monotonic(), 0.0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def write(self, batch):
+        delay = 0.5
+        while True:
+            try:
+                self.writer.write(batch)
+                self.stats["written"] += len(batch)
+                return
+            except Exception:
+                self.stats["write_errors"] += 1
+                if not self.running:
+                    return
+                # the queue keeps filling meanwhile, and the MQTT side feels it
+                time.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+    def writer_loop(self):
+        while self.running or not self.lines.empty():
+            batch = self.drain(self.batch_size)
+            if batch:
+                self.write(batch)
+
+    # rollups ---------------------------------------------------------------
+    def rollup(self, now=None):
+        """ Close 5m, 1h and 1d buckets up to now and queue their lines """
+        if now is None:
+            now = time.time()
+        with self.raw_lock:
+            series, ts, values = (np.asarray(column) for column in self.raw)
+            self.raw = ([], [], [])
+        rows = (series.astype(np.int64), ts.astype(np.float64), values.astype(np.float64),
+                values.astype(np.float64), values.astype(np.float64), np.ones(len(values), np.int64))
+        for level in self.levels:
+            # a level with nothing closed this time still flushes the ones above it
+            if rows is not None:
+                level.add(rows)
+            rows = level.flush(now)
+            if rows is not None:
+                self.emit(level.name, rows)
+        return self.stats["rollups"]
+
+    def emit(self, name, rows):
+        series, ts, sums, mins, maxs, counts = rows
+        means = sums / counts
+        for i in range(len(series)):
+            measurement, field, model, node = self.index.keys[series[i]]
+            fields = {field + "_mean": means[i], field + "_min": mins[i], field + "_max": maxs[i], field + "_count": counts[i]}
+            self.put(fleet.line("{}_{}".format(measurement, name), {"model": model, "node": node}, fields, ts[i]))
+        self.stats["rollups"] += len(series)
+
+    # service -----------------------------------------------------------------
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.writer_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+
+def replay(ingestor, path):
+    """ Feed captured "<unix time> <topic> <payload>" lines, e.g. from mosquitto_sub -v with a timestamp """
+    last = None
+    with open(path) as f:
+        for text in f:
+            parts = text.rstrip("\n").split(" ", 2)
+            if len(parts) < 3:
+                continue
+            now = float(parts[0])
+            ingestor.ingest(parts[1], parts[2], now)
+            if last is None or now - last >= 300:
+                ingestor.rollup(now)
+                last = now
+    ingestor.rollup(float("inf"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--topic", default="+/+/#")
+    parser.add_argument("--influx", default="http://localhost:8086")
+    parser.add_argument("--db", default="sensors", help="InfluxDB 1.x database")
+    parser.add_argument("--bucket", help="InfluxDB 2.x bucket, with --org and --token")
+    parser.add_argument("--org")
+    parser.add_argument("--token")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--max-pending", type=int, default=100000)
+    parser.add_argument("--block", type=float, default=5.0, help="seconds a full queue holds MQTT before dropping")
+    parser.add_argument("--standin", action="store_true", help="write to memory instead of InfluxDB")
+    parser.add_argument("--replay", help="ingest a captured file instead of subscribing")
+    args = parser.parse_args()
+
+    if args.standin:
+        writer = standins.MemoryWriter()
+    else:
+        writer = InfluxWriter(args.influx, args.db, args.bucket, args.org, args.token)
+    ingestor = Ingestor(writer, args.batch_size, max_pending=args.max_pending, block=args.block)
+    ingestor.start()
+
+    if args.replay:
+        started = time.monotonic()
+        replay(ingestor, args.replay)
+        ingestor.stop()
+        print("{} in {:.2f}s".format(ingestor.stats, time.monotonic() - started))
+        return
+
+    client = fleet.mqtt_client("fleet-ingest")
+    client.on_message = ingestor.on_message
+    client.on_connect = lambda client, userdata, flags, rc: client.subscribe(args.topic)
+    client.connect(args.broker, args.port)
+    client.loop_start()
+    try:
+        while True:
+            time.sleep(60)
+            ingestor.rollup()
+            print(ingestor.stats)
+    except KeyboardInterrupt:
+        pass
+    client.loop_stop()
+    ingestor.stop()
+
+
+if __name__ == "__main__":
+    main()
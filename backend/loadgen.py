@@ -0,0 +1,212 @@
+'''
+   Fleet load generator: many simulated QtPys against the broker
+
+   Every virtual node wakes like code.py does: connect, subscribe to the two
+   config topics and wait for retained messages, publish the sensor slots,
+   wait upload_wait, publish the energy slots and disconnect, then sleeps
+   its interval with some jitter. Topics and payloads come from
+   leak_detector_scripts/mod_record.py through fleet.py, so they are exactly
+   what the nodes send. A monitor subscribed to <model>/+/# counts what
+   arrives, giving message loss next to throughput and connect latency.
+
+   metric   one topic per reading, as code.py publishes today
+   batch    one JSON message per publish step on <model>/<node>/batch
+   lp       one line protocol message per publish step on <model>/<node>/lp
+
+   python3 loadgen.py --broker 192.168.1.10 --nodes 300 --interval 30 --duration 300
+   python3 loadgen.py --standin --nodes 500 --formats metric,batch,lp
+   python3 loadgen.py --standin --nodes 500 --aligned       # every node wakes at once
+'''
+import argparse
+import asyncio
+import math
+import random
+import struct
+import time
+
+import fleet
+import mod_record
+import mqtt_async
+import standins
+
+# the slots a QtPy with the BFF, SHT40 and soil probe fills, before and after upload_wait
+SENSOR_SLOTS = (mod_record.RESET_REASON, mod_record.SHT40_TEMP, mod_record.SHT40_HUM, mod_record.BFF_VOLTAGE,
+                mod_record.SOIL_MOISTURE, mod_record.BATTERY_VOLTAGE, mod_record.CPU_TEMP)
+ENERGY_SLOTS = (mod_record.ENERGY_AWAKE, mod_record.ENERGY_RADIO, mod_record.ENERGY_CYCLE, mod_record.ENERGY_RUNTIME)
+FORMATS = ("metric", "batch", "lp")
+
+
+def float32(value):
+    """ The value as the node's array('f') slot holds it, so payload sizes match """
+    return struct.unpack("f", struct.pack("f", value))[0]
+
+
+def slot_values(rng, slots, node):
+    readings = {
+        mod_record.RESET_REASON: 1,
+        mod_record.SHT40_TEMP: 70.0 + rng.gauss(0, 2),
+        mod_record.SHT40_HUM: 45.0 + rng.gauss(0, 3),
+        mod_record.BFF_VOLTAGE: 4.0 + rng.gauss(0, 0.05),
+        mod_record.SOIL_MOISTURE: 20.0 + rng.gauss(0, 1),
+        mod_record.BATTERY_VOLTAGE: 12.6 + rng.gauss(0, 0.02),
+        mod_record.CPU_TEMP: 95.0 + rng.gauss(0, 2),
+        mod_record.ENERGY_AWAKE: 7.5 + rng.random(),
+        mod_record.ENERGY_RADIO: 6.0 + rng.random(),
+        mod_record.ENERGY_CYCLE: 0.9 + rng.random() / 10,
+        mod_record.ENERGY_RUNTIME: 400.0 + node % 50,
+    }
+    return {mod_record.TOPICS[slot]: float32(readings[slot]) for slot in slots}
+
+
+def messages(fmt, prefix, values):
+    """ (topic, payload) list for one publish step in the given format """
+    if fmt == "batch":
+        return [(prefix + "/" + fleet.BATCH, fleet.encode_batch(values))]
+    if fmt == "lp":
+        return [(prefix + "/" + fleet.LINE_PROTOCOL, fleet.encode_line_protocol(values))]
+    # MiniMQTT sends str() of the float
+    return [("{}/{}".format(prefix, suffix), str(value)) for suffix, value in values.items()]
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return math.nan
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Stats:
+    def __init__(self):
+        self.wakes = 0
+        self.failed = 0
+        self.messages = 0
+        self.bytes = 0
+        self.readings = 0
+        self.received_messages = 0
+        self.received_readings = 0
+        self.connect_latency = []
+        self.wake_time = []
+
+    def on_message(self, topic, payload):
+        readings = fleet.decode(topic, payload)
+        if readings:
+            self.received_messages += 1
+            self.received_readings += len(readings)
+
+    def report(self, fmt, seconds):
+        connect = sorted(self.connect_latency)
+        wake = sorted(self.wake_time)
+        lost = self.readings - self.received_readings
+        return {
+            "format": fmt,
+            "wakes": self.wakes,
+            "failed": self.failed,
+            "messages": self.messages,
+            "bytes": self.bytes,
+            "readings": self.readings,
+            "lost": lost,
+            "loss_pct": 100.0 * lost / self.readings if self.readings else 0.0,
+            "msg_per_s": self.messages / seconds,
+            "readings_per_s": self.received_readings / seconds,
+            "connect_ms": [round(1000 * percentile(connect, p), 1) for p in (0.5, 0.95, 0.99, 1.0)],
+            "wake_s": [round(percentile(wake, p), 2) for p in (0.5, 0.95)],
+        }
+
+
+async def wake(args, stats, rng, fmt, node, number):
+    prefix = "{}/{}".format(args.model, node)
+    client = mqtt_async.Client("cpy-{}-{}".format(node, number))
+    started = time.perf_counter()
+    try:
+        stats.connect_latency.append(await client.connect(args.broker, args.port))
+        for topic in ("{}/config".format(args.model), "{}/config".format(prefix)):
+            await client.subscribe(topic)
+        await asyncio.sleep(args.config_wait)
+        for slots, wait in ((SENSOR_SLOTS, args.upload_wait), (ENERGY_SLOTS, 0)):
+            values = slot_values(rng, slots, node)
+            for topic, payload in messages(fmt, prefix, values):
+                await client.publish(topic, payload, args.qos)
+                stats.messages += 1
+                stats.bytes += len(topic) + len(payload)
+            stats.readings += len(values)
+            await asyncio.sleep(wait)
+        stats.wakes += 1
+        stats.wake_time.append(time.perf_counter() - started)
+    except (OSError, ConnectionError, asyncio.TimeoutError):
+        stats.failed += 1
+    finally:
+        await client.disconnect()
+
+
+async def virtual_node(args, stats, fmt, node, until):
+    rng = random.Random(node)
+    # powered up together they all start at once, otherwise anywhere in the interval
+    delay = 0.0 if args.aligned else rng.uniform(0, args.interval)
+    number = 0
+    while time.monotonic() + delay < until:
+        await asyncio.sleep(delay)
+        started = time.monotonic()
+        await wake(args, stats, rng, fmt, node, number)
+        number += 1
+        # a TPL5110 restarts its interval when DONE goes high, so the wake time adds to it
+        delay = args.interval * (1 + rng.uniform(-args.jitter, args.jitter))
+        if not args.tpl5110:
+            delay -= time.monotonic() - started
+
+
+async def run(args, fmt):
+    stats = Stats()
+    monitor = mqtt_async.Client("loadgen-monitor")
+    monitor.on_message = stats.on_message
+    await monitor.connect(args.broker, args.port)
+    await monitor.subscribe("{}/+/#".format(args.model))
+    started = time.monotonic()
+    until = started + args.duration
+    await asyncio.gather(*(virtual_node(args, stats, fmt, node, until) for node in range(args.nodes)))
+    seconds = time.monotonic() - started
+    # give the broker a moment to deliver what is still in flight
+    await asyncio.sleep(args.drain)
+    await monitor.disconnect()
+    return stats.report(fmt, seconds)
+
+
+async def main_async(args):
+    broker = None
+    if args.standin:
+        broker = standins.AsyncBroker()
+        args.port = await broker.start()
+        args.broker = "127.0.0.1"
+    reports = []
+    for fmt in args.formats.split(","):
+        reports.append(await run(args, fmt))
+        print(reports[-1])
+    if broker:
+        await broker.stop()
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--model", default="qtpy")
+    parser.add_argument("--nodes", type=int, default=100)
+    parser.add_argument("--interval", type=float, default=30.0, help="seconds between wakes, SLEEP_TIME on the nodes")
+    parser.add_argument("--jitter", type=float, default=0.1, help="fraction of the interval each sleep varies by")
+    parser.add_argument("--aligned", action="store_true", help="all nodes wake together at the start")
+    parser.add_argument("--tpl5110", action="store_true", help="wake time adds to the interval, as with the TPL5110")
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--config-wait", type=float, default=1.0, help="the loop(1) after the config subscribe")
+    parser.add_argument("--upload-wait", type=float, default=5.0, help="UPLOAD_WAIT on the nodes")
+    parser.add_argument("--qos", type=int, choices=(0, 1), default=0)
+    parser.add_argument("--formats", default="metric", help="comma separated: " + ", ".join(FORMATS))
+    parser.add_argument("--drain", type=float, default=2.0, help="seconds to wait for in-flight messages")
+    parser.add_argument("--standin", action="store_true", help="run against an in-process broker")
+    args = parser.parse_args()
+    for fmt in args.formats.split(","):
+        if fmt not in FORMATS:
+            parser.error("unknown format {}".format(fmt))
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+'''
+   Reassembles the SD files nodes ship over MQTT (leak_detector_scripts/mod_logship.py)
+
+   Each chunk on <model>/<node>/logship/<name> is a sequence number and a
+   file offset, then the bytes, and lands at that offset in
+   <out>/<model>/<node>/<name>. A chunk already there (its PUBACK was lost
+   and the node sent it again) is ignored. A chunk at offset 0 that differs
+   from what is there means the node started the file over, so the old copy
+   is kept as <name>.1, .2 ... first. Offsets past the end leave a gap, which
+   is counted.
+
+   --standin ships files from a scratch directory through mod_logship over
+   several wakes, losing acknowledgements and rotating the log on the way,
+   and checks the reassembled copies against the originals.
+
+   python3 logship.py --broker 192.168.1.10 --out logs
+   python3 logship.py --standin --wakes 30 --chunks 8 --loss 0.1
+'''
+import argparse
+import os
+import random
+import shutil
+import struct
+import tempfile
+import time
+
+import fleet
+import mod_logship
+import standins
+
+TOPIC = "+/+/logship/#"
+
+
+class Reassembler:
+    def __init__(self, out):
+        self.out = out
+        self.chunks = 0
+        self.duplicates = 0
+        self.gaps = 0
+        self.rotations = 0
+        self.errors = 0
+
+    def path_for(self, topic):
+        """ Local path of a logship topic, or None if it is not one """
+        parts = topic.split("/", 3)
+        if len(parts) < 4 or parts[2] != "logship":
+            return None
+        # anyone who can publish picks these names, nothing may land outside out
+        for level in parts[:2]:
+            if level in ("", ".", "..") or os.sep in level or (os.altsep and os.altsep in level):
+                return None
+        name = os.path.normpath(parts[3])
+        if name.startswith("..") or os.path.isabs(name):
+            return None
+        path = os.path.join(self.out, parts[0], parts[1], name)
+        root = os.path.realpath(self.out)
+        if os.path.commonpath([root, os.path.realpath(path)]) != root:
+            return None
+        return path
+
+    def rotate(self, path):
+        number = 1
+        while os.path.exists("{}.{}".format(path, number)):
+            number += 1
+        os.rename(path, "{}.{}".format(path, number))
+        self.rotations += 1
+
+    def handle(self, topic, payload):
+        """ Put one chunk in place; returns the local path, or None for a payload that is not a chunk """
+        path = self.path_for(topic)
+        if path is None or len(payload) < mod_logship.HEADER_SIZE:
+            return None
+        seq, offset = struct.unpack(mod_logship.HEADER, payload[:mod_logship.HEADER_SIZE])
+        data = payload[mod_logship.HEADER_SIZE:]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if offset < size:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                there = f.read(len(data))
+            if there == data:
+                self.duplicates += 1
+                return path
+            if offset == 0:
+                self.rotate(path)
+                size = 0
+        elif offset > size:
+            self.gaps += 1
+        with open(path, "r+b" if size else "wb") as f:
+            f.seek(offset)
+            f.write(data)
+        self.chunks += 1
+        return path
+
+    def on_message(self, client, userdata, message):
+        try:
+            self.handle(message.topic, message.payload)
+        except OSError as ex:
+            # a full disk or a name the filesystem refuses costs this chunk, not paho's network thread
+            self.errors += 1
+            print("{}: {}".format(message.topic, ex))
+
+
+def read(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def standin(args):
+    """ Ship a scratch SD through mod_logship to a MemoryBroker over several wakes and compare """
+    rng = random.Random(args.seed)
+    scratch = tempfile.mkdtemp(prefix="logship-")
+    sd = os.path.join(scratch, "sd")
+    out = os.path.join(scratch, "out")
+    os.makedirs(sd)
+    broker = standins.MemoryBroker()
+    monitor = standins.MemoryClient(broker)
+    reassembler = Reassembler(out)
+    monitor.on_message = reassembler.on_message
+    monitor.subscribe(TOPIC)
+    node = standins.MemoryClient(broker)
+    state_path = os.path.join(sd, "logship.json")
+    log = os.path.join(sd, "testlog.log")
+    archive = os.path.join(sd, "archive.csv")
+    with open(archive, "wb") as f:
+        f.write(bytes(rng.randrange(256) for _ in range(args.chunk * 5 + 17)))
+    history = {}                # what the live log held in each generation, for the check
+    generation = 0
+    lost = 0
+    unsent = 0
+
+    def publish(name, payload):
+        nonlocal lost
+        node.publish("{}/{}/logship/{}".format(args.model, args.node, name), payload, qos=1)
+        if rng.random() < args.loss:
+            # the broker has it, the node never hears back and sends it again
+            lost += 1
+            raise OSError("no PUBACK")
+
+    for wake in range(args.wakes):
+        if wake == max(1, args.wakes // 2):
+            # the log is started over half way
+            history[generation] = read(log)
+            unsent = mod_logship.backlog({log: [len(history[generation]), 0]})
+            generation += 1
+            os.remove(log)
+        with open(log, "a") as f:
+            for line in range(rng.randrange(5, 40)):
+                f.write("wake {} line {} reading {:.3f}\n".format(wake, line, rng.random()))
+        files = {}
+        for name in os.listdir(sd):
+            path = os.path.join(sd, name)
+            if path != state_path:
+                stats = os.stat(path)
+                files[path] = [stats.st_size, int(stats.st_mtime) if path != log else 1 << 31]
+        mod_logship.load(state_path)
+        try:
+            mod_logship.ship(publish, files, args.chunk, args.chunks, args.budget)
+        except OSError:
+            pass
+        mod_logship.save(state_path)
+    # the last wakes have nothing new to write and ship out the rest
+    for _ in range(args.wakes):
+        mod_logship.load(state_path)
+        files = {path: [os.path.getsize(path), 0] for path in (archive, log)}
+        if not mod_logship.backlog(files):
+            break
+        mod_logship.ship(lambda name, payload: node.publish(
+            "{}/{}/logship/{}".format(args.model, args.node, name), payload, qos=1), files, args.chunk, args.chunks, args.budget)
+        mod_logship.save(state_path)
+    history[generation] = read(log)
+
+    copies = os.path.join(out, args.model, str(args.node))
+    matches = {"archive.csv": read(os.path.join(copies, "archive.csv")) == read(archive),
+               "testlog.log": read(os.path.join(copies, "testlog.log")) == history[generation]}
+    if generation:
+        matches["testlog.log.1"] = read(os.path.join(copies, "testlog.log.1")) == history[0]
+    print("{} chunks, {} bytes shipped in {} wakes; {} acknowledgements lost".format(
+        mod_logship.stats["chunks"], mod_logship.stats["bytes"], args.wakes, lost))
+    print("reassembled {} chunks, {} duplicates ignored, {} rotations, {} gaps".format(
+        reassembler.chunks, reassembler.duplicates, reassembler.rotations, reassembler.gaps))
+    print("copies match the SD files: {}".format(", ".join("{} {}".format(name, ok) for name, ok in matches.items())))
+    if unsent:
+        print("{} bytes of the first log were not shipped before it was replaced".format(unsent))
+    shutil.rmtree(scratch)
+    return all(matches.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--out", default="logship", help="directory the files are rebuilt in")
+    parser.add_argument("--standin", action="store_true", help="ship a scratch SD card through an in-memory broker")
+    parser.add_argument("--model", default="qtpy")
+    parser.add_argument("--node", type=int, default=42)
+    parser.add_argument("--wakes", type=int, default=30)
+    parser.add_argument("--chunk", type=int, default=512, help="LOGSHIP_CHUNK on the nodes")
+    parser.add_argument("--chunks", type=int, default=4, help="LOGSHIP_CHUNKS on the nodes")
+    parser.add_argument("--budget", type=float, default=10.0, help="LOGSHIP_BUDGET on the nodes")
+    parser.add_argument("--loss", type=float, default=0.1, help="fraction of chunks whose PUBACK is lost")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.standin:
+        standin(args)
+        return
+    reassembler = Reassembler(args.out)
+    client = fleet.mqtt_client("logship")
+    client.on_message = reassembler.on_message
+    client.connect(args.broker, args.port)
+    client.subscribe(TOPIC, qos=1)
+    client.loop_start()
+    try:
+        while True:
+            time.sleep(60)
+            print("{} chunks, {} duplicates, {} rotations, {} gaps, {} errors".format(
+                reassembler.chunks, reassembler.duplicates, reassembler.rotations, reassembler.gaps, reassembler.errors))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+'''
+   LoRa gateway: frames from TRANSPORT = "lora" nodes -> the usual MQTT topics
+
+   A node on LoRa sends its whole record as one leak_detector_scripts/mod_frame.py
+   frame. Each frame is decoded with the same table and every reading is
+   republished as a plain number on <model>/<node>/<Sensor>/<Metric>, so
+   ingest.py, anomaly.py and Grafana see a LoRa node like any other. The
+   gateway adds LoRa/RSSI and LoRa/Lost (frames missing from the sequence).
+
+   python3 lora_gateway.py --broker 192.168.1.10 --frequency 915.0     # RFM9x bonnet on the RP400
+   python3 lora_gateway.py --standin --nodes 50 --wakes 20 --loss 0.05
+'''
+import argparse
+import random
+import time
+
+import fleet
+import mod_frame
+import mod_record
+import standins
+
+RSSI = "LoRa/RSSI"
+LOST = "LoRa/Lost"
+
+
+class Gateway:
+    """ Decodes frames and publishes their readings with a paho-shaped client """
+    def __init__(self, client):
+        self.client = client
+        self.last_seq = {}      # (model, node) -> sequence number of the last frame
+        self.frames = 0
+        self.bad = 0
+        self.duplicates = 0
+        self.lost = 0
+        self.published = 0
+
+    def publish(self, topic, value):
+        self.client.publish(topic, "{}".format(value))
+        self.published += 1
+
+    def handle(self, frame, rssi=None):
+        """ Republish one frame; returns (model, node, readings by slot) or None if it was not ours or a repeat """
+        try:
+            model, node, seq, readings = mod_frame.decode(frame)
+        except ValueError:
+            self.bad += 1
+            return None
+        last = self.last_seq.get((model, node))
+        if seq == last:
+            # the same frame heard twice, not 255 lost ones
+            self.duplicates += 1
+            return None
+        self.frames += 1
+        prefix = "{}/{}".format(model, node)
+        for slot, value in readings.items():
+            self.publish("{}/{}".format(prefix, mod_record.TOPICS[slot]), value)
+        if rssi is not None:
+            self.publish("{}/{}".format(prefix, RSSI), rssi)
+        if last is not None:
+            # a reboot of the gateway or a node restarts the count, nothing is negative
+            gap = (seq - last - 1) & 0xFF
+            self.lost += gap
+            self.publish("{}/{}".format(prefix, LOST), gap)
+        self.last_seq[(model, node)] = seq
+        return model, node, readings
+
+    def run(self, radio, until=None):
+        while until is None or time.monotonic() < until:
+            frame = radio.receive(timeout=1.0)
+            if frame is None:
+                continue
+            self.handle(bytes(frame), radio.last_rssi)
+
+
+def open_radio(frequency, cs_pin, reset_pin):
+    """ adafruit_rfm9x on Blinka, e.g. the RFM9x bonnet: CE1 and D25 """
+    import board
+    import busio
+    import digitalio
+    import adafruit_rfm9x
+    spi = busio.SPI(board.SCK, MOSI=board.MOSI, MISO=board.MISO)
+    cs = digitalio.DigitalInOut(getattr(board, cs_pin))
+    reset = digitalio.DigitalInOut(getattr(board, reset_pin))
+    return adafruit_rfm9x.RFM9x(spi, cs, reset, frequency)
+
+
+def simulated_record(rng, node):
+    """ The slots a QtPy with the BFF, SHT40 and soil probe fills """
+    values = [mod_record.NAN] * len(mod_record.TOPICS)
+    values[mod_record.RESET_REASON] = 1
+    values[mod_record.SHT40_TEMP] = 70.0 + rng.gauss(0, 2)
+    values[mod_record.SHT40_HUM] = 45.0 + rng.gauss(0, 3)
+    values[mod_record.BFF_VOLTAGE] = 4.0 + rng.gauss(0, 0.05)
+    values[mod_record.SOIL_MOISTURE] = 20.0 + rng.gauss(0, 1)
+    values[mod_record.BATTERY_VOLTAGE] = 12.6 + rng.gauss(0, 0.02)
+    values[mod_record.CPU_TEMP] = 95.0 + rng.gauss(0, 2)
+    values[mod_record.ENERGY_AWAKE] = 3.0 + rng.random()
+    values[mod_record.ENERGY_CYCLE] = 0.2 + rng.random() / 10
+    values[mod_record.ENERGY_RUNTIME] = 900.0 + node % 50
+    return values
+
+
+def simulate(args):
+    """ Nodes sending over a lossy RadioLink, the gateway into a MemoryBroker; checks the round trip """
+    rng = random.Random(args.seed)
+    link = standins.RadioLink(args.loss, seed=args.seed)
+    broker = standins.MemoryBroker()
+    gateway = Gateway(standins.MemoryClient(broker))
+    sizes = []
+    worst = 0.0
+    for wake in range(args.wakes):
+        originals = {}
+        for node in range(1, args.nodes + 1):
+            originals[node] = simulated_record(rng, node)
+            frame, dropped = mod_frame.encode(args.model, node, wake, originals[node])
+            sizes.append(len(frame))
+            link.send(frame)
+        while link.frames:
+            handled = gateway.handle(link.receive(), link.last_rssi)
+            if handled is None:
+                continue
+            model, node, readings = handled
+            # what reached the broker against what the node measured, in quantization steps
+            for slot, value in readings.items():
+                worst = max(worst, abs(value - originals[node][slot]) / mod_frame.QUANTA[slot][1])
+    print("{} frames sent, {} lost on the link, {} decoded, {} bad, {} repeats".format(link.sent, link.lost, gateway.frames,
+                                                                                        gateway.bad, gateway.duplicates))
+    print("frame size {}..{} bytes (limit {}), {} readings republished".format(min(sizes), max(sizes), mod_frame.MAX_FRAME,
+                                                                                gateway.published))
+    print("gateway counted {} lost frames from the sequence numbers".format(gateway.lost))
+    print("worst round trip error {:.2f} quantization steps".format(worst))
+    return gateway
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--frequency", type=float, default=915.0, help="MHz, LORA_FREQUENCY on the nodes")
+    parser.add_argument("--cs", default="CE1", help="Blinka pin of the RFM9x chip select")
+    parser.add_argument("--reset", default="D25", help="Blinka pin of the RFM9x reset")
+    parser.add_argument("--standin", action="store_true", help="simulated nodes and radio link, in-memory broker")
+    parser.add_argument("--model", default="qtpy")
+    parser.add_argument("--nodes", type=int, default=20)
+    parser.add_argument("--wakes", type=int, default=10)
+    parser.add_argument("--loss", type=float, default=0.05, help="fraction of frames the simulated link drops")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.standin:
+        simulate(args)
+        return
+    client = fleet.mqtt_client("lora-gateway")
+    client.connect(args.broker, args.port)
+    client.loop_start()
+    gateway = Gateway(client)
+    try:
+        gateway.run(open_radio(args.frequency, args.cs, args.reset))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("{} frames, {} lost, {} bad, {} readings published".format(gateway.frames, gateway.lost, gateway.bad,
+                                                                          gateway.published))
+        client.loop_stop()
+        client.disconnect()
+
+
+if __name__ == "__main__":
+    main()
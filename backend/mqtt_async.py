@@ -0,0 +1,163 @@
+'''
+   Just enough MQTT 3.1.1 over asyncio streams for the load generator
+
+   paho-mqtt runs a thread per client, which is fine for one service but not
+   for hundreds of simulated nodes. This speaks CONNECT, SUBSCRIBE, PUBLISH
+   (QoS 0 and 1), PINGREQ and DISCONNECT from a single event loop. A
+   connected client pings every half keep-alive, so one that only listens
+   stays connected.
+'''
+import asyncio
+import struct
+import time
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 12, 13, 14
+
+
+def encode_length(length):
+    out = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        out.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(out)
+
+
+def encode_string(text):
+    data = text.encode() if isinstance(text, str) else text
+    return struct.pack("!H", len(data)) + data
+
+
+def packet(kind, flags, body):
+    return bytes(((kind << 4) | flags,)) + encode_length(len(body)) + body
+
+
+async def read_packet(reader):
+    """ (type, flags, body), raises asyncio.IncompleteReadError at EOF """
+    first = (await reader.readexactly(1))[0]
+    length = 0
+    shift = 0
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+    body = await reader.readexactly(length) if length else b""
+    return first >> 4, first & 0x0F, body
+
+
+def parse_publish(flags, body):
+    """ (topic, payload, packet id or None) """
+    size = struct.unpack("!H", body[:2])[0]
+    topic = body[2:2 + size].decode()
+    rest = body[2 + size:]
+    if (flags >> 1) & 3:
+        return topic, rest[2:], struct.unpack("!H", rest[:2])[0]
+    return topic, rest, None
+
+
+class Client:
+    def __init__(self, client_id, keep_alive=60):
+        self.client_id = client_id
+        self.keep_alive = keep_alive
+        self.reader = None
+        self.writer = None
+        self.on_message = None
+        self.next_id = 0
+        self.waiting = {}
+        self.task = None
+        self.pinger = None
+        self.pings = 0
+
+    async def connect(self, host, port=1883, timeout=10.0):
+        """ Returns the seconds from TCP connect to CONNACK """
+        started = time.perf_counter()
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        body = encode_string("MQTT") + bytes((4, 0x02)) + struct.pack("!H", self.keep_alive) + encode_string(self.client_id)
+        self.writer.write(packet(CONNECT, 0, body))
+        kind, _, reply = await asyncio.wait_for(read_packet(self.reader), timeout)
+        if kind != CONNACK or reply[1] != 0:
+            raise ConnectionError("connection refused: {}".format(reply[1] if len(reply) > 1 else kind))
+        self.task = asyncio.ensure_future(self.read_loop())
+        if self.keep_alive:
+            self.pinger = asyncio.ensure_future(self.ping_loop())
+        return time.perf_counter() - started
+
+    async def ping_loop(self):
+        """ PINGREQ every half keep-alive, a client that only receives is dropped by the broker otherwise """
+        try:
+            while True:
+                await asyncio.sleep(self.keep_alive / 2)
+                self.writer.write(packet(PINGREQ, 0, b""))
+                await self.writer.drain()
+                self.pings += 1
+        except (ConnectionError, OSError):
+            pass
+
+    def packet_id(self):
+        self.next_id = self.next_id % 65535 + 1
+        return self.next_id
+
+    async def read_loop(self):
+        try:
+            while True:
+                kind, flags, body = await read_packet(self.reader)
+                if kind == PUBLISH:
+                    topic, payload, pid = parse_publish(flags, body)
+                    if pid is not None:
+                        self.writer.write(packet(PUBACK, 0, struct.pack("!H", pid)))
+                    if self.on_message:
+                        self.on_message(topic, payload)
+                elif kind in (PUBACK, SUBACK):
+                    future = self.waiting.pop(struct.unpack("!H", body[:2])[0], None)
+                    if future and not future.done():
+                        future.set_result(True)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if self.pinger:
+                self.pinger.cancel()
+            for future in self.waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("connection closed"))
+            self.waiting.clear()
+
+    async def acked(self, pid, data, timeout):
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[pid] = future
+        self.writer.write(data)
+        await asyncio.wait_for(future, timeout)
+
+    async def subscribe(self, topic_filter, qos=0, timeout=10.0):
+        pid = self.packet_id()
+        body = struct.pack("!H", pid) + encode_string(topic_filter) + bytes((qos,))
+        await self.acked(pid, packet(SUBSCRIBE, 0x02, body), timeout)
+
+    async def publish(self, topic, payload, qos=0, retain=False, timeout=10.0):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        flags = (qos << 1) | (1 if retain else 0)
+        if qos:
+            pid = self.packet_id()
+            await self.acked(pid, packet(PUBLISH, flags, encode_string(topic) + struct.pack("!H", pid) + payload), timeout)
+        else:
+            self.writer.write(packet(PUBLISH, flags, encode_string(topic) + payload))
+            await self.writer.drain()
+
+    async def disconnect(self):
+        if self.writer is None:
+            return
+        try:
+            self.writer.write(packet(DISCONNECT, 0, b""))
+            await self.writer.drain()
+            self.writer.close()
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+        for task in (self.pinger, self.task):
+            if task:
+                task.cancel()
+        self.writer = None
@@ -0,0 +1,287 @@
+'''
+   MQTT-SN gateway: UDP datagrams from TRANSPORT = "mqttsn" nodes -> mosquitto
+
+   Nodes publish to predefined topic ids (leak_detector_scripts/mod_mqttsn.py):
+   the model's index in the high byte, the mod_record slot in the low byte,
+   0xFE for diag. The gateway turns an id into <model>/<octet>/<suffix>,
+   the octet being the last byte of the sender's address as with MQTT, and
+   forwards the payload to the broker. QoS -1 datagrams need no session;
+   QoS 1 nodes get CONNACK and PUBACKs, with duplicates of a retried
+   message id forwarded once.
+
+   --bench times wakes of the same readings through both paths against
+   in-process servers with an emulated network round trip: the TCP + MQTT
+   session code.py runs with adafruit_minimqtt, and mod_mqttsn itself.
+
+   python3 mqttsn_gateway.py --broker 192.168.1.10 --listen 0.0.0.0 --udp-port 1885
+   python3 mqttsn_gateway.py --bench --wakes 20 --rtt 30 --qos -1
+'''
+import argparse
+import asyncio
+import socket
+import threading
+import time
+
+import fleet
+import mod_frame
+import mod_mqttsn
+import mod_record
+import mqtt_async
+import standins
+
+DIAG = "diag"
+
+
+def topic_for(topic_id, host):
+    """ The broker topic of a predefined id from a node at host, or None if unknown """
+    model_index, slot = topic_id >> 8, topic_id & 0xFF
+    if model_index >= len(mod_frame.MODELS):
+        return None
+    if slot == mod_mqttsn.DIAG_SLOT:
+        suffix = DIAG
+    elif slot < len(mod_record.TOPICS):
+        suffix = mod_record.TOPICS[slot]
+    else:
+        return None
+    return "{}/{}/{}".format(mod_frame.MODELS[model_index], host.split(".")[-1], suffix)
+
+
+def parse(data):
+    """ (type, body) of an MQTT-SN packet, or None """
+    if len(data) >= 4 and data[0] == 1:
+        length = int.from_bytes(data[1:3], "big")
+        if length == len(data):
+            return data[3], data[4:]
+    elif len(data) >= 2 and data[0] == len(data):
+        return data[1], data[2:]
+    return None
+
+
+class Gateway(asyncio.DatagramProtocol):
+    """ MQTT-SN over UDP in, paho-shaped publish() out """
+    def __init__(self, client, delay=0.0):
+        self.client = client
+        self.delay = delay          # seconds each way, the emulated network
+        self.transport = None
+        self.seen = {}              # (address, message id) -> time, for DUP retries
+        self.forwarded = 0
+        self.bad = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def reply(self, data, address):
+        if self.delay:
+            asyncio.get_running_loop().call_later(self.delay, self.transport.sendto, data, address)
+        else:
+            self.transport.sendto(data, address)
+
+    def datagram_received(self, data, address):
+        if self.delay:
+            asyncio.get_running_loop().call_later(self.delay, self.handle, data, address)
+        else:
+            self.handle(data, address)
+
+    def handle(self, data, address):
+        found = parse(data)
+        if found is None:
+            self.bad += 1
+            return
+        kind, body = found
+        if kind == mod_mqttsn.CONNECT:
+            self.reply(mod_mqttsn.packet(mod_mqttsn.CONNACK, b"\x00"), address)
+        elif kind == mod_mqttsn.DISCONNECT:
+            self.reply(mod_mqttsn.packet(mod_mqttsn.DISCONNECT, b""), address)
+        elif kind == mod_mqttsn.PUBLISH and len(body) >= 5:
+            flags = body[0]
+            topic_id = int.from_bytes(body[1:3], "big")
+            message_id = int.from_bytes(body[3:5], "big")
+            qos = (flags >> 5) & 3
+            topic = topic_for(topic_id, address[0]) if flags & 3 == mod_mqttsn.PREDEFINED else None
+            code = 0 if topic else 2   # 2: invalid topic id
+            duplicate = qos == 1 and (address, message_id) in self.seen
+            if topic and not duplicate:
+                self.client.publish(topic, body[5:], qos=1 if qos == 1 else 0, retain=bool(flags & mod_mqttsn.RETAIN))
+                self.forwarded += 1
+            if qos == 1:
+                self.seen[(address, message_id)] = time.monotonic()
+                self.reply(mod_mqttsn.packet(mod_mqttsn.PUBACK, body[1:5] + bytes((code,))), address)
+            if len(self.seen) > 10000:
+                cutoff = time.monotonic() - 60
+                self.seen = {key: at for key, at in self.seen.items() if at > cutoff}
+        else:
+            self.bad += 1
+
+
+async def serve(client, host, port, delay=0.0):
+    loop = asyncio.get_running_loop()
+    transport, gateway = await loop.create_datagram_endpoint(lambda: Gateway(client, delay), local_addr=(host, port))
+    return transport, gateway
+
+
+class DelayProxy:
+    """ TCP in front of a broker, each direction delayed by half the round trip """
+    def __init__(self, target_port, delay):
+        self.target_port = target_port
+        self.delay = delay
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def pump(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                # scheduled by arrival time, so order is kept and bursts are not serialized
+                loop.call_later(self.delay, writer.write, data)
+        except ConnectionError:
+            pass
+        finally:
+            loop.call_later(self.delay, writer.close)
+
+    async def handle(self, reader, writer):
+        upstream_reader, upstream_writer = await asyncio.open_connection("127.0.0.1", self.target_port)
+        await asyncio.gather(self.pump(reader, upstream_writer), self.pump(upstream_reader, writer))
+
+
+def bench_readings(model):
+    """ A QtPy wake: the sensor slots, then the energy slots """
+    values = {mod_record.RESET_REASON: 1, mod_record.SHT40_TEMP: 70.12, mod_record.SHT40_HUM: 45.3,
+              mod_record.BFF_VOLTAGE: 4.01, mod_record.SOIL_MOISTURE: 20.5, mod_record.BATTERY_VOLTAGE: 12.61,
+              mod_record.CPU_TEMP: 95.2, mod_record.ENERGY_AWAKE: 7.52, mod_record.ENERGY_RADIO: 6.01,
+              mod_record.ENERGY_CYCLE: 0.93, mod_record.ENERGY_RUNTIME: 412.0}
+    for slot in range(len(mod_record.values)):
+        mod_record.values[slot] = values.get(slot, mod_record.NAN)
+    mod_record.set_prefix("{}/1".format(model))
+    return values
+
+
+async def tcp_wake(port, rtt, qos, model):
+    """ What code.py does with adafruit_minimqtt: TCP, CONNECT/CONNACK, PUBLISHes, DISCONNECT """
+    sent = 0
+    round_trips = 2
+    # the TCP handshake happens below the proxy, so it is waited for here
+    await asyncio.sleep(rtt)
+    client = mqtt_async.Client("bench")
+    await client.connect("127.0.0.1", port)
+    sent += 14 + len(client.client_id)
+    for slot in range(len(mod_record.values)):
+        value = mod_record.values[slot]
+        if value == value:
+            payload = "{}".format(value)
+            await client.publish(mod_record.topics[slot], payload, qos=qos)
+            sent += 4 + len(mod_record.topics[slot]) + len(payload) + (2 if qos else 0)
+            round_trips += 1 if qos else 0
+    await client.disconnect()
+    return sent + 2, round_trips
+
+
+def bench(args):
+    """ Wakes through the TCP + MQTT path and the MQTT-SN path; returns both reports """
+    loop = asyncio.new_event_loop()
+    broker = standins.AsyncBroker()
+    memory_broker = standins.MemoryBroker()
+    started = threading.Event()
+    ports = {}
+
+    async def start():
+        broker_port = await broker.start()
+        ports["tcp"] = await DelayProxy(broker_port, args.rtt / 2000).start()
+        transport, gateway = await serve(standins.MemoryClient(memory_broker), "127.0.0.1", 0, args.rtt / 2000)
+        ports["udp"] = transport.get_extra_info("sockname")[1]
+        ports["gateway"] = gateway
+        started.set()
+
+    thread = threading.Thread(target=lambda: (loop.run_until_complete(start()), loop.run_forever()), daemon=True)
+    thread.start()
+    started.wait()
+    readings = len(bench_readings(args.model))
+
+    tcp_times = []
+    for _ in range(args.wakes):
+        t0 = time.perf_counter()
+        tcp_bytes, tcp_trips = asyncio.run(tcp_wake(ports["tcp"], args.rtt / 1000, 1 if args.qos == 1 else 0, args.model))
+        tcp_times.append(time.perf_counter() - t0)
+
+    sn_times = []
+    for key in mod_mqttsn.stats:
+        mod_mqttsn.stats[key] = 0
+    for _ in range(args.wakes):
+        t0 = time.perf_counter()
+        mod_mqttsn.begin(socket, "127.0.0.1", ports["udp"], args.qos, "bench")
+        mod_mqttsn.publish_record(args.model)
+        missing = mod_mqttsn.wait()
+        mod_mqttsn.end()
+        sn_times.append(time.perf_counter() - t0)
+    # QoS -1 is fire and forget, give the last datagrams time to arrive before counting
+    time.sleep(args.rtt / 1000 + 0.2)
+    loop.call_soon_threadsafe(loop.stop)
+
+    reports = [
+        ("mqtt/tcp", sum(tcp_times) / len(tcp_times), tcp_trips, tcp_bytes, broker.published / args.wakes),
+        ("mqtt-sn", sum(sn_times) / len(sn_times), mod_mqttsn.stats["round_trips"] / args.wakes,
+         mod_mqttsn.stats["bytes"] / args.wakes, ports["gateway"].forwarded / args.wakes),
+    ]
+    print("{} readings per wake, {} wakes, {} ms round trip, QoS {}".format(readings, args.wakes, args.rtt, args.qos))
+    for name, seconds, trips, size, delivered in reports:
+        print("{:<9} {:7.1f} ms per wake  {:4.1f} round trips  {:5.0f} bytes sent  {:4.1f} readings delivered".format(
+            name, seconds * 1000, trips, size, delivered))
+    print("mqtt-sn time on the network per wake is {:.0%} of mqtt/tcp".format(reports[1][1] / reports[0][1]))
+    if missing:
+        print("{} QoS 1 readings were never acknowledged".format(missing))
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--listen", default="0.0.0.0")
+    parser.add_argument("--udp-port", type=int, default=1885, help="MQTTSN_PORT on the nodes")
+    parser.add_argument("--standin", action="store_true", help="forward to an in-memory broker and report")
+    parser.add_argument("--bench", action="store_true", help="compare wakes over MQTT/TCP and MQTT-SN")
+    parser.add_argument("--model", default="qtpy")
+    parser.add_argument("--wakes", type=int, default=20)
+    parser.add_argument("--rtt", type=float, default=30.0, help="emulated WiFi round trip in ms for --bench")
+    parser.add_argument("--qos", type=int, choices=(-1, 1), default=-1, help="MQTTSN_QOS for --bench")
+    args = parser.parse_args()
+
+    if args.bench:
+        bench(args)
+        return
+    if args.standin:
+        memory_broker = standins.MemoryBroker()
+        client = standins.MemoryClient(memory_broker)
+    else:
+        client = fleet.mqtt_client("mqttsn-gateway")
+        client.connect(args.broker, args.port)
+        client.loop_start()
+
+    async def run():
+        transport, gateway = await serve(client, args.listen, args.udp_port)
+        try:
+            while True:
+                await asyncio.sleep(60)
+                print("{} readings forwarded, {} bad datagrams".format(gateway.forwarded, gateway.bad))
+        finally:
+            transport.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.standin:
+            print("{} messages on the stand-in broker".format(memory_broker.published))
+        else:
+            client.loop_stop()
+            client.disconnect()
+
+
+if __name__ == "__main__":
+    main()
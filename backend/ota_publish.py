@@ -0,0 +1,131 @@
+'''
+   Publish an OTA module update for the fleet (see leak_detector_scripts/mod_ota.py)
+
+   Chunks go out as retained base64 messages on
+   <model>/ota/chunks/<sha256>/<index>, then the manifest with the hash of
+   every file goes to <model>/ota/manifest. Chunks are addressed by content:
+   a file whose content the last retained manifest already lists is not sent
+   again, and a node that missed versions still finds every file it needs.
+   Nodes fetch only the files that differ from what they run.
+
+   python3 ota_publish.py --broker 192.168.1.10 --version 8.6 ../leak_detector_scripts/mod_*.py
+   python3 ota_publish.py --standin --version 8.6 ../leak_detector_scripts/mod_aht20.py
+'''
+import argparse
+import base64
+import hashlib
+import json
+import os
+import time
+
+import fleet
+import standins
+
+
+def file_entry(path, chunk_size):
+    with open(path, "rb") as f:
+        data = f.read()
+    return data, {
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "size": len(data),
+        "chunks": max(1, (len(data) + chunk_size - 1) // chunk_size),
+    }
+
+
+def chunk_topic(model, sha256, index):
+    return "{}/ota/chunks/{}/{}".format(model, sha256, index)
+
+
+def retained_manifest(client, model, wait):
+    """ The manifest the fleet currently sees, if any """
+    found = {}
+
+    def on_message(client, userdata, message):
+        try:
+            found["manifest"] = json.loads(message.payload)
+        except ValueError:
+            pass
+
+    client.on_message = on_message
+    topic = "{}/ota/manifest".format(model)
+    client.subscribe(topic)
+    deadline = time.monotonic() + wait
+    while "manifest" not in found and time.monotonic() < deadline:
+        client.loop(0.1)
+    client.unsubscribe(topic)
+    return found.get("manifest")
+
+
+def publish_update(client, model, version, paths, chunk_size, full=False, clear_previous=False, wait=2.0):
+    """ Returns (chunks published, files sent) """
+    previous = retained_manifest(client, model, wait)
+    # content -> entry of every file whose chunks are retained already
+    retained = {}
+    if previous and not full:
+        for entry in previous["files"].values():
+            retained[entry["sha256"]] = entry
+    manifest = {"version": version, "chunk_size": chunk_size, "files": {}}
+    sent_chunks = 0
+    sent_files = []
+    for path in paths:
+        name = os.path.basename(path)
+        data, entry = file_entry(path, chunk_size)
+        if entry["sha256"] in retained:
+            # the chunks on the broker, cut at the chunk size they were sent with
+            manifest["files"][name] = dict(entry, chunks=retained[entry["sha256"]]["chunks"])
+            continue
+        manifest["files"][name] = entry
+        for index in range(entry["chunks"]):
+            chunk = data[index * chunk_size:(index + 1) * chunk_size]
+            client.publish(chunk_topic(model, entry["sha256"], index), base64.b64encode(chunk), qos=1, retain=True)
+            sent_chunks += 1
+        retained[entry["sha256"]] = entry
+        sent_files.append(name)
+    if clear_previous and previous:
+        kept = set(entry["sha256"] for entry in manifest["files"].values())
+        for entry in previous["files"].values():
+            if entry["sha256"] in kept:
+                continue
+            kept.add(entry["sha256"])
+            for index in range(entry["chunks"]):
+                client.publish(chunk_topic(model, entry["sha256"], index), b"", qos=1, retain=True)
+    # manifest last, so nodes never see a version whose chunks aren't there yet
+    client.publish("{}/ota/manifest".format(model), json.dumps(manifest), qos=1, retain=True)
+    return sent_chunks, sent_files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="modules (and optionally code.py) making up the version")
+    parser.add_argument("--version", required=True, help="version name, also a directory name on the SD")
+    parser.add_argument("--model", default="qtpy")
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--full", action="store_true", help="send every file, not only those changed since the last manifest")
+    parser.add_argument("--clear-previous", action="store_true", help="drop the retained chunks of files the new version no longer has")
+    parser.add_argument("--standin", action="store_true", help="publish to an in-memory broker and report")
+    args = parser.parse_args()
+
+    if args.standin:
+        broker = standins.MemoryBroker()
+        client = standins.MemoryClient(broker)
+    else:
+        client = fleet.mqtt_client()
+        client.connect(args.broker, args.port)
+        client.loop_start()
+        # paho's threaded loop delivers messages, loop() here only has to wait
+        client.loop = lambda timeout=0.1: time.sleep(timeout)
+
+    chunks, files = publish_update(client, args.model, args.version, args.files, args.chunk_size,
+                                   args.full, args.clear_previous)
+    print("version {}: {} chunks for {}".format(args.version, chunks, ", ".join(files) or "no changed files"))
+    if args.standin:
+        print("{} retained topics on the stand-in broker".format(len(broker.retained)))
+    else:
+        client.loop_stop()
+        client.disconnect()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+'''
+   Fleet wake simulation: peak concurrent WiFi/broker sessions with and without wake slots
+
+   Every node boots, reads its sensors, then holds the radio (association,
+   broker session, upload_wait) for a while, as code.py does. All of them
+   power up at once, as after a power cut or an install, and each node's
+   sleep timer runs a little fast or slow. Without slots they stay bunched
+   up; with WAKE_SLOTS the sleep of each node comes from
+   leak_detector_scripts/mod_schedule.py itself. An association the AP
+   cannot take fails, and the node sits out RESET_WAIT_TIME awake before it
+   resets and tries again, which is where a herd costs battery. Peaks count
+   the nodes trying to associate at once, failing ones included, in the
+   first SLEEP_TIME after the power up and for the rest of the run.
+
+   hash     the slot from the node's UID, as with WAKE_SLOT = -1
+   assign   slots handed out over the retained <model>/<node>/config topics
+
+   python3 stagger_sim.py --nodes 200 --sleep 300 --slots 60
+   python3 stagger_sim.py --nodes 200 --method TPL5110 --no-rtc
+'''
+import argparse
+import heapq
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "leak_detector_scripts"))
+import mod_schedule  # noqa: E402
+
+BOOT = 3.0          # seconds from wake to the WiFi phase: boot, init, sensors
+DONE_DELAY = 2.2    # the TPL5110 branch's delay and DONE pulse
+FAIL_AFTER = 5.0    # seconds an association takes to fail
+
+
+class Node:
+    def __init__(self, rng, number, args, slot_mode):
+        self.uid = bytes(rng.randrange(256) for _ in range(6))
+        self.rate = 1 + rng.uniform(-args.drift, args.drift)    # its sleep timer's error
+        self.configured = number if slot_mode == "assign" else -1
+        self.power_on = True
+
+
+def schedule(node, args, now):
+    """ Point mod_schedule at this node at wall-clock time now, as code.py does each wake """
+    mod_schedule.init(args.sleep, args.slots, node.configured, node.uid)
+    mod_schedule.clock = None if args.no_rtc else (lambda: now)
+
+
+def off_slot_wake(node, args, now):
+    """ When a wake that code.py sends back without the radio wakes next, or None to go ahead """
+    first = node.power_on
+    node.power_on = False
+    schedule(node, args, now)
+    if args.method == "TPL5110":
+        if not mod_schedule.off_slot(args.hold_max, args.radio):
+            return None
+        hold = mod_schedule.hold_for_slot(0.2, args.sleep)
+        return now + hold + DONE_DELAY - 2 + (args.sleep - args.hold_max) * node.rate
+    wait = mod_schedule.power_on_wait() if first else 0.0
+    return now + wait * node.rate if wait >= 1 else None
+
+
+def next_wake(node, args, end):
+    """ (when the node wakes again after its radio session ended at end, seconds DONE was held) """
+    schedule(node, args, end)
+    if args.method == "TPL5110":
+        interval = args.sleep - (args.hold_max if args.slots else 0)
+        hold = mod_schedule.hold_for_slot(DONE_DELAY, args.hold_max)
+        return end + DONE_DELAY + hold + interval * node.rate, hold
+    return end + mod_schedule.sleep_for(args.sleep) * node.rate, 0.0
+
+
+def simulate(args, slots, slot_mode):
+    rng = random.Random(args.seed)
+    args.slots = slots
+    nodes = [Node(rng, number, args, slot_mode) for number in range(args.nodes)]
+    # (time the radio phase starts, node number); everyone boots at 0
+    events = [(BOOT + rng.uniform(0, args.boot_jitter), number) for number in range(args.nodes)]
+    heapq.heapify(events)
+    active = []         # end times of the sessions in progress
+    attempts = []       # end times of the associations in progress, failing ones too
+    peak_first = 0
+    peak_after = 0
+    failed = 0
+    sessions = 0
+    held = 0.0
+    while events:
+        start, number = heapq.heappop(events)
+        if start > args.hours * 3600:
+            break
+        node = nodes[number]
+        wake = off_slot_wake(node, args, start)
+        if wake is not None:
+            heapq.heappush(events, (wake + BOOT, number))
+            continue
+        while active and active[0] <= start:
+            heapq.heappop(active)
+        while attempts and attempts[0] <= start:
+            heapq.heappop(attempts)
+        if start < args.sleep:
+            peak_first = max(peak_first, len(attempts) + 1)
+        else:
+            peak_after = max(peak_after, len(attempts) + 1)
+        if len(active) >= args.ap_capacity:
+            # RESET_WAIT_TIME awake, then microcontroller.reset() boots it again
+            failed += 1
+            heapq.heappush(attempts, start + FAIL_AFTER)
+            heapq.heappush(events, (start + FAIL_AFTER + args.reset_wait + BOOT, number))
+            continue
+        end = start + args.radio * rng.uniform(0.8, 1.2)
+        heapq.heappush(active, end)
+        heapq.heappush(attempts, end)
+        sessions += 1
+        wake, hold = next_wake(node, args, end)
+        held += hold
+        heapq.heappush(events, (wake + BOOT, number))
+    return {"peak_first": peak_first, "peak_after": peak_after, "sessions": sessions, "failed": failed,
+            "hold_s": held / sessions if sessions else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=200)
+    parser.add_argument("--sleep", type=int, default=300, help="SLEEP_TIME on the nodes")
+    parser.add_argument("--slots", type=int, default=60, help="WAKE_SLOTS for the staggered runs")
+    parser.add_argument("--method", choices=("deep_sleep", "TPL5110"), default="deep_sleep")
+    parser.add_argument("--no-rtc", action="store_true", help="no set DS3231, slots only after a power on")
+    parser.add_argument("--hold-max", type=float, default=30.0, help="WAKE_HOLD_MAX on the nodes")
+    parser.add_argument("--radio", type=float, default=8.0, help="seconds each wake holds the radio")
+    parser.add_argument("--drift", type=float, default=0.01, help="sleep timer error, fraction either way")
+    parser.add_argument("--boot-jitter", type=float, default=1.0, help="spread of the first boot after power up")
+    parser.add_argument("--ap-capacity", type=int, default=16, help="associations the AP takes at once")
+    parser.add_argument("--reset-wait", type=float, default=300.0, help="RESET_WAIT_TIME on the nodes")
+    parser.add_argument("--hours", type=float, default=24.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    runs = (("no slots", 0, "hash"), ("hash", args.slots, "hash"), ("assign", args.slots, "assign"))
+    print("{} nodes, {} {} s, {} s radio, AP takes {}, {} hours{}".format(
+        args.nodes, args.method, args.sleep, args.radio, args.ap_capacity, args.hours,
+        ", no RTC" if args.no_rtc else ""))
+    print("{:<10} {:>6} {:>12} {:>8} {:>10} {:>8} {:>10}".format(
+        "slots", "count", "peak 1st", "after", "sessions", "failed", "hold s"))
+    for name, slots, slot_mode in runs:
+        report = simulate(args, slots, slot_mode)
+        print("{:<10} {:>6} {:>12} {:>8} {:>10} {:>8} {:>10.1f}".format(
+            name, slots, report["peak_first"], report["peak_after"], report["sessions"], report["failed"], report["hold_s"]))
+
+
+if __name__ == "__main__":
+    main()
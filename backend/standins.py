@@ -0,0 +1,200 @@
+'''
+   In-process stand-ins for the backend pieces, so the host tools can be
+   exercised without mosquitto on the RP400.
+
+   MemoryBroker keeps retained messages and matches MQTT wildcards;
+   MemoryClient speaks the small part of the paho-mqtt client API the tools use.
+   AsyncBroker is a TCP broker on localhost for the asyncio load generator.
+   RadioLink is a lossy LoRa link with the adafruit_rfm9x send/receive calls.
+'''
+import asyncio
+import collections
+import random
+import struct
+
+import mqtt_async
+
+
+def topic_matches(topic_filter, topic):
+    """ MQTT filter matching with + and # """
+    filter_parts = topic_filter.split("/")
+    topic_parts = topic.split("/")
+    for i, part in enumerate(filter_parts):
+        if part == "#":
+            return True
+        if i >= len(topic_parts):
+            return False
+        if part != "+" and part != topic_parts[i]:
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+
+class MemoryMessage:
+    def __init__(self, topic, payload, retain=False):
+        self.topic = topic
+        self.payload = payload
+        self.retain = retain
+
+
+class MemoryBroker:
+    def __init__(self):
+        self.retained = {}
+        self.clients = []
+        self.published = 0
+
+    def publish(self, topic, payload, retain=False):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self.published += 1
+        if retain:
+            # an empty retained payload clears the topic, as on mosquitto
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+        for client in self.clients:
+            client.deliver(topic, payload, False)
+
+    def subscribe(self, client, topic_filter):
+        for topic, payload in list(self.retained.items()):
+            if topic_matches(topic_filter, topic):
+                client.deliver(topic, payload, True, topic_filter)
+
+
+class MemoryClient:
+    """ paho-mqtt shaped client on a MemoryBroker """
+    def __init__(self, broker):
+        self.broker = broker
+        self.filters = []
+        self.on_message = None
+        broker.clients.append(self)
+
+    def deliver(self, topic, payload, retain, only_filter=None):
+        filters = [only_filter] if only_filter else self.filters
+        if self.on_message and any(topic_matches(f, topic) for f in filters):
+            self.on_message(self, None, MemoryMessage(topic, payload, retain))
+
+    def subscribe(self, topic_filter, qos=0):
+        self.filters.append(topic_filter)
+        self.broker.subscribe(self, topic_filter)
+
+    def unsubscribe(self, topic_filter):
+        self.filters.remove(topic_filter)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.broker.publish(topic, payload if payload is not None else b"", retain)
+
+    def loop(self, timeout=1.0):
+        pass
+
+    def disconnect(self):
+        self.broker.clients.remove(self)
+
+
+class MemoryWriter:
+    """ InfluxDB writer stand-in, keeps the lines it was given """
+    def __init__(self, fail_times=0):
+        self.lines = []
+        self.batches = 0
+        self.fail_times = fail_times
+
+    def write(self, lines):
+        if self.fail_times:
+            self.fail_times -= 1
+            raise IOError("stand-in write failure")
+        self.batches += 1
+        self.lines.extend(lines)
+
+
+class AsyncBroker:
+    """ A small MQTT 3.1.1 broker on asyncio: QoS 0/1 in, QoS 0 out, retained messages """
+    def __init__(self):
+        self.subscribers = {}   # writer -> list of filters
+        self.retained = {}
+        self.published = 0
+        self.server = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def deliver(self, writer, topic, payload, retain=False):
+        body = mqtt_async.encode_string(topic) + payload
+        writer.write(mqtt_async.packet(mqtt_async.PUBLISH, 1 if retain else 0, body))
+
+    async def handle(self, reader, writer):
+        self.subscribers[writer] = []
+        try:
+            while True:
+                kind, flags, body = await mqtt_async.read_packet(reader)
+                if kind == mqtt_async.CONNECT:
+                    writer.write(mqtt_async.packet(mqtt_async.CONNACK, 0, b"\x00\x00"))
+                elif kind == mqtt_async.PUBLISH:
+                    topic, payload, pid = mqtt_async.parse_publish(flags, body)
+                    if pid is not None:
+                        writer.write(mqtt_async.packet(mqtt_async.PUBACK, 0, struct.pack("!H", pid)))
+                    self.published += 1
+                    if flags & 1:
+                        if payload:
+                            self.retained[topic] = payload
+                        else:
+                            self.retained.pop(topic, None)
+                    for other, filters in self.subscribers.items():
+                        if any(topic_matches(f, topic) for f in filters):
+                            self.deliver(other, topic, payload)
+                elif kind == mqtt_async.SUBSCRIBE:
+                    pid = body[:2]
+                    size = struct.unpack("!H", body[2:4])[0]
+                    topic_filter = body[4:4 + size].decode()
+                    self.subscribers[writer].append(topic_filter)
+                    writer.write(mqtt_async.packet(mqtt_async.SUBACK, 0, pid + b"\x00"))
+                    for topic, payload in list(self.retained.items()):
+                        if topic_matches(topic_filter, topic):
+                            self.deliver(writer, topic, payload, True)
+                elif kind == mqtt_async.PINGREQ:
+                    writer.write(mqtt_async.packet(mqtt_async.PINGRESP, 0, b""))
+                elif kind == mqtt_async.DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            del self.subscribers[writer]
+            writer.close()
+
+
+class RadioLink:
+    """ Frames from simulated nodes to the gateway, some lost, each with an RSSI """
+    def __init__(self, loss=0.0, rssi=-95.0, seed=1):
+        self.loss = loss
+        self.rssi = rssi
+        self.rng = random.Random(seed)
+        self.frames = collections.deque()
+        self.sent = 0
+        self.lost = 0
+        self.last_rssi = None
+        self.tx_power = 13
+
+    def send(self, frame):
+        # an RFM9x packet holds 252 bytes after the RadioHead header
+        if len(frame) > 252:
+            raise ValueError("frame of {} bytes is too long for LoRa".format(len(frame)))
+        self.sent += 1
+        if self.rng.random() < self.loss:
+            self.lost += 1
+        else:
+            self.frames.append((bytes(frame), self.rssi + self.rng.gauss(0, 3)))
+        return True
+
+    def sleep(self):
+        pass
+
+    def receive(self, timeout=0.5):
+        if not self.frames:
+            return None
+        frame, self.last_rssi = self.frames.popleft()
+        return frame
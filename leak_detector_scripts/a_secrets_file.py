@@ -13,6 +13,7 @@ secrets = {
 
 
     'broker' : ‘YOUR_MQTT_BROKER_IP’,
+    #'mqttsn_gateway' : ‘YOUR_MQTTSN_GATEWAY_IP’,  # TRANSPORT = "mqttsn", defaults to the broker
     #'user' : ‘YOUR_MQTT_USERNAME,
     #'pass' : ‘YOUR_MQTT_PASSWORD’,
 }
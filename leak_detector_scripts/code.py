@@ -43,8 +43,9 @@
 # SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
 # SPDX-License-Identifier: MIT
 # standard libraries
-import os
+import sys
 import re
+import gc
 import alarm
 import time
 import ssl
@@ -53,18 +54,14 @@ import socketpool
 # standard CircuitPython libraries
 import busio
 import microcontroller
-import watchdog
 import wifi
 import storage
+import supervisor
 import board
-#from board import A0  # ADC/DAC, used as digital VCC for soil probe
-from board import A1  # ADC/DAC 12v Battery monitor 12k-3k divider
-from board import A2  # ADC QtPy BFF battery voltage
-#from board import A3  # ADC for soil probe
+from watchdog import WatchDogTimeout
+# the analog pins (A1, A2, A3) and the soil probe power (A0/D18) belong to mod_analog
 import digitalio
 from digitalio import DigitalInOut
-import analogio
-from analogio import AnalogIn
 
 # Adafruit libraries
 import adafruit_minimqtt.adafruit_minimqtt as MQTT
@@ -73,7 +70,62 @@ import adafruit_logging as logging
 from adafruit_logging import FileHandler
 from adafruit_lc709203f import LC709203F
 from adafruit_io.adafruit_io import IO_MQTT
-from adafruit_simplemath import map_range
+
+#### Mount the SD card before importing my libraries ... OTA updates of them live on it
+# Get chip select pin depending on the board, this one is for the Feather M4 Express
+sd_cs = board.TX
+sdcard_found = False
+sd_mounted_at = None
+try:
+    # Set up SPI
+    spi = busio.SPI(board.SCK, board.MOSI, board.MISO)
+    cs = DigitalInOut(sd_cs)
+    try:
+        # Set up SD card for logging
+        sdcard = adafruit_sdcard.SDCard(spi, cs)
+        print("\ncreated the sdcard object")
+        try:
+            # Create a file system
+            vfs = storage.VfsFat(sdcard)
+            print("created the vfs")
+            try:
+                # Mount the file system
+                storage.mount(vfs, "/sd")
+                print("mounted the sd")
+                sdcard_found = True
+                sd_mounted_at = time.monotonic()
+            except Exception as ex:
+                print("Error with mount ... {}".format(ex))
+        except Exception as ex:
+            print("Error with vfs ... {}".format(ex))
+    except Exception as ex:
+        print("Error with sd card ... {}".format(ex))
+except Exception as ex:
+    print("Error with spi ... {}".format(ex))
+
+#### Run the OTA version of my libraries if one is active, roll back a failing one
+import mod_diag
+import mod_ota
+import mod_watchdog
+# a wake that stalled comes back as a reload, its phase is in sleep_memory
+stalled = mod_watchdog.previous()
+boot_reset_code = mod_diag.reset_code() if stalled == None else mod_ota.RESET_WATCHDOG
+ota_version = None
+if sdcard_found:
+    try:
+        ota_version = mod_ota.activate(boot_reset_code, __file__)
+    except Exception as ex:
+        print("Error with OTA activation ... {}".format(ex))
+if ota_version != None:
+    # these and what they import were loaded from CIRCUITPY before the version went on sys.path,
+    # load them again so the version's copies run
+    for name in [name for name in sys.modules if name.startswith("mod_")]:
+        del sys.modules[name]
+    import mod_diag
+    import mod_ota
+    import mod_watchdog
+    mod_ota.read_state()
+    stalled = mod_watchdog.previous()
 
 # my libraries
 import mod_neopixel
@@ -85,100 +137,134 @@ import mod_bme680
 import mod_ina260
 import mod_ds3231
 import mod_24lc32
+import mod_kvstore
+import mod_transport
+import mod_mqttsn
 import mod_soil_probe
 import mod_battery_voltage
+import mod_energy
+import mod_record
+import mod_log
+import mod_config
+import mod_calibration
+import mod_analog
+import mod_power
+import mod_sdindex
+import mod_schedule
+import mod_logship
+import mod_sampling
+
+mod_energy.mark("boot")
 
 
 """ basic global variables ... very important!!! """
+# node tunables (sleep_time, model, charger, probes, powerdown_method ...) live in
+# settings.toml and are loaded by mod_config once the EEPROM is up, see SETUP HARDWARE
 version = 8.5 # Working copy with sensors, RTC w/NTP, soil_probe, external battery probe, and talks to MQTT via Wifi
 code_status = "work in progress"
-sleep_time = 60 * 5 #  sleep_time = 60 * 5   .... or 60 for testing
-watchdog_timeout = sleep_time + 30
-debug = True
-connect_to_wifi = True  # False for debugging
-do_connect_to_broker = True
-do_send_to_broker = True
 ic2_connected = False
 i2c_qwiic_connected = False
-model = "qtpy"  # or qtpy/featherS2/featherS3
-using_bff = True
-test_watchdog = False
-reset_wait_time = 300
-reload_wait_time = 300
-charger = "bff"  # or solar/bff
-using_hardware_watchdog = True
 hardware_reset_duration = 0.1
-trigger_duration = 0.2
-error_sleep = sleep_time
+trigger_duration = 0.2  # shortest low pulse that retriggers the hardware watchdog
 sd_card = False
-soil_moisture_detector_used = True
-battery_probe_used = True
-sd_card_used = True
-testing_wdt = False
 set_ds3231 = False   # <<<<<<<<<<< IF YOU NEED TO SET THE RTC, USING NTP >>>>>>>>
+current_model = None  # dict overriding mod_energy.CURRENT_MODEL entries measured for this node
 
 
 """ FUNCTIONS """
 # The print function....also logs
-def my_print(level, message, end=''):
-    U_level = level.upper()
-    mod_message = "{}: {}".format(U_level, message)
-    print("{}".format(mod_message))
-    if sdcard_filesystem:
-        if level == "debug":
-            logger.debug(mod_message)
-        elif level == "info":
-            logger.info(mod_message)
-        elif level == "warning":
-            logger.warning(mod_message)
-        elif level == "error":
-            logger.error(mod_message)
-        elif level == "critical":
-            logger.critical(mod_message)
-        else:
-            logger.debug(mod_message)
-
-
-# This helper function will print the contents of the SD
-def print_directory(path, tabs=0):
-    print("Files on filesystem:")
-    print("====================")
-    for file in os.listdir(path):
-        stats = os.stat(path + "/" + file)
-        filesize = stats[6]
-        isdir = stats[0] & 0x4000
-
-        if filesize < 1000:
-            sizestr = str(filesize) + " bytes"
-        elif filesize < 1000000:
-            sizestr = "%0.1f KB" % (filesize / 1000)
+# message is a format string, args are only formatted if the console or SD level wants the record
+def my_print(level, message, *args):
+    mod_log.log(mod_log.LEVELS.get(level, mod_log.DEBUG), message, *args)
+
+
+# The SD index keeps the listing and the sizes, the card is only walked when asked for (SD_RESCAN)
+def close_sd_index():
+    """ Add this wake's log growth to the SD index and write it out """
+    try:
+        mod_sdindex.touch(log_filepath)
+        mod_sdindex.save()
+        if sd_rescan:
+            mod_sdindex.print_index()
+    except Exception as ex:
+        my_print("warning", "SD index not saved: {}", ex)
+
+
+def enter_phase(phase):
+    """ Mark the start of a phase of the wake cycle """
+    mod_watchdog.phase(phase)
+    mod_energy.mark(phase)
+    if ina260_profiling and ina260_found:
+        mod_ina260.mark(ina260, phase)
+    mod_neopixel.step()
+
+
+def pause(seconds):
+    """ time.sleep that keeps the INA260 profile, the sensor burst, the status pixel and the watchdog pulse going """
+    end = time.monotonic() + seconds
+    while True:
+        mod_neopixel.step()
+        mod_watchdog.poll()
+        left = end - time.monotonic()
+        if left <= 0:
+            break
+        mod_sampling.poll()
+        left = min(left, mod_neopixel.next_change(), mod_watchdog.next_change(), mod_sampling.next_change())
+        if ina260_profiling and ina260_found:
+            mod_ina260.sleep(ina260, left)
         else:
-            sizestr = "%0.1f MB" % (filesize / 1000000)
+            time.sleep(left)
 
-        prettyprintname = ""
-        for _ in range(tabs):
-            prettyprintname += "   "
-        prettyprintname += file
-        if isdir:
-            prettyprintname += "/"
-        print("{0:<40} Size: {1:>10}".format(prettyprintname, sizestr))
 
-        # recursively print directory contents
-        if isdir:
-            print_directory(path + "/" + file, tabs + 1)
+def wait_before_reset(seconds):
+    """ time.sleep for a wait longer than the phase's watchdog budget, the watchdog given time for it """
+    mod_watchdog.extend(seconds + 15)
+    time.sleep(seconds)
 
 
-def get_voltage(pin):
-    return (pin.value * 3.3) / 65536
+def power_down():
+    """ Every power domain off before the supply is cut or we deep sleep """
+    mod_watchdog.done()
+    # the EEPROM store's changed pages, written once per wake
+    try:
+        mod_kvstore.flush()
+    except OSError as ex:
+        my_print("warning", "EEPROM store not written: {}", ex)
+    mod_neopixel.stop()
+    mod_analog.deinit()
+    if mod_power.is_on("sd"):
+        try:
+            storage.umount("/sd")
+        except OSError:
+            pass
+        mod_power.off("sd")
+    mod_power.all_off()
 
 
-def deep_sleep(this_sleep_time):
+def deep_sleep(this_sleep_time, in_slot=True):
     """ Do a deep sleep to conserve battery and close logger file handle """
-    # prepare and sleep
+    # prepare and sleep, to the start of this node's wake slot when the fleet is staggered
+    if in_slot:
+        this_sleep_time = mod_schedule.sleep_for(this_sleep_time)
+    power_down()
     time_alarm = alarm.time.TimeAlarm(monotonic_time=time.monotonic() + this_sleep_time)
     alarm.exit_and_deep_sleep_until_alarms(time_alarm)
 
 
+def cut_power(this_delay):
+    """ Tell the TPL5110 we're DONE after this_delay seconds, the circuit cuts off our supply """
+    power_down()
+    time.sleep(this_delay)
+    DONE = digitalio.DigitalInOut(board.RX) # GPIO/RX
+    DONE.direction = digitalio.Direction.OUTPUT
+    DONE.value = False
+    time.sleep(0.2)
+    DONE.value = True
+    time.sleep(0.8)
+    DONE.value = False
+    deep_sleep(sleep_time)  # Normal stuff, if the supply was not cut
+
+
 """ MQTT related callbacks """
 # Define callback methods which are called when events occur
 # pylint: disable=unused-argument, redefined-outer-name
@@ -186,7 +272,7 @@ def connect(mqtt_client, userdata, flags, rc):
     # This function will be called when the mqtt_client is connected
     # successfully to the broker.
     my_print("info" ,"Connected to MQTT Broker!")
-    my_print("info" ,"Flags: {0}\n RC: {1}".format(flags, rc))
+    my_print("info", "Flags: {0}\n RC: {1}", flags, rc)
 
 
 def disconnect(mqtt_client, userdata, rc):
@@ -197,12 +283,12 @@ def disconnect(mqtt_client, userdata, rc):
 
 def subscribe(mqtt_client, userdata, topic, granted_qos):
     # This method is called when the mqtt_client subscribes to a new feed.
-    my_print("info" ,"Subscribed to {0} with QOS level {1}".format(topic, granted_qos))
+    my_print("info", "Subscribed to {0} with QOS level {1}", topic, granted_qos)
 
 
 def unsubscribe(mqtt_client, userdata, topic, pid):
     # This method is called when the mqtt_client unsubscribes from a feed.
-    my_print("info" ,"Unsubscribed from {0} with PID {1}".format(topic, pid))
+    my_print("info", "Unsubscribed from {0} with PID {1}", topic, pid)
 
 
 def publish(mqtt_client, userdata, topic, pid):
@@ -213,7 +299,21 @@ def publish(mqtt_client, userdata, topic, pid):
 
 def message(client, topic, message):
     # Method called when a client's subscribed feed has a new value.
-    my_print("info" ,"New message on topic {0}: {1}".format(topic, message))
+    if topic.startswith(ota_prefix):
+        # OTA traffic is large, don't echo it
+        if topic.endswith("/manifest"):
+            mod_ota.on_manifest(model, message)
+        else:
+            mod_ota.on_chunk(topic, message)
+        return
+    my_print("info", "New message on topic {0}: {1}", topic, message)
+    if topic in config_topics:
+        # retained config for the fleet or this node, used from the next wake
+        changed, errors = mod_config.apply(message)
+        for error in errors:
+            my_print("warning", "config update: {}", error)
+        if changed:
+            my_print("info", "config updated for the next wake: {}", changed)
 
 
 """ intermediate functions to use the MQTT functions """
@@ -221,20 +321,22 @@ def connect_to_broker():
     if do_connect_to_broker:
         # Connect to Broker
         try:
-            my_print("info" ,"Connecting to Broker at {}...".format(secrets["broker"]))
+            my_print("info", "Connecting to Broker at {}...", secrets["broker"])
             mqtt_client.connect()
             return True
+        except WatchDogTimeout:
+            raise
         except RuntimeError:
-            my_print("info" ,"Failed to connect to Broker...RuntimeError, wait {} seconds and reset".format(reset_wait_time))
-            time.sleep(reset_wait_time)
+            my_print("error", "Failed to connect to Broker...RuntimeError, wait {} seconds and reset", reset_wait_time)
+            wait_before_reset(reset_wait_time)
             microcontroller.reset()
             deep_sleep(sleep_time)  # recover by deep sleep reset
         except Exception as ex:
             template = "An exception of type {0} occurred. Arguments:\n{1!r}"
             message = template.format(type(ex).__name__, ex.args)
-            my_print("info" ,"MQTT Error: Unable to connect to Broker\n{}".format(message))
-            my_print("info" ,"Failed to connect, wait {} seconds and reset".format(reset_wait_time))
-            time.sleep(reset_wait_time)
+            my_print("error", "MQTT Error: Unable to connect to Broker\n{}", message)
+            my_print("info", "Failed to connect, wait {} seconds and reset", reset_wait_time)
+            wait_before_reset(reset_wait_time)
             microcontroller.reset()
             deep_sleep(sleep_time)  # recover by deep sleep reset
     else:
@@ -249,10 +351,12 @@ def disconnect_from_broker():
             #io.disconnect()
             mqtt_client.disconnect()
             return True
+        except WatchDogTimeout:
+            raise
         except Exception as ex:
             template = "An exception of type {0} occurred. Arguments:\n{1!r}"
             message = template.format(type(ex).__name__, ex.args)
-            my_print("info" ,"MQTT Error: Unable to disconnect to Broker\n{}".format(message))
+            my_print("error", "MQTT Error: Unable to disconnect to Broker\n{}", message)
             deep_sleep(sleep_time)  # recover by deep sleep reset
     else:
         return True
@@ -265,133 +369,157 @@ def publish_to_broker(tag, nomenclature, value):
         try:
             #io.publish("{}".format(tag), value)
             if mqtt_client.is_connected():
-                mqtt_client.publish("{}".format(tag), value)
+                mqtt_client.publish(tag, value)
+        except WatchDogTimeout:
+            raise
         except OSError:
-            my_print("info" ,"OSError occurred, not connected to broker...wait {} seconds and reset\n".format(reset_wait_time))
-            time.sleep(reset_wait_time)
+            my_print("error", "OSError occurred, not connected to broker...wait {} seconds and reset\n", reset_wait_time)
+            wait_before_reset(reset_wait_time)
             microcontroller.reset()
         except Exception as ex:
             template = "An exception of type {0} occurred. Arguments:\n{1!r}"
             message = template.format(type(ex).__name__, ex.args)
-            my_print("info" ,"MQTT Error: Unable to publish to Broker\n{}".format(message))
-            my_print("info" ,"...wait {} seconds and reset\n".format(reset_wait_time))
-            time.sleep(reset_wait_time)
+            my_print("error", "MQTT Error: Unable to publish to Broker\n{}", message)
+            my_print("info", "...wait {} seconds and reset\n", reset_wait_time)
+            wait_before_reset(reset_wait_time)
             microcontroller.reset()
             deep_sleep(sleep_time)  # recover by deep sleep reset
-        my_print("info" ,"Published {:.2f} {} to {} ... ".format(value, nomenclature, tag), end=' ')
-
-    else:
-        my_print("info" ,"Read {:.2f} {} for {}".format(value, nomenclature, tag))
-
+        my_print("debug", "Published {:.2f} {} to {} ... ", value, nomenclature, tag)
 
-def setup_watchdog(watchdog_timeout):
-    # set up watchdog to reset system if it gets stuck on wifi or broker connections
-    wdt = microcontroller.watchdog
-    try:
-        wdt.timeout = watchdog_timeout
-        wdt.mode = watchdog.WatchDogMode.RAISE
-        my_print("info" ,"set watchdog_timeout to {} seconds and started watchdog".format(watchdog_timeout))
-        if test_watchdog:
-            my_print("info" ,"set sleep to {} seconds to test watchdog".format(watchdog_timeout + 10))
-            time.sleep(watchdog_timeout + 10)  # this delay should trigger watchdog timeout
-        return wdt
-    except watchdog.WatchDogTimeout as e:
-        my_print("info" ,"Watchdog expired, reset system")
-        microcontroller.reset()
-    except Exception as e:
-        my_print("info" ,"Other exception, reset system:\n{}".format(e))
-        microcontroller.reset()
-
-
-def retrigger_hardware_watchdog(trigger_duration):
-    if using_hardware_watchdog:
-        # take trigger low ... retrigger the hardware watchdog
-        if testing_wdt:
-            my_print("info" ,"retrigger the hardware watchdog ... currently is {}".format(wdt_out.value))
-        trigger.value = False
-        time.sleep(trigger_duration)
-        trigger.value = True
-        if testing_wdt:
-            my_print("info" ,"hardware watchdog retriggered ...   currently is {}".format(wdt_out.value))
     else:
-        my_print("info" ,"not using hardware watchdog")
+        my_print("debug", "Read {:.2f} {} for {}", value, nomenclature, tag)
 
 
 """ CODE ############################################################################# """
 
 #### SETUP HARDWARE ######################################################################
 
-#### Setup SD card for logging
-# Get chip select pin depending on the board, this one is for the Feather M4 Express
-sd_cs = board.TX
-sdcard_found = False
+#### Setup I2C ... first, the EEPROM holding the config snapshot is on it
+i2c_board, i2c_qwiic = mod_i2c.init()
+
+# Set up the 24LC32 EEPROM on the DS3231 module we're using
+eeprom = mod_24lc32.init(i2c_board, i2c_qwiic)
+# config, calibration, diagnostics and the RTC flag are keys in its store, read in one go
 try:
-    # Set up SPI
-    spi = busio.SPI(board.SCK, board.MOSI, board.MISO)
-    cs = DigitalInOut(sd_cs)
+    kv_entries = mod_kvstore.init(eeprom)
+except OSError as ex:
+    print("EEPROM store unreadable: {}".format(ex))
+    kv_entries = mod_kvstore.init()
+
+#### Load the configuration, settings.toml or its cached snapshot in the EEPROM
+config, config_errors = mod_config.load()
+sleep_time = config["sleep_time"]
+model = config["model"]  # or qtpy/featherS2/featherS3
+charger = config["charger"]  # or solar/bff
+using_bff = config["using_bff"]
+soil_moisture_detector_used = config["soil_moisture_detector_used"]
+battery_probe_used = config["battery_probe_used"]
+sd_card_used = config["sd_card_used"]
+powerdown_method = config["powerdown_method"]  # or deep_sleep/watchdog
+sea_level_pressure = config["sea_level_pressure"]
+temperature_offset = config["temperature_offset"]
+connect_to_wifi = config["connect_to_wifi"]  # False for debugging
+do_connect_to_broker = config["do_connect_to_broker"]
+do_send_to_broker = config["do_send_to_broker"]
+using_hardware_watchdog = config["using_hardware_watchdog"]
+reset_wait_time = config["reset_wait_time"]
+reload_wait_time = config["reload_wait_time"]
+upload_wait = config["upload_wait"]
+ina260_profiling = config["ina260_profiling"]  # sample the INA260 through the wake cycle and publish an energy summary
+battery_capacity_mAh = config["battery_capacity_mAh"]  # LiPo capacity used for the runtime projection
+ota_enabled = config["ota_enabled"]  # look for module updates on <model>/ota/manifest
+ota_budget = config["ota_budget"]  # seconds of broker time per wake for OTA chunks
+logship_chunks = config["logship_chunks"]  # SD log chunks shipped per wake, 0 keeps the logs on the card
+logship_budget = config["logship_budget"]  # seconds of radio time per wake for them
+logship_min_battery = config["logship_min_battery"]  # percent of charge below which nothing is shipped
+transport = config["transport"]  # mqtt over WiFi, or one LoRa frame per wake
+error_sleep = sleep_time
+# this node's wake slot, None unless WAKE_SLOTS spreads the fleet over the sleep interval
+wake_slot = mod_schedule.init(sleep_time, config["wake_slots"], config["wake_slot"], microcontroller.cpu.uid)
+wake_hold_max = config["wake_hold_max"]  # seconds the TPL5110's DONE may be held back to keep the slot
+# nodes powered up together would otherwise wake together, the TPL5110 powers up every wake
+first_after_power_on = boot_reset_code == 1 and powerdown_method != "TPL5110"
+sample_burst = config["sample_burst"]  # readings per sensor, the extra ones taken during upload_wait
+sensor_oversample = mod_sampling.oversampling(config["sensor_oversample"])  # the sensors' own averaging
+calibration_mode = config["calibration_mode"]  # guided probe calibration on the serial console
+calibrated = mod_calibration.load()  # probe curves, stored ones over the defaults
+
+sd_rescan = config["sd_rescan"]  # walk the whole card and list it, otherwise the index is trusted
+
+#### SD index ... files, sizes and free space without walking the card
+sd_status = None
+if sdcard_found:
     try:
-        # Set up SD card for logging
-        sdcard = adafruit_sdcard.SDCard(spi, cs)
-        print("\ncreated the sdcard object")
-        try:
-            # Create a file system
-            vfs = storage.VfsFat(sdcard)
-            print("created the vfs")
-            try:
-                # Mount the file system
-                storage.mount(vfs, "/sd")
-                print("mounted the sd")
-                sdcard_found = True
-            except Exception as ex:
-                print("Error with mount ... {}".format(ex))
-        except Exception as ex:
-            print("Error with vfs ... {}".format(ex))
+        mod_sdindex.load(sd_rescan)
+        sd_status = mod_sdindex.status()
+        my_print("info", "SD: {} files, {} bytes used, {} bytes free{}", sd_status["files"], sd_status["used"],
+                 sd_status["free"], " (index rebuilt)" if sd_status["rebuilt"] else "")
+        if sd_rescan:
+            mod_sdindex.print_index()
     except Exception as ex:
-        print("Error with sd card ... {}".format(ex))
-except Exception as ex:
-    print("Error with spi ... {}".format(ex))
-
-# print filesystem contents
-if sdcard_found: print_directory("/sd")
+        my_print("warning", "SD index unavailable: {}", ex)
 
 #### Initialize log functionality
 sdcard_filesystem = False
 log_filepath = "/sd/testlog.log"
+sd_min_free = 64 * 1024  # leave the card alone rather than fill it with log
 logger = logging.getLogger("testlog")
-try:
-    file_handler = FileHandler(log_filepath)
-    logger.addHandler(file_handler)
-    logger.setLevel(logging.NOTSET)
-    sdcard_filesystem = True
-    print("sdcard filesystem looks good for logging")
-except Exception as ex:
-    print("Error with sdcard filesystem ... {}".format(ex))
+if sdcard_found and sd_card_used and sd_status != None and 0 <= sd_status["free"] < sd_min_free:
+    my_print("warning", "SD has {} bytes free, not logging to it", sd_status["free"])
+elif sdcard_found and sd_card_used:
+    try:
+        file_handler = FileHandler(log_filepath)
+        logger.addHandler(file_handler)
+        sdcard_filesystem = True
+        print("sdcard filesystem looks good for logging")
+    except Exception as ex:
+        print("Error with sdcard filesystem ... {}".format(ex))
+# console and SD levels come from log_console_level and log_sd_level in the config
+mod_log.init(logger if sdcard_filesystem else None, config["log_console_level"], config["log_sd_level"])
 # test logging
 #my_print("info", "Testing log")
 
-#### Analog pins for battery state on qtpy
-#adc0 = analogio.AnalogIn(A0)  # unused ADC/DAC, used as digital for Vcc of soil moisture probe
-#adc1 = analogio.AnalogIn(A1)  # 12v Battery monitor 12k-3k divider ... handled in module
-adc2 = analogio.AnalogIn(A2)  # QtPy BFF voltage
-#adc3 = analogio.AnalogIn(A3)  # Soil probe ... handled in module
+#### Power domains ... the SD is timed from its mount, the pixel rail stays off until a pattern runs
+mod_power.add("sd", None, sd_mounted_at)
+mod_neopixel.init(config["status_pixel"])
 
-#### Soil moisture detector
+#### Analog channels ... mod_analog owns the pins and the soil probe's power rail
+# A1 12v battery monitor 12k-3k divider, A2 QtPy BFF voltage, A3 soil probe powered from A0/D18
+analog_wanted = []
 if soil_moisture_detector_used:
-    soil_probe_ready, soil_moisture_power, soil_adc = mod_soil_probe.init(model)
-
-#### Battery probe
+    analog_wanted.append(mod_soil_probe.CHANNEL)
 if battery_probe_used:
-    battery_probe_ready, battery_adc = mod_battery_voltage.init(model)
+    analog_wanted.append(mod_battery_voltage.CHANNEL)
+if (model == "qtpy") and using_bff:
+    analog_wanted.append("bff")
+try:
+    analog_channels = mod_analog.init(model, analog_wanted)
+except ValueError as ex:
+    my_print("warning", "analog channels: {}", ex)
+    analog_channels = []
+
+#### Guided calibration, only with someone at the serial console
+if calibration_mode != "none" and supervisor.runtime.serial_connected:
+    if calibration_mode in analog_channels:
+        curve, status_message = mod_calibration.calibrate(calibration_mode,
+                                                          lambda: mod_analog.read(calibration_mode, 64),
+                                                          config["calibration_degree"])
+    else:
+        curve, status_message = None, "nothing to calibrate for {}".format(calibration_mode)
+    print("calibration {}: {} - {}".format(calibration_mode, curve, status_message))
+    calibrated = [calibration_mode]
 
 #### Watchdog timer
 trigger = digitalio.DigitalInOut(board.D6) # GPIO/D6 was A1(GPIO/D17)
 trigger.direction = digitalio.Direction.OUTPUT
 trigger.value = True
 
-if testing_wdt:
-    ## define an input pin for WDT (for testing)
-    wdt_out = digitalio.DigitalInOut(board.D9) # GPIO/D9
-    wdt_out.direction = digitalio.Direction.INPUT
+# both watchdogs are fed at each phase; the slow phases get budgets from the config
+# a stall reloads the code file running now, the one OTA picked
+wdt = mod_watchdog.init(trigger if using_hardware_watchdog else None,
+                        {"upload_wait": upload_wait + 15 + logship_budget, "broker": 30 + ota_budget}, trigger_duration,
+                        __file__)
+mod_watchdog.phase("boot")
 
 
 #### FUNCTIONAL CODE #####################################################################
@@ -399,38 +527,48 @@ print() # for aesthetics to separate runs visually
 my_print("info", "Logger initialized!")
 if sdcard_filesystem: my_print("info", "sdcard_filesystem found")
 #### print version and the last reset reason
-reset_reason = 0
-if microcontroller.cpu.reset_reason == microcontroller.ResetReason.POWER_ON:
-    reset_reason = 1
-elif microcontroller.cpu.reset_reason == microcontroller.ResetReason.SOFTWARE:
-    reset_reason = 2
-elif microcontroller.cpu.reset_reason == microcontroller.ResetReason.WATCHDOG:
-    reset_reason = 3
-else : pass
-my_print("info" ,"VERSION: {}, reset reason is {}".format(version, microcontroller.cpu.reset_reason))
-my_print("info", "code_status is {}".format(code_status))
-
-# retrigger the hardware watchdog
-retrigger_hardware_watchdog(trigger_duration)
-
-# assign a battery sensor
+reset_reason = boot_reset_code
+my_print("info", "VERSION: {}, reset reason is {}", version, microcontroller.cpu.reset_reason)
+# this wake's diagnostics record, a run that ended early is saved for publishing first
+stalled_at = None
+if stalled != None and stalled[0] in mod_watchdog.PHASES:
+    stalled_at = (mod_watchdog.PHASES.index(stalled[0]), stalled[1])
+diag = mod_diag.begin(version, reset_reason, stalled_at)
+my_print("info", "boot {}", diag["boots"])
+# a crash record and new snapshots go to the chip now, the rest of the wake's changes at power down
+try:
+    my_print("debug", "EEPROM store: {} entries, {} pages written", kv_entries, mod_kvstore.flush())
+except OSError as ex:
+    my_print("warning", "EEPROM store not written: {}", ex)
+if stalled != None:
+    my_print("warning", "last wake stalled in phase {} after {:.1f} seconds, {} in a row", stalled[0], stalled[1], stalled[2])
+    if stalled[2] >= mod_watchdog.MAX_RELOADS:
+        my_print("error", "giving up until the next wake")
+        deep_sleep(sleep_time)
+if ota_version != None: my_print("info", "running OTA version {}", ota_version)
+my_print("info", "code_status is {}", code_status)
+
+#### I2C was set up first, with the EEPROM and the config
+my_print("info", "config from {}", mod_config.source)
+my_print("info", "calibrated probes: {}", calibrated)
+for error in config_errors:
+    my_print("warning", "settings.toml: {}", error)
+my_print("info", "Using i2c_onboard is {}, using i2c_qwiic is {}", i2c_board, i2c_qwiic)
+if i2c_board != None: i2c_connected = True
+else: i2c_connected = False
+if i2c_qwiic != None: i2c_qwiic_connected = True
+else: i2c_qwiic_connected = False
+
+# assign a battery sensor ... on the board bus mod_i2c owns, board.I2C() would claim the same pins
 if (model == "featherS2"):
     battery_sensor_found = False
     try:
-        battery_sensor = LC709203F(board.I2C())
-        my_print("info" ,"featherS2 battery sensor found, IC version {}".format(hex(battery_sensor.ic_version)))
+        battery_sensor = LC709203F(i2c_board)
+        my_print("info", "featherS2 battery sensor found, IC version {}", hex(battery_sensor.ic_version))
         battery_sensor_found = True
     except:
         my_print("info" ,"featherS2 battery sensor not found")
 
-#### Setup I2C
-i2c_board, i2c_qwiic = mod_i2c.init()
-my_print("info", "Using i2c_onboard is {}, using i2c_qwiic is {}".format(i2c_board, i2c_qwiic))
-if i2c_board != None: i2c_connected = True
-else: i2c_connected = False
-if i2c_qwiic != None: i2c_qwiic_connected = True
-else: i2c_qwiic_connected = False
-
 #### Setup I2C sensors
 
 ## The environmental sensors
@@ -462,7 +600,7 @@ if bme280 != None:
     my_print("info", "BME280 found")
     bme280_found = True
     # change this to match the location's pressure (hPa) at sea level
-    bme280.sea_level_pressure = 1020.0
+    bme280.sea_level_pressure = sea_level_pressure
 
 else:
     my_print("info", "BME280 not found")
@@ -473,20 +611,36 @@ if bme680 != None:
     my_print("info", "BME680 found")
     bme680_found = True
     # change this to match the location's pressure (hPa) at sea level
-    bme680.sea_level_pressure = 1020.0
+    bme680.sea_level_pressure = sea_level_pressure
     # You will usually have to add an offset to account for the temperature of
     # the sensor. This is usually around 5 degrees but varies by use. Use a
-    # separate temperature sensor to calibrate this one.
-    temperature_offset = -1
+    # separate temperature sensor to calibrate this one ... temperature_offset in the config
 else:
     my_print("info", "BME680 not found")
 
+# let the sensors average in hardware, each reading takes longer but is less noisy
+if sensor_oversample > 1:
+    try:
+        if bme280 != None:
+            mod_bme280.oversample(bme280, sensor_oversample)
+        if bme680 != None:
+            mod_bme680.oversample(bme680, sensor_oversample)
+    except (OSError, AttributeError, ValueError) as ex:
+        my_print("warning", "sensor oversampling not set: {}", ex)
+
+# every wake's energy model and watchdog budget start at init, INA260 or not
+ina260_found = False
+enter_phase("init")
+
 # check for an INA260 voltage/current sensor
 ina260 = mod_ina260.init(i2c_board, i2c_qwiic)
-ina260_found = False
 if ina260 != None:
     my_print("info", "INA260 found")
     ina260_found = True
+    if ina260_profiling:
+        mod_ina260.start_profile(ina260)
+        # the profile opens in the phase already entered
+        mod_ina260.mark(ina260, "init")
 else:
     my_print("info", "INA260 not found")
 
@@ -494,7 +648,7 @@ else:
 # indicate the health of the environmental sensors
 env_sensors_found = True
 if not (aht20_found or sht40_found or bme280_found or bme680_found):
-    my_print("info" ,"No sensor found, sleeping")
+    my_print("warning" ,"No sensor found, sleeping")
     mod_neopixel.no_sensors()
     env_sensors_found = False
     #deep_sleep(error_sleep)  # recover by deep sleep reset
@@ -506,84 +660,113 @@ if ds3231 != None:
 else:
     my_print("info", "DS3231 not found")
 
-# Set up the 24LC32 EEPROM on the DS3231 module we're using
-eeprom = mod_24lc32.init(i2c_board, i2c_qwiic)
+# The 24LC32 EEPROM on the DS3231 module we're using
 if eeprom != None:
     my_print("info", "EEPROM found")
 else:
     my_print("info", "EEPROM not found")
 
-# create a sensors dictionary
-sensors = {}
+# fill this wake's record, a fixed slot per metric
+enter_phase("sensors")
+gc.collect()
+heap_start = gc.mem_free()
+mod_record.clear()
+values = mod_record.values
+values[mod_record.RESET_REASON] = reset_reason
+if stalled != None:
+    values[mod_record.WATCHDOG_STALL] = mod_watchdog.PHASES.index(stalled[0]) if stalled[0] in mod_watchdog.PHASES else -1
+# the first reading of each sensor now, with SAMPLE_BURST the rest in upload_wait's pause()
+mod_sampling.init(sample_burst if transport == mod_transport.MQTT else 1)
 if env_sensors_found:
     #### READ SENSORS
     if aht20 != None:
-        sensor = mod_aht20.read(aht20)
-        sensors.update({sensor['type']:sensor})
+        mod_sampling.add_sampler(lambda: mod_aht20.read(aht20), (mod_record.AHT20_TEMP, mod_record.AHT20_HUM))
 
     if sht40 != None:
-        sensor = mod_sht40.read(sht40)
-        sensors.update({sensor['type']:sensor})
+        mod_sampling.add_sampler(lambda: mod_sht40.read(sht40), (mod_record.SHT40_TEMP, mod_record.SHT40_HUM))
 
     if bme280 != None:
-        sensor = mod_bme280.read(bme280)
-        sensors.update({sensor['type']:sensor})
+        mod_sampling.add_sampler(lambda: mod_bme280.read(bme280),
+                                 (mod_record.BME280_TEMP, mod_record.BME280_HUM, mod_record.BME280_PRES, mod_record.BME280_ALT))
 
     if bme680 != None:
-        sensor = mod_bme680.read(bme680)
-        sensors.update({sensor['type']:sensor})
-
-    if ds3231 != None:
-        sensor = mod_ds3231.read(ds3231)
-        sensors.update({sensor['type']:sensor})
-
-    if soil_moisture_detector_used:
-        sensor = mod_soil_probe.read(soil_moisture_power, soil_adc)
-        sensors.update({sensor['type']:sensor})
-
-    if battery_probe_used:
-        sensor = mod_battery_voltage.read(battery_adc)
-        sensors.update({sensor['type']:sensor})
-        while(False):
-            time.sleep(1.0)
-            sensor = mod_battery_voltage.read(battery_adc)
-            print("divider {} voltage {}".format(sensor["divider_reading"], sensor["battery_voltage"]))
-
-
-if eeprom != None:
-    # Check the upper EEPROM for flag ... bytearray\(b'KFRANKS'\)
-    begin = 4000
-    store = bytearray(b'KFRANKS')
-    end = begin + len(store)
-    #print("begin {} -> {}".format(begin, end))
-    sensor = mod_24lc32.read(eeprom, begin, end)
-    sensors.update({sensor['type']:sensor})
+        mod_sampling.add_sampler(lambda: mod_bme680.read(bme680, temperature_offset),
+                                 (mod_record.BME680_TEMP, mod_record.BME680_HUM, mod_record.BME680_PRES,
+                                  mod_record.BME680_ALT, mod_record.BME680_GAS))
+    mod_sampling.sample()
+
+# every analog channel in one pass, the soil probe rail powered once
+analog_raw = mod_analog.read_all()
+if mod_soil_probe.CHANNEL in analog_raw:
+    mod_soil_probe.read(analog_raw[mod_soil_probe.CHANNEL])
+if mod_battery_voltage.CHANNEL in analog_raw:
+    mod_battery_voltage.read(analog_raw[mod_battery_voltage.CHANNEL])
+
+if ina260_found:
+    mod_ina260.read(ina260)
+
+if mod_kvstore.available():
+    # Check the EEPROM store for the flag, the 'KFRANKS' bytes at 4000 before the store existed
+    rtc_flag = mod_kvstore.get("rtc_set", "<B")
+    if rtc_flag == None and mod_kvstore.legacy(4000, 7) == b'KFRANKS':
+        mod_kvstore.put("rtc_set", "<B", 1)
+        rtc_flag = (1,)
     # if we have set the flag, just say so, otherwise set it
-    if str(sensor['value_list']) == str(store):
-        my_print("info", "{} - EEPROM matches 'KFRANKS'".format(sensor['status_message']))
+    if rtc_flag != None and rtc_flag[0]:
+        my_print("info", "EEPROM store has the DS3231 set flag")
     else:
-        my_print("info", "{} - EEPROM contains - {} - DS3231 NEEDS TO BE SET".format(sensor['status_message'], sensor['value_list']))
+        my_print("info", "EEPROM store has no DS3231 set flag - DS3231 NEEDS TO BE SET")
         # This tells us to set the DS3231 to the current time. We only need to do this once.
         set_ds3231 = True
+# a set DS3231 keeps the wake slot on the wall clock
+if ds3231 != None and not set_ds3231:
+    mod_schedule.clock = lambda: time.mktime(ds3231.datetime)
+if wake_slot != None:
+    values[mod_record.WAKE_SLOT] = wake_slot
+    wall_time = mod_schedule.wall_clock()
+    if wall_time != None:
+        values[mod_record.WAKE_PHASE] = mod_schedule.lateness(wall_time)
+    # after a power cut the whole fleet boots at once: back to sleep until this node's slot, or for
+    # a TPL5110 wake the DONE hold cannot bring back, wait it out powered down; no radio this wake
+    slot_wait = 0.0
+    if first_after_power_on:
+        slot_wait = mod_schedule.power_on_wait()
+    elif powerdown_method == "TPL5110" and mod_schedule.off_slot(wake_hold_max, upload_wait + 5):
+        slot_wait = mod_schedule.hold_for_slot(0.2, sleep_time)
+    if slot_wait >= 1:
+        my_print("info", "Off wake slot {}, {:.0f} seconds to go", wake_slot, slot_wait)
+        mod_diag.finish(mod_watchdog.PHASES.index("sensors"), gc.mem_free())
+        if sdcard_filesystem:
+            file_handler.close()
+        if sdcard_found:
+            close_sd_index()
+        if powerdown_method == "TPL5110":
+            cut_power(slot_wait)
+        deep_sleep(slot_wait, False)
 
 if (model == "qtpy") and using_bff:
-    bff = (adc2.value/10000.0)*1.0183
-    #vA0 = (adc0.value * 3.3) / 65536
-    #vA1 = (adc1.value * 3.3) / 65536
-    vA2 = (adc2.value * 3.3) / 65536
-    #vA3 = (adc3.value * 3.3) / 65536
+    raw = analog_raw["bff"]
     voltage = 0
-    if charger == "solar": voltage = vA2
-    if charger == "bff": voltage = bff
-    sensors.update({"battery_voltage": voltage})
+    if charger == "solar": voltage = mod_analog.volts(raw)
+    if charger == "bff": voltage = mod_calibration.lookup("bff", raw)
+    values[mod_record.BFF_VOLTAGE] = voltage
+elif (model == "featherS2") and battery_sensor_found:
+    voltage = battery_sensor.cell_voltage
+    cell_percent = battery_sensor.cell_percent
+    values[mod_record.LC709203F_VOLTAGE] = voltage
+    values[mod_record.LC709203F_PERCENT] = cell_percent
 
-sensors.update({"version": version})
-sensors.update({"code_status": code_status})
-sensors.update({"microcontroller.cpu.reset_reason": microcontroller.cpu.reset_reason})
+if (model == "qtpy") or (model == "featherS2"):
+    values[mod_record.CPU_TEMP] = (9.0/5.0)*microcontroller.cpu.temperature + 32.0
+if (model == "featherS3"):
+    values[mod_record.CPU_TEMP] = (9.0/5.0)*microcontroller.cpus[0].temperature + 32.0
+heap_read = heap_start - gc.mem_free()
 
+if mod_log.enabled(mod_log.DEBUG):
+    if ds3231 != None:
+        my_print("debug", "DS3231 time {}", mod_ds3231.read(ds3231)['datetime'])
+    my_print("debug", "VERSION: {}, code_status: {}, reset reason: {}", version, code_status, microcontroller.cpu.reset_reason)
 
-#### setup watchdog to catch issues with WiFi or MQTT broker connections
-wdt = setup_watchdog(watchdog_timeout)
 
 # Add a secrets.py to your filesystem that has a dictionary called secrets with
 # "ssid" and "password" keys with your WiFi credentials.
@@ -595,29 +778,37 @@ wdt = setup_watchdog(watchdog_timeout)
 try:
     from secrets import secrets
 except ImportError:
-    my_print("info" ,"WiFi secrets are kept in secrets.py, please add them there!")
+    my_print("critical" ,"WiFi secrets are kept in secrets.py, please add them there!")
     raise
 
 # Connect to WiFi
-if connect_to_wifi:
-    wifi_connected = False
+enter_phase("wifi")
+wifi_connected = False
+if transport == mod_transport.LORA:
+    # no WiFi at all, the gateway republishes under the node number instead of the IP octet
+    wifi.radio.enabled = False
+    topic_prefix = '{}/{}'.format(model, config["lora_node"])
+    mod_record.set_prefix(topic_prefix)
+    do_connect_to_broker = False
+    do_send_to_broker = False
+elif connect_to_wifi:
     try:
-        my_print("info" ,"Connecting to %s" % secrets["ssid"])
+        my_print("info", "Connecting to {}", secrets["ssid"])
         wifi.radio.connect(secrets["ssid"], secrets["password"])
-        my_print("info" ,"Connected to %s!" % secrets["ssid"])
-        my_print("info" ,"Using IP %s" % wifi.radio.ipv4_address)
+        my_print("info", "Connected to {}!", secrets["ssid"])
+        my_print("info", "Using IP {}", wifi.radio.ipv4_address)
         this_ip = wifi.radio.ipv4_address
         regex = re.compile("[\.]")
         octets = regex.split("{}".format(this_ip))
         topic_prefix = '{}/{}'.format(model, octets[-1])
-        my_print("info" ,"topic_prefix = {}".format(topic_prefix))
+        mod_record.set_prefix(topic_prefix)
+        my_print("info", "topic_prefix = {}", topic_prefix)
         wifi_connected = True
-        sensors.update({"IP": wifi.radio.ipv4_address})
-        sensors.update({"topic_prefix": topic_prefix})
-        my_print("info", "SENSORS: {}".format(sensors))
+        if mod_log.enabled(mod_log.DEBUG):
+            my_print("debug", "SENSORS: {}", mod_record.as_dict())
     except ConnectionError:
-        my_print("info" ,"Failed to connect...ConnectionError, wait {} seconds and reload".format(reload_wait_time))
-        time.sleep(reload_wait_time)
+        my_print("error", "Failed to connect...ConnectionError, wait {} seconds and reload", reload_wait_time)
+        wait_before_reset(reload_wait_time)
         # Set up for deep sleep to conserve battery
         deep_sleep(sleep_time)  # Normal stuff
 
@@ -626,32 +817,39 @@ else:
     do_send_to_broker = False
     sleep_time = error_sleep
 
+if transport == mod_transport.MQTTSN:
+    # readings go as datagrams to the MQTT-SN gateway, there is no broker session
+    do_connect_to_broker = False
+    do_send_to_broker = False
+
 # Create a socket pool
 pool = socketpool.SocketPool(wifi.radio)
 # !!! DO THIS ONCE, THEN UNSET set_ds3231
-if set_ds3231:
+if set_ds3231 and transport == mod_transport.MQTT:  # NTP needs the WiFi
     sensor = mod_ds3231.read(ds3231)
-    my_print("info", "DS3231 IS SET TO - {}".format(sensor))
+    my_print("info", "DS3231 IS SET TO - {}", sensor)
     ds3231_is_set = mod_ds3231.set(ds3231, pool)
     sensor = mod_ds3231.read(ds3231)
-    my_print("info", "DS3231 IS SET TO - {}".format(sensor))
+    my_print("info", "DS3231 IS SET TO - {}", sensor)
     if ds3231_is_set:
         # set the flag in EEPROM
-        my_print("info", "Writing {} to EEPROM".format(store))
-        status_message = mod_24lc32.set(eeprom, begin, end, store) # 'KFRANKS
-        my_print("info", "{}".format(status_message))
+        my_print("info", "Setting the DS3231 flag in the EEPROM store")
+        mod_kvstore.put("rtc_set", "<B", 1)
+        mod_schedule.clock = lambda: time.mktime(ds3231.datetime)
 
 
 
 """ MQTT stuff """
-# Set up a MiniMQTT Client
+# Set up a MiniMQTT Client, TLS (and its context) only for a TLS port
+use_tls = secrets["port"] == 8883
 mqtt_client = MQTT.MQTT(
     broker=secrets["broker"],
     port=secrets["port"],
     #username=secrets["aio_username"],
     #password=secrets["aio_key"],
     socket_pool=pool,
-    ssl_context=ssl.create_default_context(),
+    is_ssl=use_tls,
+    ssl_context=ssl.create_default_context() if use_tls else None,
 )
 
 # Initialize an Adafruit IO MQTT Client
@@ -666,16 +864,42 @@ mqtt_client.on_publish = publish
 mqtt_client.on_message = message
 
 # connect to broker
+enter_phase("broker")
 if connect_to_broker():
     my_print("info" ,"Connected to Broker")
 else:
-    my_print("info" ,"Failed to connect to Broker, wait {} seconds and reload".format(reload_wait_time))
-    time.sleep(reload_wait_time)
+    my_print("info", "Failed to connect to Broker, wait {} seconds and reload", reload_wait_time)
+    wait_before_reset(reload_wait_time)
     # Set up for deep sleep to conserve battery
     deep_sleep(sleep_time)  # Normal stuff
 
+# pick up retained config updates, fleet wide then this node's own
+config_topics = ("{}/config".format(model), "{}/config".format(topic_prefix))
+ota_prefix = "{}/ota/".format(model)
+if do_connect_to_broker and mqtt_client.is_connected():
+    try:
+        for topic in config_topics:
+            mqtt_client.subscribe(topic)
+        # retained messages arrive right after the subscribe
+        mqtt_client.loop(1)
+    except WatchDogTimeout:
+        raise
+    except Exception as ex:
+        my_print("warning", "config subscribe failed: {}", ex)
+
+# fetch changed modules for a new OTA version, staged on the SD for the next boot
+if ota_enabled and sdcard_found and do_connect_to_broker and mqtt_client.is_connected():
+    try:
+        my_print("info", "OTA: {}", mod_ota.check(mqtt_client, model, ota_budget))
+    except WatchDogTimeout:
+        raise
+    except Exception as ex:
+        my_print("error", "OTA check failed: {}", ex)
+
 """ Show everyone we're alive """
-mod_neopixel.connected_health(do_send_to_broker)
+enter_phase("health")
+mod_neopixel.connected_health(do_send_to_broker or transport != mod_transport.MQTT)
+enter_phase("publish")
 
 """ Manually publish new values to Broker """
 ## Explicitly pump the message loop.
@@ -687,107 +911,179 @@ mod_neopixel.connected_health(do_send_to_broker)
 #else:
 #    my_print("info" ,"\n")
 
-# publish_to_broker(tag, nomenclature, value)
+# publish every filled slot of the record, topics are prefix/Sensor/Metric
 # topic_prefix is qtpy/xxx, where xxx is the last byte of the IP for this model
+heap_start = gc.mem_free()
 if (model == "qtpy") or (model == "featherS2") or (model == "featherS3"):
-    publish_to_broker("{}/ResetReason".format(topic_prefix), "f", float("{}.0".format(reset_reason)))
-    if env_sensors_found:
-        if aht20_found:
-            publish_to_broker("{}/AHT20/Temp".format(topic_prefix), "F", sensors['aht20']['tempF'])
-            publish_to_broker("{}/AHT20/Humidity".format(topic_prefix), "Percent", sensors['aht20']['humP'])
-        if sht40_found:
-            publish_to_broker("{}/SHT40/Temp".format(topic_prefix), "F", sensors['sht40']['tempF'])
-            publish_to_broker("{}/SHT40/Humidity".format(topic_prefix), "Percent", sensors['sht40']['tempF'])
-        if bme280_found:
-            publish_to_broker("{}/BME280/Temp".format(topic_prefix), "F", sensors['bme280']['tempF'])
-            publish_to_broker("{}/BME280/Humidity".format(topic_prefix), "Percent", sensors['bme280']['humP'])
-            publish_to_broker("{}/BME280/Pressure".format(topic_prefix), "inHG", sensors['bme280']['presH'])
-            publish_to_broker("{}/BME280/Altitude".format(topic_prefix), "meters", sensors['bme280']['altM'])
-        if bme680_found:
-            publish_to_broker("{}/BME680/Temp".format(topic_prefix), "F", sensors['bme680']['tempF'])
-            publish_to_broker("{}/BME680/Humidity".format(topic_prefix), "Percent", sensors['bme680']['humP'])
-            publish_to_broker("{}/BME680/Pressure".format(topic_prefix), "inHG", sensors['bme680']['presH'])
-            publish_to_broker("{}/BME680/Altitude".format(topic_prefix), "meters", sensors['bme680']['altM'])
-            publish_to_broker("{}/BME680/Gas".format(topic_prefix), "ohm", sensors['bme680']['gasOhm'])
-
-    if ina260_found:
-        publish_to_broker("{}/INA260/Battery".format(topic_prefix), "V", ina260.voltage)
-        publish_to_broker("{}/INA260/Current".format(topic_prefix), "mA", ina260.current)
-        publish_to_broker("{}/INA260/Power".format(topic_prefix), "mW", ina260.power)
-    if (model == "qtpy") and using_bff:
-        publish_to_broker("{}/BFF/BatteryADC".format(topic_prefix), "V", voltage)
-        if soil_moisture_detector_used:
-            publish_to_broker("{}/Soil/Moisture".format(topic_prefix), "Percent", sensors['soil_probe']['soil_value'])
-        if battery_probe_used:
-            publish_to_broker("{}/Battery/Voltage".format(topic_prefix), "Volts", sensors['battery']['battery_voltage'])
-    elif (model == "featherS2"):
-        if battery_sensor_found:
-            voltage = battery_sensor.cell_voltage
-            cell_percent = battery_sensor.cell_percent
-            publish_to_broker("{}/LC709203F/BatteryVoltage".format(topic_prefix), "V", voltage)
-            publish_to_broker("{}/LC709203F/BatteryPercent".format(topic_prefix), "Percent", cell_percent)
-        if soil_moisture_detector_used:
-            publish_to_broker("{}/Soil/Moisture".format(topic_prefix), "Percent", sensors['soil_probe']['soil_value'])
-        if battery_probe_used:
-            publish_to_broker("{}/Battery/Voltage".format(topic_prefix), "Volts", sensors['battery']['battery_voltage'])
-    else:
-        pass
-
+    mod_record.publish(publish_to_broker, 0, mod_record.INA260_PEAK)
 else:
-    my_print("info" ,"unknown model {}".format(model))
+    my_print("info", "unknown model {}", model)
+if transport == mod_transport.MQTTSN and wifi_connected:
+    # one datagram per reading to predefined topic ids, QoS 1 adds a CONNECT and the PUBACKs
+    try:
+        mqttsn_gateway = secrets.get("mqttsn_gateway", secrets["broker"])
+        if not mod_mqttsn.begin(pool, mqttsn_gateway, config["mqttsn_port"], config["mqttsn_qos"], topic_prefix):
+            my_print("warning", "no CONNACK from the MQTT-SN gateway at {}", mqttsn_gateway)
+        my_print("info", "MQTT-SN: {} readings sent", mod_mqttsn.publish_record(model, 0, mod_record.INA260_PEAK))
+        mod_diag.publish(lambda payload: mod_mqttsn.publish(mod_mqttsn.topic_id(model, mod_mqttsn.DIAG_SLOT), payload, True))
+    except WatchDogTimeout:
+        raise
+    except Exception as ex:
+        my_print("error", "MQTT-SN publish failed: {}", ex)
+heap_publish = heap_start - gc.mem_free()
 
-if (model == "qtpy") or (model == "featherS2"):
-    publish_to_broker("{}/Onboard/CPUTemp".format(topic_prefix), "F", (9.0/5.0)*microcontroller.cpu.temperature + 32.0)
-if (model == "featherS3"):
-    publish_to_broker("{}/Onboard/CPUTemp".format(topic_prefix), "F", (9.0/5.0)*microcontroller.cpus[0].temperature + 32.0)
-my_print("info" ,"")
+# diagnostics of earlier wakes not yet published, retained so the fleet's latest is always visible
+if do_send_to_broker and do_connect_to_broker and mqtt_client.is_connected():
+    try:
+        sent = mod_diag.publish(lambda payload: mqtt_client.publish("{}/diag".format(topic_prefix), payload, retain=True))
+        my_print("info", "published {} diagnostics records", sent)
+    except WatchDogTimeout:
+        raise
+    except Exception as ex:
+        my_print("warning", "diagnostics publish failed: {}", ex)
+my_print("debug", "heap used reading {} bytes, publishing {} bytes", heap_read, heap_publish)
+my_print("debug", "I2C bus stats: {}", mod_i2c.stats())
+my_print("debug", "EEPROM store stats: {}", mod_kvstore.stats)
 
 # wait for data to get uploaded
-upload_wait = 5
-my_print("info" ,"Wait {} seconds for the data to get uploaded".format(upload_wait))
-time.sleep(upload_wait)
+my_print("info", "Wait {} seconds for the data to get uploaded", upload_wait)
+enter_phase("upload_wait")
+if transport == mod_transport.MQTT:
+    pause(upload_wait)
+
+# the first readings went out above, on time; the whole burst's mean and spread go in one stats record
+if mod_sampling.burst > 1:
+    my_print("info", "{} readings per sensor", mod_sampling.taken)
+    if do_send_to_broker and do_connect_to_broker and mqtt_client.is_connected():
+        try:
+            mqtt_client.publish("{}/stats".format(topic_prefix), mod_sampling.as_json())
+        except WatchDogTimeout:
+            raise
+        except Exception as ex:
+            my_print("warning", "stats publish failed: {}", ex)
+
+battery_percent = None
+if (model == "qtpy") and using_bff:
+    battery_percent = mod_energy.state_of_charge(voltage)
+elif (model == "featherS2") and battery_sensor_found:
+    battery_percent = cell_percent
+
+# the readings are out, ship what the host hasn't got of the SD files, a bounded amount per wake
+if logship_chunks and sd_status != None and do_send_to_broker and do_connect_to_broker and mqtt_client.is_connected():
+    if logship_min_battery > 0 and (battery_percent == None or battery_percent < logship_min_battery):
+        my_print("info", "log shipping skipped, battery at {}%", battery_percent)
+    else:
+        try:
+            mod_sdindex.touch(log_filepath)
+            mod_logship.load()
+            shipped = mod_logship.ship(
+                lambda name, payload: mqtt_client.publish("{}/logship/{}".format(topic_prefix, name), payload, qos=1),
+                mod_sdindex.files, config["logship_chunk"], logship_chunks, logship_budget)
+            my_print("info", "shipped {} log chunks, {} bytes still to go", shipped, mod_logship.backlog(mod_sdindex.files))
+        except WatchDogTimeout:
+            raise
+        except Exception as ex:
+            my_print("warning", "log shipping stopped: {}", ex)
+        try:
+            mod_logship.save()
+        except OSError as ex:
+            my_print("warning", "log shipping offsets not saved: {}", ex)
+
+# publish the power profile of this wake, everything up to the disconnect
+if ina260_profiling and ina260_found:
+    phases = mod_ina260.summary()
+    if phases != None:
+        for phase in phases:
+            publish_to_broker("{}/INA260/Energy/{}".format(topic_prefix, phase), "mWh", phases[phase])
+
+# publish the modelled energy of this cycle and the projected battery runtime
+phase_durations = mod_energy.phase_durations()
+# backend/energy_model.py reads these lines back from the SD log
+if config["log_profile"]:
+    mod_log.record("PROFILE: {}", {"phases": phase_durations, "sleep_time": sleep_time, "powerdown_method": powerdown_method})
+elif mod_log.enabled(mod_log.DEBUG):
+    my_print("debug", "PROFILE: {}", {"phases": phase_durations, "sleep_time": sleep_time, "powerdown_method": powerdown_method})
+cycle = mod_energy.cycle_energy(phase_durations, sleep_time, powerdown_method, current_model)
+# a status pattern still running has had its time, account for every powered second
+mod_neopixel.stop()
+power_on = mod_power.on_time()
+my_print("info", "power domains on (s): {}", power_on)
+values[mod_record.POWER_PIXEL] = power_on.get(mod_neopixel.DOMAIN, 0.0)
+values[mod_record.POWER_SOIL] = power_on.get("soil", 0.0)
+values[mod_record.POWER_SD] = power_on.get("sd", 0.0)
+if sd_status != None:
+    values[mod_record.SD_FREE] = sd_status["free"] / 1000000
+    values[mod_record.SD_USED] = sd_status["used"] / 1000000
+values[mod_record.ENERGY_AWAKE] = cycle['awake_s']
+values[mod_record.ENERGY_RADIO] = cycle['radio_s']
+values[mod_record.ENERGY_CYCLE] = cycle['energy_mWh']
+if battery_percent != None:
+    values[mod_record.ENERGY_RUNTIME] = mod_energy.runtime_hours(battery_percent, battery_capacity_mAh, cycle)
+mod_record.publish(publish_to_broker, mod_record.INA260_PEAK)
+if transport == mod_transport.MQTTSN and mod_mqttsn.sock != None:
+    try:
+        mod_mqttsn.publish_record(model, mod_record.INA260_PEAK)
+        missing = mod_mqttsn.wait()
+        if missing:
+            my_print("warning", "MQTT-SN: {} readings never acknowledged", missing)
+        my_print("debug", "MQTT-SN stats: {}", mod_mqttsn.stats)
+    except WatchDogTimeout:
+        raise
+    except Exception as ex:
+        my_print("error", "MQTT-SN publish failed: {}", ex)
+    mod_mqttsn.end()
+if transport == mod_transport.LORA:
+    # every slot in one frame, on the SPI bus the SD card shares
+    try:
+        mod_transport.init_lora(spi, config["lora_cs"], config["lora_reset"], config["lora_frequency"], config["lora_tx_power"])
+        frame_size, dropped = mod_transport.send_record(model, config["lora_node"])
+        my_print("info", "LoRa frame of {} bytes sent", frame_size)
+        if dropped:
+            my_print("warning", "left out of the LoRa frame: {}", [mod_record.TOPICS[slot] for slot in dropped])
+    except WatchDogTimeout:
+        raise
+    except Exception as ex:
+        my_print("error", "LoRa send failed: {}", ex)
 disconnect_from_broker()
 
+# a full wake on a trial OTA version, keep it
+if ota_version != None:
+    mod_ota.mark_good()
+
 
 #### the end is near
-powerdown_method = "TPL5110"
+enter_phase("shutdown")
+my_print("info", "diagnostics: {}", mod_diag.finish(mod_watchdog.PHASES.index("shutdown"), gc.mem_free()))
 if powerdown_method == "deep_sleep":
-    my_print("info" ,"Deep sleep for {} seconds...".format(this_sleep_time))
-    if sdcard_found:
+    my_print("info", "Deep sleep for {} seconds...", mod_schedule.sleep_for(sleep_time))
+    if sdcard_filesystem:
         my_print("info" ,"Closing logger filehandle...this forces writes to SD")
         my_print("info" ,"")
         file_handler.close()  # We're done with the logger file handle, close it
-        print_directory("/sd") # print filesystem contents
+    if sdcard_found:
+        close_sd_index()  # the log file's new size and OTA's files, no walk of the card
     # Set up for deep sleep to conserve battery
     deep_sleep(sleep_time)  # Normal stuff
 if powerdown_method == "watchdog":
-    # feed the watchdog
-    my_print("info" ,"Feed the watchdog")
-    wdt.feed()
-    my_print("info" ,"Deep sleep for {} seconds...".format(this_sleep_time))
-    if sdcard_found:
+    my_print("info", "Deep sleep for {} seconds...", mod_schedule.sleep_for(sleep_time))
+    if sdcard_filesystem:
         my_print("info" ,"Closing logger filehandle...this forces writes to SD")
         my_print("info" ,"")
         file_handler.close()  # We're done with the logger file handle, close it
-        print_directory("/sd") # print filesystem contents
+    if sdcard_found:
+        close_sd_index()  # the log file's new size and OTA's files, no walk of the card
     deep_sleep(sleep_time)  # Normal stuff
 if powerdown_method == "TPL5110":
     #### Set up the pin that indicates DONE for the TPL5110, the circuit cuts off our supply
     # set it True (DONE)
     this_delay = 2
-    my_print("info" ,"Telling TPL5110 to shut down power...in {} seconds".format(this_delay))
-    if sdcard_found:
+    # held back to this node's wake slot, the TPL5110's interval is WAKE_HOLD_MAX short of SLEEP_TIME
+    this_delay += mod_schedule.hold_for_slot(this_delay + 0.2, wake_hold_max)
+    my_print("info", "Telling TPL5110 to shut down power...in {} seconds", this_delay)
+    if sdcard_filesystem:
         my_print("info" ,"Closing logger filehandle...this forces writes to SD")
         my_print("info" ,"")
         file_handler.close()  # We're done with the logger file handle, close it
-        print_directory("/sd") # print filesystem contents
-    time.sleep(this_delay)
-    DONE = digitalio.DigitalInOut(board.RX) # GPIO/RX
-    DONE.direction = digitalio.Direction.OUTPUT
-    DONE.value = False
-    set_pin = True
-    time.sleep(0.2)
-    DONE.value = True
-    time.sleep(0.8)
-    DONE.value = False
-    deep_sleep(sleep_time)  # Normal stuff
+    if sdcard_found:
+        close_sd_index()  # the log file's new size and OTA's files, no walk of the card
+    cut_power(this_delay)
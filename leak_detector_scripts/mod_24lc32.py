@@ -1,5 +1,21 @@
+import time
 import adafruit_24lc32
 
+PAGE_SIZE = 32          # a write never crosses a page, the chip wraps inside it
+WRITE_CYCLE = 0.01      # seconds of ACK polling before a page write counts as failed
+
+
+def crc16(data, crc=0xFFFF):
+    """ CRC-16/CCITT-FALSE, guards the blocks other modules keep in the EEPROM """
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+    return crc
+
 
 def init(i2c_board, i2c_qwiic):
     eeprom = None
@@ -49,12 +65,37 @@ def read(eeprom, begin, end):
         except Exception as ex:
             status_message = "ERROR: EEPROM multi-value read issue:\n{}".format(ex)
 
-    sensor_data = {
-        "type": "24ls32",
-        "begin": begin,
-        "end": end,
-        "value_list": '{}'.format(value_list),
-        "status_message": status_message
-    }
+    # the raw bytes, compare them with the expected bytes directly
+    return value_list, status_message
+
+
+def read_block(eeprom, begin, length):
+    """ length bytes from begin in one sequential read """
+    buffer = bytearray(length)
+    with eeprom._i2c as i2c:
+        i2c.write_then_readinto(bytes((begin >> 8, begin & 0xFF)), buffer)
+    return buffer
+
+
+def ack_poll(eeprom, timeout=WRITE_CYCLE):
+    """ The chip NACKs its address until the write cycle ends; returns the polls it took """
+    deadline = time.monotonic() + timeout
+    polls = 0
+    while True:
+        polls += 1
+        try:
+            with eeprom._i2c as i2c:
+                i2c.write(b"")
+            return polls
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+
 
-    return sensor_data
+def write_page(eeprom, address, data):
+    """ One page write, address and data in a single transaction, then ACK polling """
+    if address // PAGE_SIZE != (address + len(data) - 1) // PAGE_SIZE:
+        raise ValueError("write at {} of {} bytes crosses a page".format(address, len(data)))
+    with eeprom._i2c as i2c:
+        i2c.write(bytes((address >> 8, address & 0xFF)) + bytes(data))
+    return ack_poll(eeprom)
@@ -1,4 +1,5 @@
 import adafruit_ahtx0
+import mod_record
 
 def init(i2c_board, i2c_qwiic):
     aht20 = None
@@ -16,10 +17,7 @@ def init(i2c_board, i2c_qwiic):
 
 
 def read(aht20):
-    sensor_data = {
-    	"type":  "aht20",
-        "tempF": (9.0/5.0)*aht20.temperature + 32.0,
-        "tempC": aht20.temperature,
-        "humP":  aht20.relative_humidity
-             }
-    return sensor_data
+    # every property read is a new ~80ms measurement, so read each one once
+    values = mod_record.values
+    values[mod_record.AHT20_TEMP] = (9.0/5.0)*aht20.temperature + 32.0
+    values[mod_record.AHT20_HUM] = aht20.relative_humidity
@@ -0,0 +1,105 @@
+import time
+import board
+import analogio
+import mod_power
+
+""" one owner for the analog inputs and the probe power pins
+
+    Channels are opened only while they are sampled and deinit right after,
+    and the channels sharing a power rail are read in one powered window, so
+    each rail settles once per wake. Rails are mod_power domains, so their
+    on-time is accounted with the rest. The AnalogIn and power pin constructors
+    can be swapped for simulated ones.
+"""
+# model -> channel -> (analog pin, power rail or None)
+PINS = {
+    "qtpy":      {"soil": ("A3", "soil"), "battery": ("A1", None), "bff": ("A2", None)},
+    "featherS2": {"soil": ("A3", "soil"), "battery": ("A1", None)},
+    "featherS3": {"soil": ("A3", "soil"), "battery": ("A1", None)},
+}
+# model -> rail -> (enable pin, seconds to settle after power up)
+RAILS = {
+    "qtpy":      {"soil": ("D18", 2.0)},    # GPIO/D18 (AKA A0)
+    "featherS2": {"soil": ("D11", 2.0)},
+    "featherS3": {"soil": ("D11", 2.0)},
+}
+
+channels = {}       # name -> (pin, rail)
+rails = {}          # rail -> seconds to settle, the enable pin is in mod_power
+analog_in = None
+sleep = time.sleep
+
+
+def volts(raw, vref=3.3):
+    """ A raw 16-bit AnalogIn reading in volts """
+    return (raw * vref) / 65536
+
+
+def init(model, names, analog_factory=None, power_factory=None, sleep_fn=None):
+    """ Set up the named channels for this model; returns the names available """
+    global analog_in, sleep
+    if model not in PINS:
+        raise ValueError("no analog pins known for model {}".format(model))
+    analog_in = analog_factory or analogio.AnalogIn
+    if sleep_fn is not None:
+        sleep = sleep_fn
+    make_power = power_factory or mod_power.pin
+    channels.clear()
+    rails.clear()
+    pins = PINS[model]
+    for name in names:
+        if name not in pins:
+            continue
+        pin, rail = pins[name]
+        channels[name] = (getattr(board, pin), rail)
+        if rail is not None and rail not in rails:
+            enable, settle = RAILS[model][rail]
+            mod_power.add(rail, make_power(getattr(board, enable)))
+            rails[rail] = settle
+    return list(channels)
+
+
+def sample(pin, samples):
+    adc = analog_in(pin)
+    try:
+        total = 0
+        for _ in range(samples):
+            total += adc.value
+    finally:
+        # a live AnalogIn keeps the ADC powered
+        adc.deinit()
+    return total // samples
+
+
+def read_all(names=None, samples=1):
+    """ Raw readings by channel name, one power window per rail """
+    if names is None:
+        names = list(channels)
+    by_rail = {}
+    for name in names:
+        if name in channels:
+            by_rail.setdefault(channels[name][1], []).append(name)
+    raws = {}
+    for rail in by_rail:
+        if rail is not None:
+            mod_power.on(rail)
+            sleep(rails[rail])
+        try:
+            for name in by_rail[rail]:
+                raws[name] = sample(channels[name][0], samples)
+        finally:
+            if rail is not None:
+                mod_power.off(rail)
+    return raws
+
+
+def read(name, samples=1):
+    return read_all((name,), samples).get(name)
+
+
+def deinit():
+    for rail in rails:
+        mod_power.off(rail)
+        mod_power.domains[rail][0].deinit()
+    rails.clear()
+    channels.clear()
@@ -1,33 +1,14 @@
-import time
-import board
-import digitalio
-import analogio
-from board import A1
-from adafruit_simplemath import map_range
+import mod_record
+import mod_calibration
 
-def get_voltage(pin):
-    return (pin.value * 3.3) / 65536
+""" external battery monitor on A1 through the 12k-3k divider
 
-def init(model):
-    probe_ready = False
-    ## Power pin for soil moisture detector
-    if (model == "featherS2") or (model == "featherS3"):
-        adc = analogio.AnalogIn(A1)
-        probe_ready = True
-    if (model == "qtpy"):
-        adc = analogio.AnalogIn(A1)
-        probe_ready = True
-    return probe_ready, adc
+    mod_analog owns the pin; this turns the raw reading into volts.
+"""
+CHANNEL = "battery"
 
-def read(adc):
-    # Power up the soil probe and let it stabilize before taking reading
-    time.sleep(1)
-    divider_reading = 1.0 * get_voltage(adc)
-    battery_voltage = map_range(divider_reading, 0.032 , 3.2, 0.0, 16.0)
-    # Power down the soil probe
-    sensor_data = {
-    	"type":  "battery",
-        "divider_reading": divider_reading,
-        "battery_voltage": battery_voltage
-             }
-    return sensor_data
+
+def read(raw):
+    # the calibrated divider curve replaces map_range(v, 0.032, 3.2, 0.0, 16.0)
+    mod_record.values[mod_record.BATTERY_VOLTAGE] = mod_calibration.lookup(CHANNEL, raw)
+    return mod_calibration.volts(CHANNEL, raw)
@@ -1,4 +1,5 @@
-from adafruit_bme280 import basic as adafruit_bme280
+from adafruit_bme280 import advanced as adafruit_bme280
+import mod_record
 
 def init(i2c_board, i2c_qwiic):
     bme280 = None
@@ -21,13 +22,23 @@ def init(i2c_board, i2c_qwiic):
     return bme280
 
 
+def altitude(pressure, sea_level_pressure):
+    # same formula as the driver, without another pressure conversion
+    return 44330 * (1.0 - (pressure / sea_level_pressure) ** 0.1903)
+
+
+def oversample(bme280, times):
+    # the chip's own averaging per measurement, times is 1, 2, 4, 8 or 16
+    code = getattr(adafruit_bme280, "OVERSCAN_X{}".format(times))
+    bme280.overscan_temperature = code
+    bme280.overscan_humidity = code
+    bme280.overscan_pressure = code
+
+
 def read(bme280):
-    sensor_data = {
-    	"type":  "bme280",
-        "tempF": (9.0/5.0)*bme280.temperature + 32.0,
-        "tempC": bme280.temperature,
-        "humP":  bme280.relative_humidity,
-        "presH": bme280.pressure*0.030,
-        "altM":  bme280.altitude
-             }
-    return sensor_data
+    values = mod_record.values
+    pressure = bme280.pressure
+    values[mod_record.BME280_TEMP] = (9.0/5.0)*bme280.temperature + 32.0
+    values[mod_record.BME280_HUM] = bme280.relative_humidity
+    values[mod_record.BME280_PRES] = pressure*0.030
+    values[mod_record.BME280_ALT] = altitude(pressure, bme280.sea_level_pressure)
@@ -1,4 +1,6 @@
 import adafruit_bme680
+import mod_record
+from mod_bme280 import altitude
 
 def init(i2c_board, i2c_qwiic):
     bme680 = None
@@ -20,14 +22,18 @@ def init(i2c_board, i2c_qwiic):
 
     return bme680
 
-def read(bme680):
-    sensor_data = {
-    	"type":  "bme680",
-        "tempF": (9.0/5.0)*bme680.temperature + 32.0,
-        "tempC": bme680.temperature,
-        "humP":  bme680.relative_humidity,
-        "presH": bme680.pressure*0.030,
-        "altM":  bme680.altitude,
-        "gasOhm":bme680.gas
-             }
-    return sensor_data
+def oversample(bme680, times):
+    # the chip's own averaging per measurement, times is 1, 2, 4, 8 or 16
+    bme680.temperature_oversample = times
+    bme680.humidity_oversample = times
+    bme680.pressure_oversample = times
+
+
+def read(bme680, temperature_offset=0.0):
+    values = mod_record.values
+    pressure = bme680.pressure
+    values[mod_record.BME680_TEMP] = (9.0/5.0)*(bme680.temperature + temperature_offset) + 32.0
+    values[mod_record.BME680_HUM] = bme680.relative_humidity
+    values[mod_record.BME680_PRES] = pressure*0.030
+    values[mod_record.BME680_ALT] = altitude(pressure, bme680.sea_level_pressure)
+    values[mod_record.BME680_GAS] = bme680.gas
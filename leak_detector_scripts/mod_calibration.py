@@ -0,0 +1,173 @@
+import array
+import mod_kvstore
+
+""" calibration curves for the analog probes, persisted in the EEPROM store
+
+    Each channel has a curve from volts to its unit, either piecewise linear
+    through measured points or a polynomial fitted to them, and its own ADC
+    reference voltage, so one node's ADC reading high is compensated too.
+    At load every curve is baked into a lookup table indexed by the raw
+    16-bit reading, and a conversion is one index plus an interpolation.
+    calibrate() walks through capturing the points on the serial console.
+"""
+PWL = 0
+POLY = 1
+MAX_POINTS = 8
+TABLE_BITS = 8                    # 256 table steps across the 16-bit ADC range
+TABLE_SHIFT = 16 - TABLE_BITS
+TABLE_STEP = 1 << TABLE_SHIFT
+
+# name -> (kind, points (volts, value) for PWL or coefficients for POLY, vref)
+# the defaults are the constants the probes used before calibration existed
+DEFAULTS = {
+    "soil":    (PWL, ((0.899977, 100.0), (2.35596, 0.0)), 3.3),
+    "battery": (PWL, ((0.032, 0.0), (3.2, 16.0)), 3.3),
+    "bff":     (POLY, (0.0, 65536 * 1.0183 / (3.3 * 10000)), 3.3),
+}
+# what to do for each point of a guided calibration, the value is asked for
+PROMPTS = {
+    "soil":    ("probe in dry air (0 %)", "probe in water (100 %)"),
+    "battery": ("battery at a known voltage, measured with a meter",),
+    "bff":     ("LiPo at a known voltage, measured with a meter",),
+}
+
+# kind, number of points or coefficients, vref, the flattened data; one key per channel
+CURVE = "<BBf{}f".format(2 * MAX_POINTS)
+KEY_PREFIX = "cal."
+
+curves = {}
+tables = {}
+
+
+def evaluate(kind, data, volts):
+    if kind == POLY:
+        result = 0.0
+        for coefficient in reversed(data):
+            result = result * volts + coefficient
+        return result
+    # piecewise linear, held flat past the end points like map_range clamps
+    points = sorted(data)
+    if volts <= points[0][0]:
+        return points[0][1]
+    for i in range(1, len(points)):
+        x1, y1 = points[i]
+        if volts <= x1:
+            x0, y0 = points[i - 1]
+            return y0 + (y1 - y0) * (volts - x0) / (x1 - x0)
+    return points[-1][1]
+
+
+def build(name):
+    """ Bake the channel's curve into a table of 2**TABLE_BITS + 1 entries over raw counts """
+    kind, data, vref = curves[name]
+    table = array.array('f', [0.0] * ((1 << TABLE_BITS) + 1))
+    for i in range(len(table)):
+        table[i] = evaluate(kind, data, i * TABLE_STEP * vref / 65536)
+    tables[name] = table
+
+
+def lookup(name, raw):
+    """ Calibrated value for a raw AnalogIn.value """
+    table = tables[name]
+    i = raw >> TABLE_SHIFT
+    low = table[i]
+    return low + (table[i + 1] - low) * (raw & (TABLE_STEP - 1)) / TABLE_STEP
+
+
+def volts(name, raw):
+    return raw * curves[name][2] / 65536
+
+
+def fit(points, degree):
+    """ Least squares polynomial through (volts, value) points, lowest order first """
+    size = degree + 1
+    matrix = [[0.0] * (size + 1) for _ in range(size)]
+    for x, y in points:
+        powers = [x ** k for k in range(2 * size)]
+        for row in range(size):
+            for col in range(size):
+                matrix[row][col] += powers[row + col]
+            matrix[row][size] += y * powers[row]
+    # Gaussian elimination with partial pivoting on the normal equations
+    for col in range(size):
+        pivot = max(range(col, size), key=lambda r: abs(matrix[r][col]))
+        matrix[col], matrix[pivot] = matrix[pivot], matrix[col]
+        if abs(matrix[col][col]) < 1e-12:
+            raise ValueError("points do not determine a degree {} curve".format(degree))
+        for row in range(size):
+            if row != col:
+                factor = matrix[row][col] / matrix[col][col]
+                for k in range(col, size + 1):
+                    matrix[row][k] -= factor * matrix[col][k]
+    return tuple(matrix[row][size] / matrix[row][row] for row in range(size))
+
+
+def pack(name):
+    kind, data, vref = curves[name]
+    flat = [v for point in data for v in point] if kind == PWL else list(data)
+    return [kind, len(data), vref] + flat + [0.0] * (2 * MAX_POINTS - len(flat))
+
+
+def unpack(fields):
+    kind, n, vref = fields[0], fields[1], fields[2]
+    flat = fields[3:]
+    if kind == PWL:
+        data = tuple((flat[2 * k], flat[2 * k + 1]) for k in range(n))
+    else:
+        data = tuple(flat[:n])
+    return kind, data, vref
+
+
+def save(name):
+    if not mod_kvstore.available():
+        return "no EEPROM for the calibration"
+    mod_kvstore.put(KEY_PREFIX + name, CURVE, *pack(name))
+    return "{} calibration stored".format(name)
+
+
+def load():
+    """ Stored curves over the defaults, then build every table; returns the calibrated names """
+    curves.clear()
+    curves.update(DEFAULTS)
+    calibrated = []
+    for name in DEFAULTS:
+        fields = mod_kvstore.get(KEY_PREFIX + name, CURVE)
+        if fields is not None:
+            curves[name] = unpack(fields)
+            calibrated.append(name)
+    for name in curves:
+        build(name)
+    return calibrated
+
+
+def calibrate(name, sample, degree=0, ask=input):
+    """ Guided calibration of one channel on the serial console
+
+        sample() returns the channel's raw reading, powered and averaged.
+        A known voltage on the pin first sets the channel's ADC reference,
+        then each prompt's reading becomes a point. With degree 0 the points
+        stay piecewise linear, otherwise a polynomial of that degree is fitted.
+        A single point shifts the existing curve to pass through it.
+    """
+    kind, data, vref = curves[name]
+    answer = ask("{}: known voltage on the pin (blank keeps vref {:.4f}): ".format(name, vref)).strip()
+    if answer:
+        vref = float(answer) * 65536 / max(sample(), 1)
+    prompts = PROMPTS[name]
+    points = []
+    while len(points) < MAX_POINTS:
+        prompt = prompts[len(points)] if len(points) < len(prompts) else "another point"
+        answer = ask("{}: {}, enter the value (blank when done): ".format(name, prompt)).strip()
+        if not answer:
+            break
+        points.append((sample() * vref / 65536, float(answer)))
+    if len(points) == 1:
+        offset = points[0][1] - evaluate(kind, data, points[0][0])
+        data = tuple((x, y + offset) for x, y in data) if kind == PWL else (data[0] + offset,) + tuple(data[1:])
+    elif len(points) > 1 and degree:
+        kind, data = POLY, fit(points, degree)
+    elif len(points) > 1:
+        kind, data = PWL, tuple(sorted(points))
+    curves[name] = (kind, data, vref)
+    build(name)
+    return curves[name], save(name)
@@ -0,0 +1,206 @@
+import os
+import json
+import mod_kvstore
+
+""" runtime configuration
+
+    Values come from settings.toml (os.getenv), are validated, and are cached
+    as a packed snapshot in the EEPROM store so warm boots skip the TOML parse.
+    The snapshot is reparsed when settings.toml changes size or mtime.
+    A retained MQTT config topic can override any key; overrides are written
+    into the snapshot and take effect on the next wake.
+"""
+# key, type (b=bool i=int f=float s=str), default, allowed values or (min, max)
+SCHEMA = (
+    ("sleep_time",                  "i", 300,       (10, 86400)),
+    ("model",                       "s", "qtpy",    ("qtpy", "featherS2", "featherS3")),
+    ("charger",                     "s", "bff",     ("bff", "solar")),
+    ("using_bff",                   "b", True,      None),
+    ("soil_moisture_detector_used", "b", True,      None),
+    ("battery_probe_used",          "b", True,      None),
+    ("sd_card_used",                "b", True,      None),
+    ("powerdown_method",            "s", "TPL5110", ("TPL5110", "deep_sleep", "watchdog")),
+    ("sea_level_pressure",          "f", 1020.0,    (800.0, 1100.0)),
+    ("temperature_offset",          "f", 0.0,       (-20.0, 20.0)),
+    ("connect_to_wifi",             "b", True,      None),
+    ("do_connect_to_broker",        "b", True,      None),
+    ("do_send_to_broker",           "b", True,      None),
+    ("using_hardware_watchdog",     "b", True,      None),
+    ("reset_wait_time",             "i", 300,       (0, 3600)),
+    ("reload_wait_time",            "i", 300,       (0, 3600)),
+    ("upload_wait",                 "f", 5.0,       (0.0, 60.0)),
+    ("ina260_profiling",            "b", False,     None),
+    ("battery_capacity_mAh",        "i", 1200,      (1, 100000)),
+    ("status_pixel",                "b", True,      None),
+    ("calibration_mode",            "s", "none",    ("none", "soil", "battery", "bff")),
+    ("calibration_degree",          "i", 0,         (0, 3)),
+    ("sample_burst",                "i", 1,         (1, 50)),
+    ("sensor_oversample",           "i", 1,         (1, 16)),
+    ("sd_rescan",                   "b", False,     None),
+    ("transport",                   "s", "mqtt",    ("mqtt", "lora", "mqttsn")),
+    ("mqttsn_port",                 "i", 1885,      (1, 65535)),
+    ("mqttsn_qos",                  "i", -1,        (-1, 1)),
+    ("lora_node",                   "i", 1,         (1, 254)),
+    ("lora_frequency",              "f", 915.0,     (137.0, 1020.0)),
+    ("lora_tx_power",               "i", 13,        (5, 23)),
+    ("lora_cs",                     "s", "D5",      None),
+    ("lora_reset",                  "s", "D9",      None),
+    ("wake_slots",                  "i", 0,         (0, 1440)),
+    ("wake_slot",                   "i", -1,        (-1, 1439)),
+    ("wake_hold_max",               "f", 30.0,      (0.0, 120.0)),
+    ("ota_enabled",                 "b", True,      None),
+    ("ota_budget",                  "f", 20.0,      (0.0, 120.0)),
+    ("logship_chunks",              "i", 0,         (0, 500)),
+    ("logship_chunk",               "i", 512,       (64, 4096)),
+    ("logship_budget",              "f", 10.0,      (0.0, 120.0)),
+    ("logship_min_battery",         "f", 50.0,      (0.0, 100.0)),
+    ("log_console_level",           "s", "info",    ("debug", "info", "warning", "error", "critical", "none")),
+    ("log_sd_level",                "s", "warning", ("debug", "info", "warning", "error", "critical", "none")),
+    ("log_profile",                 "b", True,      None),
+)
+STRING_SIZE = 12
+# bools go as a byte, CircuitPython's struct has no "?"
+FORMAT = "<" + "".join("{}s".format(STRING_SIZE) if kind == "s" else {"b": "B", "i": "i", "f": "f"}[kind]
+                       for _, kind, _, _ in SCHEMA)
+# settings.toml size and mtime, then the schema; a schema change changes the format and drops the snapshot
+SNAPSHOT = "<II" + FORMAT[1:]
+KEY = "config"
+SETTINGS_PATH = "/settings.toml"
+
+values = {}
+source = None
+
+
+def settings_stamp():
+    try:
+        stats = os.stat(SETTINGS_PATH)
+        return stats[6], int(stats[8])
+    except OSError:
+        return 0, 0
+
+
+def convert(kind, value):
+    """ settings.toml and MQTT give ints and strings; make them the schema type """
+    if kind == "b":
+        if isinstance(value, str):
+            return value.strip().lower() in ("1", "true", "yes", "on")
+        return bool(value)
+    if kind == "i":
+        return int(value)
+    if kind == "f":
+        return float(value)
+    return str(value)
+
+
+def check(key, kind, value, allowed):
+    if allowed is None:
+        return value
+    if kind in ("i", "f"):
+        if allowed[0] <= value <= allowed[1]:
+            return value
+    elif value in allowed:
+        return value
+    raise ValueError("{} = {} is not in {}".format(key, value, allowed))
+
+
+def validate(key, value):
+    for name, kind, _, allowed in SCHEMA:
+        if name == key:
+            value = convert(kind, value)
+            if kind == "s" and len(value) > STRING_SIZE:
+                raise ValueError("{} is longer than {} characters".format(key, STRING_SIZE))
+            return check(key, kind, value, allowed)
+    raise KeyError(key)
+
+
+def parse_settings():
+    """ Read every key from settings.toml, bad or missing values fall back to the default """
+    parsed = {}
+    errors = []
+    for key, _, default, _ in SCHEMA:
+        raw = os.getenv(key.upper())
+        if raw is None:
+            parsed[key] = default
+            continue
+        try:
+            parsed[key] = validate(key, raw)
+        except (ValueError, KeyError) as ex:
+            errors.append(str(ex))
+            parsed[key] = default
+    return parsed, errors
+
+
+def pack(config, stamp):
+    fields = list(stamp)
+    for key, kind, _, _ in SCHEMA:
+        value = config[key]
+        if kind == "s":
+            value = value.encode()
+        elif kind == "b":
+            value = 1 if value else 0
+        fields.append(value)
+    return fields
+
+
+def unpack(fields, stamp):
+    """ The cached config, or None if it is stale """
+    if tuple(fields[:2]) != tuple(stamp):
+        return None
+    config = {}
+    for i in range(len(SCHEMA)):
+        key, kind, _, _ = SCHEMA[i]
+        value = fields[i + 2]
+        if kind == "s":
+            value = value.rstrip(b"\x00").decode()
+        elif kind == "b":
+            value = bool(value)
+        config[key] = value
+    return config
+
+
+def save(stamp=None):
+    if not mod_kvstore.available():
+        return "no EEPROM for the config snapshot"
+    if stamp is None:
+        stamp = settings_stamp()
+    mod_kvstore.put(KEY, SNAPSHOT, *pack(values, stamp))
+    return "config snapshot stored"
+
+
+def load():
+    """ Snapshot if it matches settings.toml, otherwise parse, validate and cache """
+    global values, source
+    stamp = settings_stamp()
+    fields = mod_kvstore.get(KEY, SNAPSHOT)
+    if fields is not None:
+        cached = unpack(fields, stamp)
+        if cached is not None:
+            values = cached
+            source = "eeprom"
+            return values, []
+    values, errors = parse_settings()
+    source = "settings.toml"
+    save(stamp)
+    return values, errors
+
+
+def apply(payload):
+    """ Merge a JSON config update, e.g. {"sleep_time": 600}; returns changed keys and errors """
+    changed = []
+    errors = []
+    try:
+        update = json.loads(payload)
+    except ValueError:
+        return changed, ["config payload is not JSON"]
+    for key in update:
+        try:
+            value = validate(key, update[key])
+        except (ValueError, KeyError) as ex:
+            errors.append("{}: {}".format(key, ex))
+            continue
+        if values.get(key) != value:
+            values[key] = value
+            changed.append(key)
+    if changed:
+        save()
+    return changed, errors
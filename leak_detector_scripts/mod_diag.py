@@ -1,16 +1,181 @@
+import time
+import json
+import struct
+import alarm
+import supervisor
 import microcontroller
-import config
+import mod_24lc32
+import mod_kvstore
 
-def reset_reason():
-    # print version and the last reset reason
-    reset_reason = 0
+""" boot diagnostics, one compact record per wake
+
+    A record holds the version, boot count, reset code, the last phase
+    reached, the exception type and line of a crash, free heap and the
+    wake duration. The running wake's record lives in sleep_memory, so a
+    crash or watchdog reload still finds it; finished (and crashed) wakes
+    go into a ring of RING_SLOTS keys in the EEPROM store, which survives
+    the TPL5110 cutting power. Records not yet published go out as JSON on
+    <prefix>/diag at the next good connection.
+"""
+RESET_NAMES = {1: "power on", 2: "software", 3: "watchdog", 0: "other"}
+
+# version x10, boots, reset code, phase, flags, exception, line, free heap kB, wake deciseconds
+FIELDS = "<HIBBB10sHHH"
+# in sleep_memory the fields get a magic and a crc, the store has its own
+RECORD = "<2s" + FIELDS[1:] + "H"
+EXCEPTION_SIZE = 10
+RECORD_SIZE = struct.calcsize(RECORD)
+MAGIC = b"DG"
+FINISHED = 1
+PUBLISHED = 2
+NO_PHASE = 255
+RING_SLOTS = 4
+KEY_PREFIX = "diag"
+MEMORY_BEGIN = 16             # after mod_watchdog's record in sleep_memory
+
+current = None
+started = 0.0
+
+
+def reset_code():
+    # the code published as ResetReason: 1 power on, 2 software, 3 watchdog, 0 anything else
     if microcontroller.cpu.reset_reason == microcontroller.ResetReason.POWER_ON:
-        message = "VERSION: {}, the last reset was due to HARDWARE".format(config.version)
-        reset_reason = 1
+        return 1
     elif microcontroller.cpu.reset_reason == microcontroller.ResetReason.SOFTWARE:
-        message = "VERSION: {}, the last reset was due to SOFTWARE".format(config.version)
-        reset_reason = 2
-    else :
-        message = "VERSION: {}, unknown cpu reset code: {}".format(config.version, microcontroller.cpu.reset_reason)
+        return 2
+    elif microcontroller.cpu.reset_reason == microcontroller.ResetReason.WATCHDOG:
+        return 3
+    return 0
+
+
+def to_fields(record):
+    return (int(record["version"] * 10), record["boots"], record["reset"], record["phase"], record["flags"],
+            record["exception"].encode()[:EXCEPTION_SIZE], record["line"],
+            min(record["heap"] // 1024, 65535), min(int(record["wake_s"] * 10), 65535))
+
+
+def from_fields(fields):
+    return {"version": fields[0] / 10, "boots": fields[1], "reset": fields[2], "phase": fields[3],
+            "flags": fields[4], "exception": fields[5].rstrip(b"\x00").decode(), "line": fields[6],
+            "heap": fields[7] * 1024, "wake_s": fields[8] / 10}
+
+
+def pack(record):
+    body = struct.pack(RECORD[:-1], MAGIC, *to_fields(record))
+    return body + struct.pack("<H", mod_24lc32.crc16(body))
+
+
+def unpack(blob):
+    """ The record in blob, or None if it is blank or corrupt """
+    if len(blob) < RECORD_SIZE:
+        return None
+    blob = bytes(blob[:RECORD_SIZE])
+    fields = struct.unpack(RECORD, blob)
+    if fields[0] != MAGIC or mod_24lc32.crc16(blob[:-2]) != fields[10]:
+        return None
+    return from_fields(fields[1:10])
+
+
+def crash_from_traceback():
+    """ (exception type, line) of the error that ended the previous run, if it was one """
+    text = supervisor.get_previous_traceback()
+    if not text:
+        return "", 0
+    lines = [line.strip() for line in text.split("\n") if line.strip()]
+    exception = lines[-1].split(":")[0] if lines else ""
+    line = 0
+    for text_line in lines:
+        at = text_line.find("line ")
+        if at >= 0:
+            digits = ""
+            for ch in text_line[at + 5:]:
+                if not ch.isdigit():
+                    break
+                digits += ch
+            if digits:
+                line = int(digits)
+    return exception, line
+
+
+def memory_record():
+    return unpack(alarm.sleep_memory[MEMORY_BEGIN:MEMORY_BEGIN + RECORD_SIZE])
+
+
+def write_memory(record):
+    alarm.sleep_memory[MEMORY_BEGIN:MEMORY_BEGIN + RECORD_SIZE] = pack(record)
+
+
+def slot_key(boots):
+    return "{}{}".format(KEY_PREFIX, boots % RING_SLOTS)
+
+
+def ring():
+    """ Valid records in the ring, oldest first """
+    records = []
+    for slot in range(RING_SLOTS):
+        fields = mod_kvstore.get(slot_key(slot), FIELDS)
+        if fields is not None:
+            records.append(from_fields(fields))
+    records.sort(key=lambda record: record["boots"])
+    return records
+
+
+def write_ring(record):
+    if not mod_kvstore.available():
+        return "no EEPROM for the diagnostics"
+    mod_kvstore.put(slot_key(record["boots"]), FIELDS, *to_fields(record))
+    return "diagnostics record {} stored".format(record["boots"])
+
+
+def begin(version, reset, stalled=None):
+    """ Start this wake's record; a crashed or stalled previous run is saved to the ring
+
+        stalled is (phase index, seconds into the wake) from mod_watchdog.previous(), or None.
+    """
+    global current, started
+    started = time.monotonic()
+    saved = ring()
+    last = memory_record()
+    if last is not None and not last["flags"] & FINISHED:
+        # the previous run never reached finish(): it crashed or the watchdog fired
+        last["exception"], last["line"] = crash_from_traceback()
+        if stalled is not None:
+            last["phase"], last["wake_s"] = stalled[0], stalled[1]
+        write_ring(last)
+        saved.append(last)
+    boots = max([record["boots"] for record in saved] + [last["boots"] if last else 0]) + 1
+    current = {"version": version, "boots": boots, "reset": reset, "phase": NO_PHASE, "flags": 0,
+               "exception": "", "line": 0, "heap": 0, "wake_s": 0.0}
+    write_memory(current)
+    return current
+
+
+def finish(phase, heap):
+    """ The wake got to the end: complete its record in sleep_memory and the ring """
+    current["phase"] = phase
+    current["heap"] = heap
+    current["wake_s"] = time.monotonic() - started
+    current["flags"] |= FINISHED
+    write_memory(current)
+    return write_ring(current)
+
+
+def as_json(record):
+    report = dict(record)
+    report["reset"] = RESET_NAMES.get(record["reset"], "other")
+    report["finished"] = 1 if record["flags"] & FINISHED else 0
+    del report["flags"]
+    return json.dumps(report)
+
 
-    return reset_reason, message
+def publish(publish_fn):
+    """ Hand each unpublished ring record to publish_fn(json), oldest first; returns how many went """
+    sent = 0
+    for record in ring():
+        if record["flags"] & PUBLISHED or record["boots"] == current["boots"]:
+            continue
+        publish_fn(as_json(record))
+        record["flags"] |= PUBLISHED
+        write_ring(record)
+        sent += 1
+    return sent
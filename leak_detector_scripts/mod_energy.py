@@ -0,0 +1,112 @@
+import time
+
+""" energy per wake cycle and battery runtime projection
+
+    Plain python so the same model runs on the QtPy and on the host
+    (backend/energy_model.py) against recorded profiles.
+"""
+# currents in mA unless noted; override any of them from the config
+CURRENT_MODEL = {
+    "mcu_mA": 22.0,          # ESP32-S2 awake, radio off
+    "radio_mA": 75.0,        # added while WiFi is associated and transmitting
+    "sensors_mA": 1.5,       # I2C sensors, RTC and EEPROM while awake
+    "probe_mA": 6.0,         # soil probe and dividers while powered
+    "supply_V": 3.7,         # nominal LiPo voltage
+    "sleep_uA": {            # current between wakes by powerdown method
+        "TPL5110": 0.035,
+        "deep_sleep": 80.0,
+        "watchdog": 80.0,
+    },
+}
+# phases with the radio on, and phases that power the analog probes
+RADIO_PHASES = ("wifi", "broker", "health", "publish", "upload_wait")
+PROBE_PHASES = ("sensors",)
+
+# LiPo open-circuit voltage to state of charge (percent)
+LIPO_CURVE = (
+    (3.27, 0.0), (3.61, 5.0), (3.69, 10.0), (3.71, 15.0), (3.73, 20.0),
+    (3.75, 25.0), (3.77, 30.0), (3.79, 35.0), (3.80, 40.0), (3.82, 45.0),
+    (3.84, 50.0), (3.85, 55.0), (3.87, 60.0), (3.91, 65.0), (3.95, 70.0),
+    (3.98, 75.0), (4.02, 80.0), (4.08, 85.0), (4.11, 90.0), (4.15, 95.0),
+    (4.20, 100.0),
+)
+
+phase_marks = []
+
+
+def mark(phase):
+    """ Record the start of a phase on the monotonic clock """
+    phase_marks.append((phase, time.monotonic()))
+
+
+def phase_durations(now=None):
+    """ Seconds spent in each marked phase, the last one runs until now """
+    if now is None:
+        now = time.monotonic()
+    durations = {}
+    for i in range(len(phase_marks)):
+        name, start = phase_marks[i]
+        end = phase_marks[i + 1][1] if i + 1 < len(phase_marks) else now
+        durations[name] = durations.get(name, 0.0) + end - start
+    return durations
+
+
+def model_value(model, key):
+    if model and key in model:
+        return model[key]
+    return CURRENT_MODEL[key]
+
+
+def cycle_energy(durations, sleep_time, powerdown_method="TPL5110", model=None):
+    """ Charge (mAh) and energy (mWh) of one wake plus the sleep that follows """
+    mcu = model_value(model, "mcu_mA")
+    radio = model_value(model, "radio_mA")
+    sensors = model_value(model, "sensors_mA")
+    probe = model_value(model, "probe_mA")
+    sleep_ua = model_value(model, "sleep_uA")
+    if isinstance(sleep_ua, dict):
+        sleep_ua = sleep_ua.get(powerdown_method, 0.0)
+    awake = 0.0
+    radio_on = 0.0
+    mas = 0.0   # mA*s
+    for name in durations:
+        seconds = durations[name]
+        awake += seconds
+        current = mcu + sensors
+        if name in RADIO_PHASES:
+            current += radio
+            radio_on += seconds
+        if name in PROBE_PHASES:
+            current += probe
+        mas += current * seconds
+    # the TPL5110 period includes the wake, deep sleep starts counting after it
+    asleep = max(sleep_time - awake, 0.0) if powerdown_method == "TPL5110" else sleep_time
+    mas += sleep_ua / 1000.0 * asleep
+    charge = mas / 3600.0
+    return {
+        "awake_s": awake,
+        "radio_s": radio_on,
+        "charge_mAh": charge,
+        "energy_mWh": charge * model_value(model, "supply_V"),
+        "cycle_s": awake + asleep,
+    }
+
+
+def state_of_charge(cell_voltage):
+    """ Percent charge from a resting LiPo voltage """
+    if cell_voltage <= LIPO_CURVE[0][0]:
+        return 0.0
+    for i in range(1, len(LIPO_CURVE)):
+        v1, p1 = LIPO_CURVE[i]
+        if cell_voltage <= v1:
+            v0, p0 = LIPO_CURVE[i - 1]
+            return p0 + (p1 - p0) * (cell_voltage - v0) / (v1 - v0)
+    return 100.0
+
+
+def runtime_hours(percent, capacity_mAh, cycle):
+    """ Hours left at the measured per-cycle charge """
+    if cycle["charge_mAh"] <= 0:
+        return 0.0
+    cycles = capacity_mAh * percent / 100.0 / cycle["charge_mAh"]
+    return cycles * cycle["cycle_s"] / 3600.0
@@ -0,0 +1,115 @@
+import struct
+import mod_record
+
+""" a wake's record as one small binary frame, for uplinks without MQTT
+
+    The header is the frame version and model in one byte, the node number,
+    a sequence number and a bitmask of the slots that follow. Each filled
+    slot goes as a fixed-point integer of one or two bytes, its step below,
+    in slot order; slots that do not fit in MAX_FRAME bytes are left out
+    and reported, so the sensor readings always go first. The backend
+    decodes with the same table (backend/lora_gateway.py).
+"""
+VERSION = 1
+MODELS = ("qtpy", "featherS2", "featherS3")
+MAX_FRAME = 49
+MASK_SIZE = (len(mod_record.TOPICS) + 7) // 8
+HEADER = "<BBB{}s".format(MASK_SIZE)
+
+# slot -> (struct code, step); the value sent is round(value / step), clamped to the code's range
+QUANTA = {
+    mod_record.RESET_REASON:      ("B", 1),
+    mod_record.AHT20_TEMP:        ("h", 0.01),
+    mod_record.AHT20_HUM:         ("B", 0.5),
+    mod_record.SHT40_TEMP:        ("h", 0.01),
+    mod_record.SHT40_HUM:         ("B", 0.5),
+    mod_record.BME280_TEMP:       ("h", 0.01),
+    mod_record.BME280_HUM:        ("B", 0.5),
+    mod_record.BME280_PRES:       ("H", 0.001),
+    mod_record.BME280_ALT:        ("h", 1),
+    mod_record.BME680_TEMP:       ("h", 0.01),
+    mod_record.BME680_HUM:        ("B", 0.5),
+    mod_record.BME680_PRES:       ("H", 0.001),
+    mod_record.BME680_ALT:        ("h", 1),
+    mod_record.BME680_GAS:        ("H", 10),
+    mod_record.INA260_VOLTAGE:    ("H", 0.001),
+    mod_record.INA260_CURRENT:    ("h", 0.1),
+    mod_record.INA260_POWER:      ("H", 0.5),
+    mod_record.BFF_VOLTAGE:       ("H", 0.001),
+    mod_record.LC709203F_VOLTAGE: ("H", 0.001),
+    mod_record.LC709203F_PERCENT: ("B", 0.5),
+    mod_record.SOIL_MOISTURE:     ("B", 0.5),
+    mod_record.BATTERY_VOLTAGE:   ("H", 0.001),
+    mod_record.CPU_TEMP:          ("h", 0.1),
+    mod_record.INA260_PEAK:       ("h", 0.1),
+    mod_record.INA260_MEAN:       ("h", 0.1),
+    mod_record.INA260_CHARGE:     ("H", 0.001),
+    mod_record.INA260_ENERGY:     ("H", 0.001),
+    mod_record.ENERGY_AWAKE:      ("H", 0.01),
+    mod_record.ENERGY_RADIO:      ("H", 0.01),
+    mod_record.ENERGY_CYCLE:      ("H", 0.001),
+    mod_record.ENERGY_RUNTIME:    ("H", 1),
+    mod_record.POWER_PIXEL:       ("H", 0.01),
+    mod_record.POWER_SOIL:        ("H", 0.01),
+    mod_record.POWER_SD:          ("H", 0.01),
+    mod_record.WATCHDOG_STALL:    ("b", 1),
+    mod_record.SD_FREE:           ("H", 1),
+    mod_record.SD_USED:           ("H", 1),
+    mod_record.WAKE_SLOT:         ("H", 1),
+    mod_record.WAKE_PHASE:        ("H", 1),
+}
+LIMITS = {"B": (0, 255), "b": (-128, 127), "H": (0, 65535), "h": (-32768, 32767)}
+SIZES = {"B": 1, "b": 1, "H": 2, "h": 2}
+
+
+def quantize(slot, value):
+    code, step = QUANTA[slot]
+    low, high = LIMITS[code]
+    return max(low, min(high, int(round(value / step))))
+
+
+def encode(model, node, seq, values=None):
+    """ (frame, slots left out) for the filled slots of the record """
+    if values is None:
+        values = mod_record.values
+    mask = bytearray(MASK_SIZE)
+    codes = "<"
+    fields = []
+    size = struct.calcsize(HEADER)
+    dropped = []
+    for slot in range(len(values)):
+        value = values[slot]
+        if value != value or slot not in QUANTA:
+            continue
+        code = QUANTA[slot][0]
+        if size + SIZES[code] > MAX_FRAME:
+            dropped.append(slot)
+            continue
+        size += SIZES[code]
+        mask[slot // 8] |= 1 << (slot % 8)
+        codes += code
+        fields.append(quantize(slot, value))
+    first = (VERSION << 4) | MODELS.index(model)
+    return struct.pack(HEADER, first, node & 0xFF, seq & 0xFF, bytes(mask)) + struct.pack(codes, *fields), dropped
+
+
+def decode(frame):
+    """ (model, node, seq, {slot: value}); ValueError for a frame that is not ours """
+    header_size = struct.calcsize(HEADER)
+    if len(frame) < header_size:
+        raise ValueError("frame of {} bytes is too short".format(len(frame)))
+    first, node, seq, mask = struct.unpack(HEADER, frame[:header_size])
+    if first >> 4 != VERSION or first & 0x0F >= len(MODELS):
+        raise ValueError("frame version {} model {} is unknown".format(first >> 4, first & 0x0F))
+    slots = [slot for slot in range(MASK_SIZE * 8) if mask[slot // 8] & (1 << (slot % 8))]
+    if any(slot not in QUANTA for slot in slots):
+        raise ValueError("frame has unknown slots")
+    codes = "<" + "".join(QUANTA[slot][0] for slot in slots)
+    if struct.calcsize(codes) != len(frame) - header_size:
+        raise ValueError("frame length does not match its slots")
+    raws = struct.unpack(codes, frame[header_size:])
+    readings = {}
+    for slot, raw in zip(slots, raws):
+        step = QUANTA[slot][1]
+        readings[slot] = round(raw * step, 3) if step < 1 else raw * step
+    return MODELS[first & 0x0F], node, seq, readings
@@ -1,19 +1,223 @@
+import time
 import board
 import busio
+import digitalio
+import microcontroller
+
+""" I2C buses with adaptive clock, bus recovery and per-bus counters """
+# candidate bus clocks, fastest first
+FREQUENCIES = (1000000, 400000, 100000)
+# highest clock each known device is good for, by address
+DEVICE_MAX_FREQUENCY = {
+    0x0B: 400000,   # LC709203F
+    0x38: 400000,   # AHT20
+    0x40: 1000000,  # INA260
+    0x44: 1000000,  # SHT40
+    0x57: 400000,   # 24LC32
+    0x68: 400000,   # DS3231
+    0x76: 1000000,  # BME280/BME680
+    0x77: 1000000,  # BME280/BME680
+}
+# unknown devices get the safe clock
+DEFAULT_MAX_FREQUENCY = 100000
+# seconds to wait for a bus lock before giving up
+LOCK_TIMEOUT = 0.5
+# nvm layout for the cached clock choice: magic, bus, device signature, frequency index
+NVM_OFFSET = 0
+NVM_MAGIC = 0xC2
+NVM_SLOT_SIZE = 4
+
+counters = {}
+
+
+class CountingI2C:
+    """ Wraps busio.I2C so drivers are counted, timed out and recovered """
+    def __init__(self, name, scl, sda, frequency):
+        self.name = name
+        self.scl = scl
+        self.sda = sda
+        self.frequency = frequency
+        self.stats = counters.setdefault(name, {"transactions": 0, "errors": 0, "recoveries": 0, "frequency": frequency})
+        self.stats["frequency"] = frequency
+        self.bus = busio.I2C(scl, sda, frequency=frequency)
+
+    def try_lock(self):
+        # drivers spin on try_lock forever; bound it and recover a stuck bus instead
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while not self.bus.try_lock():
+            if time.monotonic() > deadline:
+                self.stats["errors"] += 1
+                self.recover()
+                return self.bus.try_lock()
+        return True
+
+    def unlock(self):
+        self.bus.unlock()
+
+    def scan(self):
+        return self.bus.scan()
+
+    def _transaction(self, method, *args, **kwargs):
+        self.stats["transactions"] += 1
+        try:
+            return method(*args, **kwargs)
+        except OSError:
+            self.stats["errors"] += 1
+            raise
+
+    def writeto(self, *args, **kwargs):
+        return self._transaction(self.bus.writeto, *args, **kwargs)
+
+    def readfrom_into(self, *args, **kwargs):
+        return self._transaction(self.bus.readfrom_into, *args, **kwargs)
+
+    def writeto_then_readfrom(self, *args, **kwargs):
+        return self._transaction(self.bus.writeto_then_readfrom, *args, **kwargs)
+
+    def recover(self):
+        """ Release the bus, clock out a stuck slave and rebuild the bus """
+        try:
+            self.bus.deinit()
+        except Exception:
+            pass
+        recover_pins(self.scl, self.sda)
+        self.stats["recoveries"] += 1
+        self.bus = busio.I2C(self.scl, self.sda, frequency=self.frequency)
+
+    def deinit(self):
+        self.bus.deinit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.deinit()
+
+
+def recover_pins(scl, sda):
+    """ Standard I2C recovery: pulse SCL until the slave lets go of SDA, then send a STOP """
+    scl_pin = digitalio.DigitalInOut(scl)
+    sda_pin = digitalio.DigitalInOut(sda)
+    try:
+        sda_pin.switch_to_input(pull=digitalio.Pull.UP)
+        scl_pin.switch_to_output(value=True, drive_mode=digitalio.DriveMode.OPEN_DRAIN)
+        # up to nine clocks lets a slave finish the byte it thinks it is sending
+        for _ in range(9):
+            if sda_pin.value:
+                break
+            scl_pin.value = False
+            time.sleep(0.000005)
+            scl_pin.value = True
+            time.sleep(0.000005)
+        # STOP: SDA rises while SCL is high
+        sda_pin.switch_to_output(value=False, drive_mode=digitalio.DriveMode.OPEN_DRAIN)
+        time.sleep(0.000005)
+        scl_pin.value = True
+        time.sleep(0.000005)
+        sda_pin.value = True
+        recovered = sda_pin.value
+    finally:
+        scl_pin.deinit()
+        sda_pin.deinit()
+    return recovered
+
+
+def signature(addresses):
+    # one byte fingerprint of the devices on a bus
+    sig = len(addresses)
+    for address in addresses:
+        sig = (sig * 31 + address) & 0xFF
+    return sig
+
+
+def cached_frequency(bus_id, sig):
+    start = NVM_OFFSET + bus_id * NVM_SLOT_SIZE
+    try:
+        slot = microcontroller.nvm[start:start + NVM_SLOT_SIZE]
+    except Exception:
+        return None
+    if slot[0] == NVM_MAGIC and slot[1] == bus_id and slot[2] == sig and slot[3] < len(FREQUENCIES):
+        return FREQUENCIES[slot[3]]
+    return None
+
+
+def cache_frequency(bus_id, sig, frequency):
+    start = NVM_OFFSET + bus_id * NVM_SLOT_SIZE
+    slot = bytes((NVM_MAGIC, bus_id, sig, FREQUENCIES.index(frequency)))
+    try:
+        # only write when it changed, nvm is flash
+        if microcontroller.nvm[start:start + NVM_SLOT_SIZE] != slot:
+            microcontroller.nvm[start:start + NVM_SLOT_SIZE] = slot
+    except Exception:
+        pass
+
+
+def scan(bus):
+    while not bus.try_lock():
+        pass
+    try:
+        return bus.scan()
+    finally:
+        bus.unlock()
+
+
+def best_frequency(addresses):
+    limit = 1000000
+    for address in addresses:
+        limit = min(limit, DEVICE_MAX_FREQUENCY.get(address, DEFAULT_MAX_FREQUENCY))
+    return limit
+
+
+def open_bus(name, bus_id, scl, sda):
+    """ Probe the bus at 100kHz, then run it at the fastest clock every device answers at """
+    try:
+        bus = CountingI2C(name, scl, sda, 100000)
+    except Exception:
+        # a slave holding SDA low makes busio refuse the pins; recover and try once more
+        recover_pins(scl, sda)
+        counters.setdefault(name, {"transactions": 0, "errors": 0, "recoveries": 0, "frequency": 0})["recoveries"] += 1
+        bus = CountingI2C(name, scl, sda, 100000)
+    addresses = scan(bus)
+    sig = signature(addresses)
+    frequency = cached_frequency(bus_id, sig)
+    if frequency is None:
+        frequency = DEFAULT_MAX_FREQUENCY
+        limit = best_frequency(addresses)
+        for candidate in FREQUENCIES:
+            if candidate > limit:
+                continue
+            if candidate == 100000:
+                break
+            bus.deinit()
+            bus = CountingI2C(name, scl, sda, candidate)
+            # stable means every device still answers at this clock
+            if scan(bus) == addresses:
+                frequency = candidate
+                break
+        cache_frequency(bus_id, sig, frequency)
+    if bus.frequency != frequency:
+        bus.deinit()
+        bus = CountingI2C(name, scl, sda, frequency)
+    return bus
+
 
 def init():
     """ I2C setup """
     # Create i2c object, communicating over the board's i2c qwiic bus
     try:
-        i2c_qwiic = busio.I2C(board.SCL1, board.SDA1)  # QT Py
+        i2c_qwiic = open_bus("qwiic", 0, board.SCL1, board.SDA1)  # QT Py
     except:
         i2c_qwiic = None
 
     # Create i2c object, communicating over the board's default I2C bus
     try:
-        i2c_board = board.I2C()  # uses board.SCL and board.SDA
+        i2c_board = open_bus("board", 1, board.SCL, board.SDA)  # uses board.SCL and board.SDA
     except:
         i2c_board = None
 
     return i2c_board, i2c_qwiic
 
+
+def stats():
+    """ Per-bus transaction, error and recovery counters """
+    return counters
@@ -1,4 +1,24 @@
+import time
+import array
 import adafruit_ina260
+import mod_record
+
+""" power profiling, samples are kept in preallocated arrays across the wake cycle
+
+    When the arrays fill up, every other sample is dropped and the sampling
+    interval doubles, so a wake of any length is covered to its end.
+"""
+PROFILE_SIZE = 512
+profile_current = None    # mA
+profile_voltage = None    # V
+profile_time = None       # seconds since start_profile
+profile_count = 0
+profile_peak = 0.0        # mA, kept apart so decimation cannot drop it
+profile_start = 0.0
+profile_phases = []       # (phase name, first sample index)
+sample_interval = 0.01
+base_interval = 0.01
+
 
 def init(i2c_board, i2c_qwiic):
     ina260 = None
@@ -15,7 +35,110 @@ def init(i2c_board, i2c_qwiic):
     return ina260
 
 def read(ina260):
-    sensor_data = {
-    	"type":  "ina260",
-             }
-    return sensor_data
+    values = mod_record.values
+    values[mod_record.INA260_VOLTAGE] = ina260.voltage
+    values[mod_record.INA260_CURRENT] = ina260.current
+    values[mod_record.INA260_POWER] = ina260.power
+
+
+def start_profile(ina260, size=PROFILE_SIZE):
+    """ Configure the INA260 for continuous averaged conversions and reset the sample buffers """
+    global profile_current, profile_voltage, profile_time, profile_count, profile_start, profile_phases, sample_interval
+    global base_interval, profile_peak
+    # 4 samples of 1.1ms for each of V and I, a fresh average every ~9ms
+    ina260.averaging_count = adafruit_ina260.AveragingCount.COUNT_4
+    ina260.current_conversion_time = adafruit_ina260.ConversionTime.TIME_1_1_ms
+    ina260.voltage_conversion_time = adafruit_ina260.ConversionTime.TIME_1_1_ms
+    ina260.mode = adafruit_ina260.Mode.CONTINUOUS
+    base_interval = 4 * 2 * 0.0011
+    sample_interval = base_interval
+    if profile_current is None or len(profile_current) != size:
+        profile_current = array.array('f', bytearray(4 * size))
+        profile_voltage = array.array('f', bytearray(4 * size))
+        profile_time = array.array('f', bytearray(4 * size))
+    profile_count = 0
+    profile_peak = 0.0
+    profile_phases = []
+    profile_start = time.monotonic()
+    sample(ina260)
+
+
+def decimate():
+    """ Keep every other sample and halve the sampling rate, the phase marks move with them """
+    global profile_count, sample_interval
+    kept = (profile_count + 1) // 2
+    for i in range(kept):
+        profile_current[i] = profile_current[2 * i]
+        profile_voltage[i] = profile_voltage[2 * i]
+        profile_time[i] = profile_time[2 * i]
+    profile_count = kept
+    for i in range(len(profile_phases)):
+        profile_phases[i] = (profile_phases[i][0], profile_phases[i][1] // 2)
+    sample_interval *= 2
+
+
+def sample(ina260):
+    """ Take one sample if the INA260 has a fresh average """
+    global profile_count, profile_peak
+    if profile_current is None:
+        return
+    now = time.monotonic() - profile_start
+    if profile_count and now - profile_time[profile_count - 1] < sample_interval:
+        return
+    if profile_count >= len(profile_current):
+        decimate()
+    profile_current[profile_count] = ina260.current
+    profile_voltage[profile_count] = ina260.voltage
+    profile_time[profile_count] = now
+    if profile_current[profile_count] > profile_peak:
+        profile_peak = profile_current[profile_count]
+    profile_count += 1
+
+
+def mark(ina260, phase):
+    """ Start a new phase of the wake cycle """
+    sample(ina260)
+    profile_phases.append((phase, max(profile_count - 1, 0)))
+
+
+def sleep(ina260, seconds):
+    """ time.sleep replacement that keeps sampling """
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        sample(ina260)
+        time.sleep(sample_interval)
+
+
+def _integrate(first, last):
+    # trapezoid sums of I*dt and V*I*dt in mA*s and mW*s
+    charge = 0.0
+    energy = 0.0
+    for i in range(first + 1, last + 1):
+        dt = profile_time[i] - profile_time[i - 1]
+        current = (profile_current[i] + profile_current[i - 1]) / 2
+        power = (profile_current[i] * profile_voltage[i] + profile_current[i - 1] * profile_voltage[i - 1]) / 2
+        charge += current * dt
+        energy += power * dt
+    return charge, energy
+
+
+def summary():
+    """ peak/mean current, total charge and energy into the record, returns energy per phase (mWh) """
+    if not profile_count:
+        return None
+    last = profile_count - 1
+    charge, energy = _integrate(0, last)
+    # the samples are not evenly spaced, the mean is the charge over the time it took
+    duration = profile_time[last] - profile_time[0]
+    mean = charge / duration if duration > 0 else profile_current[0]
+    phases = {}
+    for i in range(len(profile_phases)):
+        name, first = profile_phases[i]
+        end = profile_phases[i + 1][1] if i + 1 < len(profile_phases) else last
+        phases[name] = _integrate(first, end)[1] / 3600
+    values = mod_record.values
+    values[mod_record.INA260_PEAK] = profile_peak
+    values[mod_record.INA260_MEAN] = mean
+    values[mod_record.INA260_CHARGE] = charge / 3600
+    values[mod_record.INA260_ENERGY] = energy / 3600
+    return phases
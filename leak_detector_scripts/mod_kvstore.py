@@ -0,0 +1,181 @@
+import struct
+import mod_24lc32
+
+""" named, typed values in the top kilobyte of the 24LC32
+
+    Each entry is a key, the struct format of its value, the packed value
+    and a CRC, so every persistent feature gets its own key instead of its
+    own address range. load() reads the whole region in one sequential read
+    and put() only changes the copy in RAM; flush() lays the entries out
+    again and writes just the 32 byte pages that differ from what the chip
+    holds, each as one aligned page write with ACK polling. The region is
+    read and written through two functions, so a bytearray can stand in
+    for the chip.
+"""
+REGION_BEGIN = 3072
+REGION_END = 4096
+PAGE_SIZE = mod_24lc32.PAGE_SIZE
+HEADER = "<2sB"
+MAGIC = b"KV"
+LAYOUT_VERSION = 1
+ENTRY = "<BB"          # key length, format length; then key, format, value, crc16
+END = 0xFF             # an erased byte ends the entries
+
+entries = {}           # key -> (format, values)
+order = []             # keys in layout order, MicroPython dicts keep none
+shadow = None          # what the chip holds, as of load() and the last flush()
+legacy_image = None    # the region before it was first formatted, for migrations
+read_fn = None
+write_fn = None
+stats = {"reads": 0, "bytes_read": 0, "page_writes": 0, "ack_polls": 0}
+
+
+def init(eeprom=None, read_region=None, write_page=None):
+    """ Use the EEPROM, or read_region(begin, length) and write_page(address, data); neither keeps it in RAM """
+    global read_fn, write_fn
+    if eeprom is not None:
+        read_fn = lambda begin, length: mod_24lc32.read_block(eeprom, begin, length)
+        write_fn = lambda address, data: mod_24lc32.write_page(eeprom, address, data)
+    else:
+        read_fn = read_region
+        write_fn = write_page
+    return load()
+
+
+def available():
+    return read_fn is not None
+
+
+def entry_size(key, fmt):
+    return struct.calcsize(ENTRY) + len(key) + len(fmt) + struct.calcsize(fmt) + 2
+
+
+def parse(image):
+    """ Entries of a region image; a bad CRC drops that entry, a bad layout the rest """
+    found = {}
+    keys = []
+    at = struct.calcsize(HEADER)
+    while at < len(image) and image[at] != END:
+        key_length, format_length = struct.unpack_from(ENTRY, image, at)
+        start = at + struct.calcsize(ENTRY)
+        try:
+            key = bytes(image[start:start + key_length]).decode()
+            fmt = bytes(image[start + key_length:start + key_length + format_length]).decode()
+            size = struct.calcsize(fmt)
+        except Exception:
+            break
+        value_at = start + key_length + format_length
+        end = value_at + size + 2
+        if key_length == 0 or end > len(image):
+            break
+        crc = struct.unpack_from("<H", image, value_at + size)[0]
+        if mod_24lc32.crc16(image[start:value_at + size]) == crc:
+            found[key] = (fmt, struct.unpack_from(fmt, image, value_at))
+            keys.append(key)
+        at = end
+    return found, keys
+
+
+def load():
+    """ Read the region once and index its entries; returns how many there are """
+    global shadow, legacy_image
+    entries.clear()
+    del order[:]
+    shadow = None
+    legacy_image = None
+    if read_fn is None:
+        return 0
+    image = read_fn(REGION_BEGIN, REGION_END - REGION_BEGIN)
+    stats["reads"] += 1
+    stats["bytes_read"] += len(image)
+    shadow = bytes(image)
+    magic, version = struct.unpack_from(HEADER, image, 0)
+    if magic != MAGIC or version != LAYOUT_VERSION:
+        # never formatted: keep the old bytes so the modules can migrate what they had there
+        legacy_image = shadow
+        return 0
+    found, keys = parse(image)
+    entries.update(found)
+    order.extend(keys)
+    return len(order)
+
+
+def legacy(address, length):
+    """ Bytes that were at an EEPROM address before the store took the region over, or None """
+    if legacy_image is None or address < REGION_BEGIN or address + length > REGION_END:
+        return None
+    return legacy_image[address - REGION_BEGIN:address - REGION_BEGIN + length]
+
+
+def get(key, fmt=None):
+    """ The stored tuple, or None if missing or stored with another format """
+    entry = entries.get(key)
+    if entry is None or (fmt is not None and entry[0] != fmt):
+        return None
+    return entry[1]
+
+
+def used():
+    return struct.calcsize(HEADER) + sum(entry_size(key, entries[key][0]) for key in order)
+
+
+def put(key, fmt, *values):
+    """ Store values packed with fmt under key, in RAM until flush() """
+    struct.pack(fmt, *values)  # the same error now rather than at flush()
+    if len(key) > 255 or len(fmt) > 255 or not key:
+        raise ValueError("key or format too long: {}".format(key))
+    size = used() + entry_size(key, fmt)
+    if key in entries:
+        size -= entry_size(key, entries[key][0])
+    if size + 1 > REGION_END - REGION_BEGIN:
+        raise ValueError("no room for {} in the EEPROM store".format(key))
+    if key not in entries:
+        order.append(key)
+    entries[key] = (fmt, tuple(values))
+
+
+def delete(key):
+    if key in entries:
+        del entries[key]
+        order.remove(key)
+
+
+def layout():
+    """ The region image for the current entries, unchanged sizes keep their offsets """
+    image = bytearray(shadow if shadow is not None else b"\xff" * (REGION_END - REGION_BEGIN))
+    struct.pack_into(HEADER, image, 0, MAGIC, LAYOUT_VERSION)
+    at = struct.calcsize(HEADER)
+    for key in order:
+        fmt, values = entries[key]
+        body = key.encode() + fmt.encode() + struct.pack(fmt, *values)
+        entry = struct.pack(ENTRY, len(key), len(fmt)) + body + struct.pack("<H", mod_24lc32.crc16(body))
+        image[at:at + len(entry)] = entry
+        at += len(entry)
+    image[at] = END
+    return image
+
+
+def dirty_pages(image):
+    if shadow is None:
+        return []
+    return [page for page in range(0, len(image), PAGE_SIZE) if image[page:page + PAGE_SIZE] != shadow[page:page + PAGE_SIZE]]
+
+
+def flush():
+    """ Write back the pages that changed; returns how many were written """
+    global shadow, legacy_image
+    if write_fn is None or shadow is None:
+        return 0
+    image = layout()
+    pages = dirty_pages(image)
+    written = bytearray(shadow)
+    try:
+        for page in pages:
+            stats["ack_polls"] += write_fn(REGION_BEGIN + page, image[page:page + PAGE_SIZE]) or 0
+            stats["page_writes"] += 1
+            written[page:page + PAGE_SIZE] = image[page:page + PAGE_SIZE]
+    finally:
+        # a failed page is written again at the next flush
+        shadow = bytes(written)
+    legacy_image = None
+    return len(pages)
@@ -0,0 +1,74 @@
+import os
+
+""" level gated logging to the USB console and the SD logger
+
+    Messages are a format string plus args; nothing is formatted, printed or
+    written unless the console or SD level lets the record through.
+    Levels come from settings.toml: LOG_CONSOLE_LEVEL and LOG_SD_LEVEL.
+"""
+# same numbers as adafruit_logging
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+CRITICAL = 50
+NONE = 100
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR, "critical": CRITICAL, "none": NONE}
+NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR", CRITICAL: "CRITICAL"}
+
+console_level = INFO
+sd_level = INFO
+lowest = INFO
+logger = None
+
+
+def level_from(name, default):
+    if name is None:
+        return default
+    return LEVELS.get(str(name).lower(), default)
+
+
+def init(sd_logger=None, console=None, sd=None):
+    """ Set the sinks and levels, settings.toml provides the levels not passed in """
+    global console_level, sd_level, lowest, logger
+    console_level = level_from(console if console is not None else os.getenv("LOG_CONSOLE_LEVEL"), INFO)
+    sd_level = level_from(sd if sd is not None else os.getenv("LOG_SD_LEVEL"), INFO)
+    logger = sd_logger
+    if logger is not None:
+        logger.setLevel(sd_level)
+        lowest = min(console_level, sd_level)
+    else:
+        lowest = console_level
+
+
+def enabled(level):
+    """ True if a record at this level reaches any sink, guard costly arguments with it """
+    return level >= lowest
+
+
+def log(level, message, *args):
+    if level < lowest:
+        return
+    to_console = level >= console_level
+    to_sd = logger is not None and level >= sd_level
+    if args:
+        message = message.format(*args)
+    if to_console:
+        print("{}: {}".format(NAMES.get(level, "DEBUG"), message))
+    if to_sd:
+        logger.log(level, "{}: {}".format(NAMES.get(level, "DEBUG"), message))
+
+
+def record(message, *args):
+    """ An info record the host tools read back from the SD log, written past LOG_SD_LEVEL """
+    to_console = INFO >= console_level
+    to_sd = logger is not None and sd_level < NONE
+    if not (to_console or to_sd):
+        return
+    if args:
+        message = message.format(*args)
+    if to_console:
+        print("INFO: {}".format(message))
+    if to_sd:
+        # at the logger's own level, or its level check drops it
+        logger.log(max(sd_level, INFO), "INFO: {}".format(message))
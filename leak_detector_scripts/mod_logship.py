@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import struct
+import mod_sdindex
+
+""" the SD card's files shipped to the host a few chunks a wake
+
+    What has not been sent of each file in the SD index goes out in
+    fixed-size chunks on <prefix>/logship/<name>, oldest file first, each
+    chunk a HEADER of its sequence number and file offset and then the
+    bytes. Chunks are published with QoS 1 and a file's offset only moves
+    on once the broker has the chunk; the offsets are kept on the card in
+    STATE_PATH, so shipping resumes where it stopped, and a file that
+    shrank (a new log) starts again from 0. backend/logship.py puts the
+    files back together. A wake ships at most a chunk count and a time
+    budget, so the radio time it adds is bounded.
+"""
+STATE_PATH = mod_sdindex.ROOT + "/logship.json"
+HEADER = "<HI"               # chunk sequence number in the file, file offset
+HEADER_SIZE = struct.calcsize(HEADER)
+SKIP = (mod_sdindex.INDEX_PATH, STATE_PATH, mod_sdindex.ROOT + "/ota/")
+
+state = {}                   # path -> [offset sent up to, next sequence number]
+dirty = False
+stats = {"chunks": 0, "bytes": 0, "files": 0}
+
+
+def load(path=STATE_PATH):
+    global dirty
+    state.clear()
+    dirty = False
+    try:
+        with open(path, "r") as f:
+            state.update(json.loads(f.read()))
+    except (OSError, ValueError):
+        pass
+    return state
+
+
+def save(path=STATE_PATH):
+    """ Write the offsets if they moved, tmp then rename like the SD index """
+    global dirty
+    if not dirty:
+        return False
+    temp = path + ".tmp"
+    with open(temp, "w") as f:
+        f.write(json.dumps(state))
+    if mod_sdindex.exists(path):
+        os.remove(path)
+    os.rename(temp, path)
+    dirty = False
+    return True
+
+
+def name_of(path):
+    """ The topic level(s) for a file: its path under /sd """
+    if path.startswith(mod_sdindex.ROOT + "/"):
+        return path[len(mod_sdindex.ROOT) + 1:]
+    return path.rsplit("/", 1)[-1]
+
+
+def shippable(path):
+    if path.endswith(".tmp"):
+        return False
+    for skip in SKIP:
+        if path.startswith(skip):
+            return False
+    return True
+
+
+def pending(files):
+    """ (path, offset, size) of every file with unsent bytes, least recently changed first """
+    global dirty
+    found = []
+    for path in files:
+        if not shippable(path):
+            continue
+        size, mtime = files[path]
+        entry = state.get(path)
+        if entry is None or size < entry[0]:
+            # new, or rewritten shorter than what was sent: ship it from the start
+            entry = state[path] = [0, 0]
+            dirty = True
+        if entry[0] < size:
+            found.append((mtime, path, entry[0], size))
+    found.sort()
+    return [(path, offset, size) for _, path, offset, size in found]
+
+
+def backlog(files):
+    """ Bytes still to ship """
+    total = 0
+    for path, offset, size in pending(files):
+        total += size - offset
+    return total
+
+
+def ship(publish_fn, files, chunk_size, max_chunks, budget):
+    """ Send up to max_chunks chunks within budget seconds; returns the chunks sent
+
+        files is the SD index's {path: [size, mtime]}. publish_fn(name, payload)
+        must raise if the broker did not take the chunk; shipping stops there.
+    """
+    global dirty
+    deadline = time.monotonic() + budget
+    buffer = bytearray(HEADER_SIZE + chunk_size)
+    view = memoryview(buffer)
+    sent = 0
+    for path, offset, size in pending(files):
+        if sent >= max_chunks or time.monotonic() >= deadline:
+            break
+        entry = state[path]
+        name = name_of(path)
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while entry[0] < size and sent < max_chunks and time.monotonic() < deadline:
+                count = f.readinto(view[HEADER_SIZE:HEADER_SIZE + min(chunk_size, size - entry[0])])
+                if not count:
+                    break
+                struct.pack_into(HEADER, buffer, 0, entry[1] & 0xFFFF, entry[0])
+                publish_fn(name, bytes(view[:HEADER_SIZE + count]))
+                entry[0] += count
+                entry[1] += 1
+                dirty = True
+                sent += 1
+                stats["chunks"] += 1
+                stats["bytes"] += count
+        stats["files"] += 1
+    return sent
@@ -0,0 +1,148 @@
+import time
+import struct
+import mod_frame
+import mod_record
+
+""" MQTT-SN over UDP for the wake, publish and sleep cycle
+
+    Topics are predefined ids the gateway (backend/mqttsn_gateway.py)
+    knows without registering: the model's index in the high byte and the
+    mod_record slot in the low byte, and the gateway adds the node octet
+    from the sender's address, so the broker sees the usual
+    <model>/<octet>/<Sensor>/<Metric>. QoS -1 needs no connection at all:
+    each reading is one datagram and nothing is waited for. QoS 1 costs one
+    CONNECT/CONNACK and the PUBACKs, collected together at the end.
+    The socket pool is socketpool's or, on the host, the socket module.
+"""
+CONNECT = 0x04
+CONNACK = 0x05
+PUBLISH = 0x0C
+PUBACK = 0x0D
+DISCONNECT = 0x18
+# PUBLISH flags
+DUP = 0x80
+QOS_MINUS_ONE = 0x60
+QOS_ONE = 0x20
+RETAIN = 0x10
+CLEAN_SESSION = 0x04
+PREDEFINED = 0x01
+PROTOCOL_ID = 0x01
+DIAG_SLOT = 0xFE           # low byte of the <prefix>/diag topic id
+RETRIES = 1
+
+sock = None
+address = None
+qos = -1
+next_id = 1
+pending = {}               # message id -> PUBLISH packet waiting for its PUBACK
+buffer = bytearray(64)
+stats = {"datagrams": 0, "bytes": 0, "round_trips": 0, "retries": 0}
+
+
+def topic_id(model, slot):
+    return (mod_frame.MODELS.index(model) << 8) | slot
+
+
+def packet(kind, body):
+    if len(body) + 2 < 256:
+        return bytes((len(body) + 2, kind)) + body
+    # a diagnostics record can be longer: 0x01, then the length in two bytes
+    return b"\x01" + struct.pack(">H", len(body) + 4) + bytes((kind,)) + body
+
+
+def send(data):
+    sock.sendto(data, address)
+    stats["datagrams"] += 1
+    stats["bytes"] += len(data)
+
+
+def receive(timeout):
+    """ (type, body) of the next datagram from the gateway, or None on timeout """
+    sock.settimeout(max(timeout, 0.01))
+    try:
+        size, sender = sock.recvfrom_into(buffer)
+    except OSError:
+        return None
+    if size < 2 or buffer[0] != size:
+        return None
+    return buffer[1], bytes(buffer[2:size])
+
+
+def begin(pool, host, port, quality=-1, client_id="", timeout=2.0):
+    """ A UDP socket to the gateway; QoS 1 also connects. Returns False if the CONNACK never came """
+    global sock, address, qos
+    address = pool.getaddrinfo(host, port)[0][4]
+    sock = pool.socket(pool.AF_INET, pool.SOCK_DGRAM)
+    qos = quality
+    pending.clear()
+    if qos != 1:
+        return True
+    send(packet(CONNECT, bytes((CLEAN_SESSION, PROTOCOL_ID)) + struct.pack(">H", 60) + client_id.encode()))
+    stats["round_trips"] += 1
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        reply = receive(deadline - time.monotonic())
+        if reply is not None and reply[0] == CONNACK:
+            return reply[1][:1] == b"\x00"
+    return False
+
+
+def publish(topic, payload, retain=False):
+    """ One PUBLISH to a predefined topic id; with QoS 1 its PUBACK is collected by wait() """
+    global next_id
+    flags = PREDEFINED | (RETAIN if retain else 0)
+    message_id = 0
+    if qos == 1:
+        flags |= QOS_ONE
+        message_id = next_id
+        next_id = next_id % 0xFFFF + 1
+    else:
+        flags |= QOS_MINUS_ONE
+    if not isinstance(payload, bytes):
+        payload = str(payload).encode()
+    data = packet(PUBLISH, struct.pack(">BHH", flags, topic, message_id) + payload)
+    send(data)
+    if message_id:
+        pending[message_id] = data
+
+
+def publish_record(model, first=0, last=len(mod_record.TOPICS)):
+    """ Every filled slot in [first, last) as a reading, like mod_record.publish; returns how many """
+    count = 0
+    for slot in range(first, last):
+        value = mod_record.values[slot]
+        if value == value:
+            publish(topic_id(model, slot), value)
+            count += 1
+    return count
+
+
+def wait(timeout=2.0):
+    """ Collect the PUBACKs, sending what is still missing once more; returns the unacknowledged count """
+    for attempt in range(RETRIES + 1):
+        if not pending:
+            break
+        if attempt:
+            stats["retries"] += len(pending)
+            for message_id in pending:
+                data = bytearray(pending[message_id])
+                data[2 if data[0] != 1 else 4] |= DUP
+                send(bytes(data))
+        stats["round_trips"] += 1
+        deadline = time.monotonic() + timeout
+        while pending and time.monotonic() < deadline:
+            reply = receive(deadline - time.monotonic())
+            if reply is not None and reply[0] == PUBACK and len(reply[1]) >= 5:
+                pending.pop(struct.unpack(">H", reply[1][2:4])[0], None)
+    return len(pending)
+
+
+def end():
+    """ DISCONNECT a QoS 1 session, without waiting for the reply """
+    global sock
+    if sock is None:
+        return
+    if qos == 1:
+        send(packet(DISCONNECT, b""))
+    sock.close()
+    sock = None
@@ -2,10 +2,16 @@ import neopixel
 
 import board
 import time
+import mod_power
 
-""" stuff for the onboard neopixel """
+""" stuff for the onboard neopixel
+
+    Patterns are lists of (color, seconds) stepped by step() from the main
+    code (enter_phase and pause), so they never hold up the wake. The pixel
+    and its NEOPIXEL_POWER rail are only on while a pattern runs; with the
+    pixel disabled (production) patterns are skipped entirely.
+"""
 # pixel definitions
-pixel = neopixel.NeoPixel(board.NEOPIXEL, 1)
 dim_red = (10, 0, 0)
 dim_green = (0, 10, 0)
 dim_blue = (0, 0, 10)
@@ -14,36 +20,87 @@ bright_green = (0, 100, 0)
 bright_blue = (0, 0, 100)
 pixels_off = (0, 0, 0)
 
+HELLO = ((dim_red, 0.1), (dim_green, 0.1), (dim_blue, 0.1), (pixels_off, 0.1))
+HEALTH_SENDING = HELLO + ((bright_green, 1), (pixels_off, 0.1))
+HEALTH_NOT_SENDING = HELLO + ((bright_red, 1), (pixels_off, 0.1))
+NO_SENSORS = HELLO + ((bright_red, 1), (pixels_off, 0.1)) * 3
+
+DOMAIN = "pixel"
+IDLE = 3600.0
+
+pixel = None
+enabled = True
+pattern = None
+index = 0
+step_ends = 0.0
+
+
+def init(enable=True):
+    """ Register the pixel's power domain, nothing is powered yet """
+    global enabled
+    enabled = enable
+    power_pin = getattr(board, "NEOPIXEL_POWER", None)
+    mod_power.add(DOMAIN, mod_power.pin(power_pin) if power_pin is not None else None)
+
+
+def start(new_pattern):
+    """ Begin a pattern, replacing any that is running """
+    global pixel, pattern, index, step_ends
+    if not enabled:
+        return
+    if pixel is None:
+        mod_power.on(DOMAIN)
+        pixel = neopixel.NeoPixel(board.NEOPIXEL, 1)
+    pattern = new_pattern
+    index = 0
+    pixel.fill(pattern[0][0])
+    step_ends = time.monotonic() + pattern[0][1]
+
+
+def step(now=None):
+    """ Advance the running pattern to where it should be by now """
+    global index, step_ends
+    if pattern is None:
+        return
+    if now is None:
+        now = time.monotonic()
+    while now >= step_ends:
+        index += 1
+        if index >= len(pattern):
+            stop()
+            return
+        pixel.fill(pattern[index][0])
+        step_ends += pattern[index][1]
+
+
+def next_change():
+    """ Seconds until step() has something to do """
+    if pattern is None:
+        return IDLE
+    return max(0.0, step_ends - time.monotonic())
+
+
+def busy():
+    return pattern is not None
+
 
-def power_pixel(pixels, time_on):
-    """ this code manipulates the onboard neopixel """
-    pixel.fill(pixels)
-    time.sleep(time_on)
+def stop():
+    """ Pixel off, released and its rail unpowered """
+    global pixel, pattern
+    pattern = None
+    if pixel is not None:
+        pixel.fill(pixels_off)
+        pixel.deinit()
+        pixel = None
+    if DOMAIN in mod_power.domains:
+        mod_power.off(DOMAIN)
 
 
 def connected_health(do_send_to_broker):
     """ Show everyone we're alive """
-    # Show the user we're alive by manipulating the Neopixel
-    power_pixel(dim_red, 0.1)
-    power_pixel(dim_green, 0.1)
-    power_pixel(dim_blue, 0.1)
-    power_pixel(pixels_off, 0.1)
-    if do_send_to_broker:
-        power_pixel(bright_green, 1)
-    else:
-        power_pixel(bright_red, 1)
-    power_pixel(pixels_off, 0.1)
+    start(HEALTH_SENDING if do_send_to_broker else HEALTH_NOT_SENDING)
 
 
 def no_sensors():
-    # Show the user we have a sensor issue by manipulating the Neopixel
-    power_pixel(dim_red, 0.1)
-    power_pixel(dim_green, 0.1)
-    power_pixel(dim_blue, 0.1)
-    power_pixel(pixels_off, 0.1)
-    power_pixel(bright_red, 1)
-    power_pixel(pixels_off, 0.1)
-    power_pixel(bright_red, 1)
-    power_pixel(pixels_off, 0.1)
-    power_pixel(bright_red, 1)
-    power_pixel(pixels_off, 0.1)
+    # Show the user we have a sensor issue
+    start(NO_SENSORS)
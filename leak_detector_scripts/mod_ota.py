@@ -0,0 +1,290 @@
+import os
+import sys
+import json
+import time
+import binascii
+import supervisor
+import mod_sdindex
+try:
+    import hashlib
+except ImportError:
+    import adafruit_hashlib as hashlib
+
+""" remote module updates over MQTT, staged on the SD card
+
+    The host (backend/ota_publish.py) keeps a retained manifest on
+    <model>/ota/manifest: {"version", "chunk_size", "files": {name: {"sha256", "size", "chunks"}}}
+    and the base64 chunks of every file in it on <model>/ota/chunks/<sha256>/<index>,
+    so a node that missed a version still finds the files it kept unchanged.
+    Only files whose hash differs from what this node runs are fetched. Chunks
+    land in /sd/ota/stage, survive across wakes, and once every file verifies
+    the stage is renamed to /sd/ota/<version> and put first on sys.path.
+    A new version is on trial until mark_good(); a watchdog reset or
+    MAX_TRIALS boots without mark_good() rolls back to the previous version.
+"""
+CIRCUITPY = "/"
+OTA_ROOT = "/sd/ota"
+STAGE = OTA_ROOT + "/stage"
+STATE_PATH = OTA_ROOT + "/state.json"
+MAX_TRIALS = 3
+RESET_WATCHDOG = 3   # mod_diag.reset_code() code
+
+state = {"active": None, "previous": None, "pending": False, "trials": 0, "failed": None}
+manifest = None
+needed = {}          # name -> file entry of the manifest
+
+
+def exists(path):
+    try:
+        os.stat(path)
+        return True
+    except OSError:
+        return False
+
+
+def read_state():
+    try:
+        with open(STATE_PATH, "r") as f:
+            state.update(json.loads(f.read()))
+    except (OSError, ValueError):
+        pass
+    return state
+
+
+def write_state():
+    # write then rename so a power cut never leaves half a state file
+    temp = STATE_PATH + ".tmp"
+    with open(temp, "w") as f:
+        f.write(json.dumps(state))
+    if exists(STATE_PATH):
+        os.remove(STATE_PATH)
+    os.rename(temp, STATE_PATH)
+    mod_sdindex.touch(STATE_PATH)
+
+
+def version_dir(version):
+    return "{}/{}".format(OTA_ROOT, version)
+
+
+def sha256_file(path):
+    digest = hashlib.new("sha256")
+    buffer = bytearray(512)
+    with open(path, "rb") as f:
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            digest.update(buffer[:count] if count < len(buffer) else buffer)
+    return binascii.hexlify(digest.digest()).decode()
+
+
+def current_path(name):
+    """ Where the file this node runs today comes from """
+    if state["active"]:
+        path = "{}/{}".format(version_dir(state["active"]), name)
+        if exists(path):
+            return path
+    return CIRCUITPY + name
+
+
+def code_file():
+    """ The code.py the active version runs, a shipped one in place of the one on CIRCUITPY """
+    return current_path("code.py")
+
+
+def run(running_file):
+    """ Reload into the active version's code.py unless it is the one running """
+    path = code_file()
+    if running_file.lstrip("/") != path.lstrip("/"):
+        supervisor.set_next_code_file(path, reload_on_error=True)
+        supervisor.reload()
+
+
+def activate(reset_code, running_file="code.py"):
+    """ At boot: roll back a failing trial version, then run the active version
+
+        A trial boot is counted once, by the code.py of the version on
+        trial; the run that only reloads into it does not count.
+    """
+    read_state()
+    run(running_file)
+    if state["pending"]:
+        state["trials"] += 1
+        if reset_code == RESET_WATCHDOG or state["trials"] > MAX_TRIALS:
+            state["failed"] = state["active"]
+            state["active"] = state["previous"]
+            state["pending"] = False
+            state["trials"] = 0
+        write_state()
+        run(running_file)
+    if state["active"]:
+        path = version_dir(state["active"])
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    return state["active"]
+
+
+def mark_good():
+    """ The trial version made it through a full wake """
+    if state["pending"]:
+        state["pending"] = False
+        state["trials"] = 0
+        write_state()
+
+
+def manifest_topic(model):
+    return "{}/ota/manifest".format(model)
+
+
+def chunk_filter(model, sha256):
+    return "{}/ota/chunks/{}/+".format(model, sha256)
+
+
+def chunk_filters(model):
+    """ One filter per distinct file content still needed """
+    filters = []
+    for name in needed:
+        topic = chunk_filter(model, needed[name]["sha256"])
+        if topic not in filters:
+            filters.append(topic)
+    return filters
+
+
+def on_manifest(model, payload):
+    """ Decide which files to fetch; returns the chunk topic filters to subscribe to """
+    global manifest, needed
+    try:
+        manifest = json.loads(payload)
+    except ValueError:
+        return []
+    version = manifest["version"]
+    needed = {}
+    if version in (state["active"], state["failed"]):
+        return []
+    wanted = {}
+    for name in manifest["files"]:
+        entry = manifest["files"][name]
+        path = current_path(name)
+        if exists(path) and sha256_file(path) == entry["sha256"]:
+            continue
+        wanted[name] = entry
+    # the chunks and the assembled files are both on the card until finish()
+    if wanted and not mod_sdindex.has_room(2 * sum(wanted[name]["size"] for name in wanted)):
+        return []
+    if not exists(OTA_ROOT):
+        os.mkdir(OTA_ROOT)
+    if not exists(STAGE):
+        os.mkdir(STAGE)
+    needed = wanted
+    return chunk_filters(model)
+
+
+def on_chunk(topic, payload):
+    """ <model>/ota/chunks/<sha256>/<index>, payload is base64 """
+    parts = topic.split("/")
+    if manifest is None or len(parts) != 5 or parts[2] != "chunks":
+        return
+    data = None
+    for name in needed:
+        if needed[name]["sha256"] != parts[3]:
+            continue
+        if data is None:
+            data = binascii.a2b_base64(payload)
+        with open("{}/{}.{}".format(STAGE, name, int(parts[4])), "wb") as f:
+            f.write(data)
+
+
+def missing_chunks(name):
+    return [i for i in range(needed[name]["chunks"]) if not exists("{}/{}.{}".format(STAGE, name, i))]
+
+
+def complete():
+    for name in needed:
+        if missing_chunks(name):
+            return False
+    return True
+
+
+def assemble(name):
+    """ Join the chunks of one file and check its hash """
+    entry = needed[name]
+    target = "{}/{}".format(STAGE, name)
+    with open(target, "wb") as out:
+        for i in range(entry["chunks"]):
+            chunk_path = "{}.{}".format(target, i)
+            with open(chunk_path, "rb") as f:
+                out.write(f.read())
+            os.remove(chunk_path)
+    if sha256_file(target) != entry["sha256"]:
+        os.remove(target)
+        return False
+    return True
+
+
+def copy(source, target):
+    with open(source, "rb") as src:
+        with open(target, "wb") as dst:
+            while True:
+                data = src.read(512)
+                if not data:
+                    break
+                dst.write(data)
+
+
+def remove_tree(path):
+    for name in os.listdir(path):
+        full = path + "/" + name
+        if os.stat(full)[0] & mod_sdindex.DIRECTORY:
+            remove_tree(full)
+        else:
+            os.remove(full)
+    os.rmdir(path)
+
+
+def finish():
+    """ Verify and swap in the new version once every chunk is here; returns a status message """
+    if manifest is None or not needed:
+        return "no update"
+    if not complete():
+        count = sum(len(missing_chunks(name)) for name in needed)
+        return "{} chunks still missing for {}".format(count, manifest["version"])
+    for name in needed:
+        if not assemble(name):
+            return "hash mismatch for {}, it will be fetched again".format(name)
+    # files the previous OTA version supplied and this one keeps
+    if state["active"]:
+        for name in manifest["files"]:
+            source = "{}/{}".format(version_dir(state["active"]), name)
+            if name not in needed and exists(source):
+                copy(source, "{}/{}".format(STAGE, name))
+    version = manifest["version"]
+    # left over from an earlier install of the same version, e.g. one rolled back from
+    if exists(version_dir(version)):
+        remove_tree(version_dir(version))
+        mod_sdindex.forget(version_dir(version))
+    os.rename(STAGE, version_dir(version))
+    mod_sdindex.forget(STAGE)
+    mod_sdindex.scan(version_dir(version))
+    state["previous"] = state["active"]
+    state["active"] = version
+    state["pending"] = True
+    state["trials"] = 0
+    write_state()
+    return "version {} staged, active from the next boot".format(version)
+
+
+def check(mqtt_client, model, budget):
+    """ Look for a new manifest and pull what fits in budget seconds of this broker session """
+    mqtt_client.subscribe(manifest_topic(model))
+    mqtt_client.loop(1)
+    if not needed:
+        return "no update"
+    filters = chunk_filters(model)
+    for topic in filters:
+        mqtt_client.subscribe(topic)
+    end = time.monotonic() + budget
+    while time.monotonic() < end and not complete():
+        mqtt_client.loop(1)
+    for topic in filters:
+        mqtt_client.unsubscribe(topic)
+    return finish()
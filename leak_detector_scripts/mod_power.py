@@ -0,0 +1,65 @@
+import time
+import digitalio
+
+""" power domains switched on only while something needs them
+
+    A domain is an enable pin (the NeoPixel rail, a probe rail) or, with no
+    pin, something on the always-on supply whose use is still worth timing
+    (the mounted SD card). Every on/off is timed, so on_time() accounts for
+    each powered second of the wake, per domain.
+"""
+# name -> [enable pin or None, on since (monotonic) or None, seconds on, times switched on]
+domains = {}
+
+
+def pin(board_pin):
+    """ An active high enable pin as an output, switched off """
+    enable = digitalio.DigitalInOut(board_pin)
+    enable.direction = digitalio.Direction.OUTPUT
+    enable.value = False
+    return enable
+
+
+def add(name, enable=None, since=None):
+    """ Register a domain, since is when it came on if it already is """
+    domains[name] = [enable, since, 0.0, 0 if since is None else 1]
+
+
+def on(name):
+    domain = domains[name]
+    if domain[1] is None:
+        if domain[0] is not None:
+            domain[0].value = True
+        domain[1] = time.monotonic()
+        domain[3] += 1
+
+
+def off(name):
+    domain = domains[name]
+    if domain[1] is not None:
+        if domain[0] is not None:
+            domain[0].value = False
+        domain[2] += time.monotonic() - domain[1]
+        domain[1] = None
+
+
+def is_on(name):
+    return name in domains and domains[name][1] is not None
+
+
+def on_time(name=None):
+    """ Seconds on so far this wake, for one domain or {name: seconds} for all """
+    now = time.monotonic()
+    if name is not None:
+        domain = domains[name]
+        return domain[2] + (now - domain[1] if domain[1] is not None else 0.0)
+    return {name: on_time(name) for name in domains}
+
+
+def switches():
+    return {name: domains[name][3] for name in domains}
+
+
+def all_off():
+    for name in domains:
+        off(name)
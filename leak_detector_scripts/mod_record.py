@@ -0,0 +1,98 @@
+import array
+
+""" one preallocated record of this wake's readings, a fixed float slot per metric
+
+    Slots hold NaN until a sensor fills them; only filled slots are published.
+    Topics are built once from the prefix, so publishing allocates nothing per metric.
+"""
+NAN = float("nan")
+
+# topic suffix and unit for each slot, in slot order
+TOPICS = (
+    "ResetReason",
+    "AHT20/Temp", "AHT20/Humidity",
+    "SHT40/Temp", "SHT40/Humidity",
+    "BME280/Temp", "BME280/Humidity", "BME280/Pressure", "BME280/Altitude",
+    "BME680/Temp", "BME680/Humidity", "BME680/Pressure", "BME680/Altitude", "BME680/Gas",
+    "INA260/Battery", "INA260/Current", "INA260/Power",
+    "BFF/BatteryADC",
+    "LC709203F/BatteryVoltage", "LC709203F/BatteryPercent",
+    "Soil/Moisture",
+    "Battery/Voltage",
+    "Onboard/CPUTemp",
+    "INA260/PeakCurrent", "INA260/MeanCurrent", "INA260/Charge", "INA260/Energy",
+    "Energy/AwakeTime", "Energy/RadioTime", "Energy/Cycle", "Energy/Runtime",
+    "Power/Pixel", "Power/Soil", "Power/SD",
+    "Watchdog/StalledPhase",
+    "SD/FreeMB", "SD/UsedMB",
+    "Schedule/WakeSlot", "Schedule/Phase",
+)
+UNITS = (
+    "f",
+    "F", "Percent",
+    "F", "Percent",
+    "F", "Percent", "inHG", "meters",
+    "F", "Percent", "inHG", "meters", "ohm",
+    "V", "mA", "mW",
+    "V",
+    "V", "Percent",
+    "Percent",
+    "Volts",
+    "F",
+    "mA", "mA", "mAh", "mWh",
+    "s", "s", "mWh", "hours",
+    "s", "s", "s",
+    "phase",
+    "MB", "MB",
+    "slot", "s",
+)
+(RESET_REASON,
+ AHT20_TEMP, AHT20_HUM,
+ SHT40_TEMP, SHT40_HUM,
+ BME280_TEMP, BME280_HUM, BME280_PRES, BME280_ALT,
+ BME680_TEMP, BME680_HUM, BME680_PRES, BME680_ALT, BME680_GAS,
+ INA260_VOLTAGE, INA260_CURRENT, INA260_POWER,
+ BFF_VOLTAGE,
+ LC709203F_VOLTAGE, LC709203F_PERCENT,
+ SOIL_MOISTURE,
+ BATTERY_VOLTAGE,
+ CPU_TEMP,
+ INA260_PEAK, INA260_MEAN, INA260_CHARGE, INA260_ENERGY,
+ ENERGY_AWAKE, ENERGY_RADIO, ENERGY_CYCLE, ENERGY_RUNTIME,
+ POWER_PIXEL, POWER_SOIL, POWER_SD,
+ WATCHDOG_STALL,
+ SD_FREE, SD_USED,
+ WAKE_SLOT, WAKE_PHASE) = range(len(TOPICS))
+
+values = array.array('f', [NAN] * len(TOPICS))
+topics = None
+
+
+def clear():
+    for i in range(len(values)):
+        values[i] = NAN
+
+
+def set_prefix(prefix):
+    """ Build the full topic for every slot, once per wake """
+    global topics
+    topics = ["{}/{}".format(prefix, suffix) for suffix in TOPICS]
+    return topics
+
+
+def is_set(slot):
+    # NaN is the only float not equal to itself
+    return values[slot] == values[slot]
+
+
+def publish(publish_fn, first=0, last=len(TOPICS)):
+    """ Hand each filled slot in [first, last) to publish_fn(topic, unit, value) """
+    for i in range(first, last):
+        value = values[i]
+        if value == value:
+            publish_fn(topics[i], UNITS[i], value)
+
+
+def as_dict():
+    """ Filled slots by topic suffix, for logging """
+    return {TOPICS[i]: values[i] for i in range(len(values)) if values[i] == values[i]}
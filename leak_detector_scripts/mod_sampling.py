@@ -0,0 +1,119 @@
+import time
+import json
+import math
+import array
+import mod_record
+
+""" a burst of readings per sensor, taken while the wake waits anyway
+
+    Each sensor registers a sampler, its module's read(), and the record
+    slots that read fills. The first sample is taken in the sensors phase
+    and published on the usual topics before upload_wait, as without a
+    burst. The rest come from poll() in code.py's pause(), spaced INTERVAL
+    apart, so the burst costs no awake time. pause() is only called for
+    upload_wait: the WiFi connect and the broker's CONNECT block inside
+    their drivers and never get back to Python to sample. A burst longer
+    than upload_wait allows, (SAMPLE_BURST - 1) * INTERVAL seconds, stops
+    short; the stats record counts what was taken.
+
+    Every sample goes into running statistics per slot (Welford, in
+    preallocated arrays), and the mean, min, max and standard deviation
+    go out as one JSON record on <prefix>/stats.
+"""
+INTERVAL = 0.5              # seconds between samples of a burst
+
+burst = 1
+samplers = []               # (read function, slots it fills)
+taken = 0
+next_at = 0.0
+counts = array.array('H', [0] * len(mod_record.TOPICS))
+means = array.array('f', [0.0] * len(mod_record.TOPICS))
+squares = array.array('f', [0.0] * len(mod_record.TOPICS))     # sum of squared deviations
+lows = array.array('f', [0.0] * len(mod_record.TOPICS))
+highs = array.array('f', [0.0] * len(mod_record.TOPICS))
+
+
+def oversampling(times):
+    """ The largest of the sensors' 1, 2, 4, 8 and 16 times oversampling not above times """
+    chosen = 1
+    while chosen * 2 <= min(times, 16):
+        chosen *= 2
+    return chosen
+
+
+def init(count):
+    """ count samples per sensor this wake, 1 for the single reading of old """
+    global burst, taken, next_at
+    burst = max(1, count)
+    taken = 0
+    next_at = 0.0
+    samplers.clear()
+    for slot in range(len(counts)):
+        counts[slot] = 0
+
+
+def add_sampler(read, slots):
+    samplers.append((read, slots))
+
+
+def add(slot, value):
+    """ One reading of a slot into its running statistics """
+    if value != value:
+        return
+    n = counts[slot] + 1
+    counts[slot] = n
+    if n == 1:
+        means[slot] = value
+        squares[slot] = 0.0
+        lows[slot] = value
+        highs[slot] = value
+        return
+    delta = value - means[slot]
+    means[slot] += delta / n
+    squares[slot] += delta * (value - means[slot])
+    if value < lows[slot]:
+        lows[slot] = value
+    if value > highs[slot]:
+        highs[slot] = value
+
+
+def sample():
+    """ Every sensor once, their slots into the statistics; a failed read is skipped """
+    global taken, next_at
+    values = mod_record.values
+    for read, slots in samplers:
+        try:
+            read()
+        except (OSError, RuntimeError):
+            continue
+        for slot in slots:
+            add(slot, values[slot])
+    taken += 1
+    next_at = time.monotonic() + INTERVAL
+
+
+def next_change():
+    """ Seconds until poll() has a sample to take, or a long time if the burst is done """
+    if taken >= burst or not samplers:
+        return 3600.0
+    return max(0.0, next_at - time.monotonic())
+
+
+def poll():
+    if taken < burst and samplers and time.monotonic() >= next_at:
+        sample()
+
+
+def std(slot):
+    n = counts[slot]
+    return math.sqrt(squares[slot] / (n - 1)) if n > 1 else 0.0
+
+
+def as_json():
+    """ {suffix: [mean, min, max, std, n]} for every slot sampled more than once """
+    record = {}
+    for slot in range(len(counts)):
+        if counts[slot] > 1:
+            record[mod_record.TOPICS[slot]] = [round(means[slot], 3), round(lows[slot], 3), round(highs[slot], 3),
+                                               round(std(slot), 4), counts[slot]]
+    return json.dumps(record)
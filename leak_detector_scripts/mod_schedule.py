@@ -0,0 +1,117 @@
+""" wake slots, so a fleet does not reach the AP and the broker all at once
+
+    The sleep interval is cut into WAKE_SLOTS slots and each node wakes at
+    the start of its own: WAKE_SLOT from the config (a retained
+    <model>/<node>/config message is how the broker hands one out), or a
+    hash of the chip's UID. With the DS3231 set, the slot is a phase of the
+    wall clock and every sleep is trimmed to end at it, so drift and shared
+    power cuts cannot line the nodes up again. A power-on is what lines
+    nodes up, so a node that deep sleeps goes straight back to sleep after
+    one, before the radio, until its slot: by the clock if it has one,
+    otherwise the slot's offset from now. The TPL5110 times its interval
+    from DONE, so there the node holds DONE back until the slot's phase;
+    a wake far off it (after a power cut) skips the radio and holds DONE
+    for as long as it takes, once.
+    Plain python; backend/stagger_sim.py runs it over a simulated fleet.
+"""
+MIN_SLEEP = 10              # the shortest SLEEP_TIME the config allows
+
+slots = 0
+slot = None
+period = 0
+offset = 0.0
+clock = None                # wall-clock seconds, set once the DS3231 is known to be right
+
+
+def uid_slot(uid, count):
+    """ FNV-1a of the UID bytes, so a chip always lands in the same slot """
+    digest = 0x811C9DC5
+    for byte in uid:
+        digest = ((digest ^ byte) * 0x01000193) & 0xFFFFFFFF
+    return digest % count
+
+
+def init(sleep_time, count, configured, uid):
+    """ This node's slot, or None with staggering off (WAKE_SLOTS = 0) """
+    global slots, slot, period, offset
+    slots = count
+    period = sleep_time
+    if not slots:
+        slot = None
+        return None
+    slot = configured % slots if configured >= 0 else uid_slot(uid, slots)
+    offset = slot * period / slots
+    return slot
+
+
+def wall_clock():
+    """ Wall-clock seconds, or None without a clock or when the DS3231 does not answer """
+    if clock is None:
+        return None
+    try:
+        return clock()
+    except (OSError, ValueError):
+        return None
+
+
+def lateness(now):
+    """ Seconds from the start of the slot to wall-clock time now """
+    return (now - offset) % period
+
+
+def until_slot(now):
+    """ Seconds from wall-clock time now to the next start of the slot, at least MIN_SLEEP """
+    wait = (offset - now) % period
+    if wait < MIN_SLEEP:
+        wait += period
+    return wait
+
+
+def sleep_for(sleep_time):
+    """ The deep sleep that ends in this node's slot, sleep_time without staggering or a clock """
+    if slot is None:
+        return sleep_time
+    now = wall_clock()
+    if now is not None:
+        return until_slot(now)
+    return sleep_time
+
+
+def power_on_wait():
+    """ Seconds to sleep after a power-on before the radio is used, 0 to go ahead """
+    if slot is None:
+        return 0.0
+    now = wall_clock()
+    if now is not None:
+        return (offset - now) % period
+    return offset
+
+
+def off_slot(max_hold, ahead):
+    """ True when a TPL5110 wake is further from its slot's phase than a DONE hold reaches
+
+        ahead is roughly how long the rest of the wake takes before DONE.
+    """
+    now = wall_clock()
+    if slot is None or now is None:
+        return False
+    return (offset - now) % period > max_hold + ahead
+
+
+def hold_for_slot(done_in, max_hold):
+    """ Seconds to hold DONE back so the TPL5110's wakes keep to the slot
+
+        The TPL5110's own interval is set WAKE_HOLD_MAX shorter than
+        SLEEP_TIME and the hold makes up the difference, so DONE goes high
+        on the slot's phase every wake, whatever the wake took. done_in is how long
+        until DONE would go high without a hold. A wake too far off the
+        phase to reach it holds nothing (its next wake comes earlier) or
+        max_hold (later), whichever is the shorter way round.
+    """
+    now = wall_clock()
+    if slot is None or now is None:
+        return 0.0
+    needed = (offset - now - done_in) % period
+    if needed <= max_hold:
+        return needed
+    return 0.0 if needed > period / 2 else max_hold
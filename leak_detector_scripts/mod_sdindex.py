@@ -0,0 +1,161 @@
+import os
+import json
+
+""" a manifest of the files on the SD card, kept up to date incrementally
+
+    /sd/index.json maps each path to [size, mtime]. The code that writes
+    files (logging, OTA) reports what it changed through touch(), scan()
+    and forget(), so status and free-space checks never walk the card.
+    A full walk happens only when asked for (SD_RESCAN) or when the index
+    is missing or unreadable, so boot and shutdown stay flat as logs pile up.
+"""
+ROOT = "/sd"
+INDEX_PATH = ROOT + "/index.json"
+INDEX_VERSION = 1
+DIRECTORY = 0x4000
+
+files = {}            # path -> [size, mtime]
+loaded = False
+dirty = False
+rebuilt = False
+
+
+def exists(path):
+    try:
+        os.stat(path)
+        return True
+    except OSError:
+        return False
+
+
+def walk(path):
+    """ Every file under path, one os.stat each: the slow way, kept for rebuilds """
+    for name in os.listdir(path):
+        full = path + "/" + name
+        stats = os.stat(full)
+        if stats[0] & DIRECTORY:
+            walk(full)
+        elif full != INDEX_PATH:
+            files[full] = [stats[6], int(stats[8])]
+
+
+def rebuild():
+    global dirty, rebuilt
+    files.clear()
+    walk(ROOT)
+    dirty = True
+    rebuilt = True
+    return len(files)
+
+
+def load(rescan=False):
+    """ Read the index, walking the card only if asked or if the index is unusable """
+    global loaded, dirty, rebuilt
+    loaded = True
+    dirty = False
+    rebuilt = False
+    files.clear()
+    if not rescan:
+        try:
+            with open(INDEX_PATH, "r") as f:
+                index = json.loads(f.read())
+            if index.get("version") == INDEX_VERSION:
+                files.update(index["files"])
+                return len(files)
+        except (OSError, ValueError, KeyError):
+            pass
+    return rebuild()
+
+
+def save():
+    """ Write the index if it changed, tmp then rename like mod_ota's state """
+    global dirty
+    if not loaded or not dirty:
+        return False
+    temp = INDEX_PATH + ".tmp"
+    with open(temp, "w") as f:
+        f.write(json.dumps({"version": INDEX_VERSION, "files": files}))
+    if exists(INDEX_PATH):
+        os.remove(INDEX_PATH)
+    os.rename(temp, INDEX_PATH)
+    dirty = False
+    return True
+
+
+def touch(path):
+    """ One file was written or removed """
+    global dirty
+    if not loaded:
+        return
+    try:
+        stats = os.stat(path)
+        entry = [stats[6], int(stats[8])]
+    except OSError:
+        entry = None
+    if files.get(path) != entry:
+        if entry is None:
+            files.pop(path, None)
+        else:
+            files[path] = entry
+        dirty = True
+
+
+def forget(prefix):
+    """ Drop everything under a removed or renamed directory """
+    global dirty
+    for path in [path for path in files if path == prefix or path.startswith(prefix + "/")]:
+        del files[path]
+        dirty = True
+
+
+def scan(path):
+    """ Re-read one directory tree that changed wholesale, e.g. a new OTA version """
+    global dirty
+    if not loaded:
+        return
+    forget(path)
+    if exists(path):
+        walk(path)
+    dirty = True
+
+
+def free_bytes():
+    stats = os.statvfs(ROOT)
+    return stats[0] * stats[3]
+
+
+def has_room(needed):
+    try:
+        return free_bytes() >= needed
+    except OSError:
+        return False
+
+
+def status():
+    """ {files, used bytes, free bytes} from the index and one statvfs """
+    used = 0
+    for path in files:
+        used += files[path][0]
+    try:
+        free = free_bytes()
+    except OSError:
+        free = -1
+    return {"files": len(files), "used": used, "free": free, "rebuilt": rebuilt}
+
+
+def print_index(prefix=None):
+    """ The old print_directory listing, from the index instead of the card """
+    if prefix is None:
+        prefix = ROOT
+    print("Files on filesystem:")
+    print("====================")
+    for path in sorted(files):
+        if path.startswith(prefix):
+            size = files[path][0]
+            if size < 1000:
+                sizestr = str(size) + " bytes"
+            elif size < 1000000:
+                sizestr = "%0.1f KB" % (size / 1000)
+            else:
+                sizestr = "%0.1f MB" % (size / 1000000)
+            print("{0:<40} Size: {1:>10}".format(path[len(ROOT) + 1:], sizestr))
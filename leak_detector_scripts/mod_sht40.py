@@ -1,4 +1,5 @@
 import adafruit_sht4x
+import mod_record
 
 def init(i2c_board, i2c_qwiic):
     sht40 = None
@@ -16,10 +17,8 @@ def init(i2c_board, i2c_qwiic):
 
 
 def read(sht40):
-    sensor_data = {
-    	"type":  "sht40",
-        "tempF": (9.0/5.0)*sht40.temperature + 32.0,
-        "tempC": sht40.temperature,
-        "humP":  sht40.relative_humidity
-             }
-    return sensor_data
+    # one measurement gives both values
+    temperature, relative_humidity = sht40.measurements
+    values = mod_record.values
+    values[mod_record.SHT40_TEMP] = (9.0/5.0)*temperature + 32.0
+    values[mod_record.SHT40_HUM] = relative_humidity
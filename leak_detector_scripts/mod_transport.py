@@ -0,0 +1,53 @@
+import board
+import digitalio
+import mod_frame
+import mod_kvstore
+
+""" how a wake's readings leave the node: WiFi and MQTT or MQTT-SN, or one LoRa frame
+
+    With MQTT every slot is its own publish (publish_to_broker in code.py),
+    with MQTT-SN its own UDP datagram (mod_mqttsn), without a TCP session.
+    With LoRa the WiFi radio stays off; the record goes as one mod_frame
+    frame from an RFM9x on the SPI bus the SD card already uses, and
+    backend/lora_gateway.py republishes it to the usual topics. The
+    sequence number lives in the EEPROM store, so the gateway can count
+    lost frames across power cuts.
+"""
+MQTT = "mqtt"
+LORA = "lora"
+MQTTSN = "mqttsn"
+MODES = (MQTT, LORA, MQTTSN)
+SEQ_KEY = "lora_seq"
+
+radio = None
+
+
+def init_lora(spi, cs_pin, reset_pin, frequency, tx_power=13, radio_factory=None):
+    """ Set up the RFM9x on the shared SPI bus; pins are board names like "D5" """
+    global radio
+    if radio_factory is None:
+        # only LoRa nodes need the driver on their filesystem
+        import adafruit_rfm9x
+        radio_factory = adafruit_rfm9x.RFM9x
+    cs = digitalio.DigitalInOut(getattr(board, cs_pin))
+    reset = digitalio.DigitalInOut(getattr(board, reset_pin))
+    radio = radio_factory(spi, cs, reset, frequency)
+    radio.tx_power = tx_power
+    return radio
+
+
+def next_seq():
+    last = mod_kvstore.get(SEQ_KEY, "<B")
+    seq = (last[0] + 1) & 0xFF if last is not None else 0
+    mod_kvstore.put(SEQ_KEY, "<B", seq)
+    return seq
+
+
+def send_record(model, node):
+    """ The whole record in one frame; returns (frame size, slots that did not fit) """
+    frame, dropped = mod_frame.encode(model, node, next_seq())
+    if not radio.send(frame):
+        raise OSError("LoRa send timed out")
+    # the modem has nothing more to do this wake
+    radio.sleep()
+    return len(frame), dropped
@@ -0,0 +1,134 @@
+import time
+import struct
+import alarm
+import supervisor
+import microcontroller
+import watchdog
+
+""" watchdog supervision of the wake, one deadline per phase
+
+    enter_phase() calls phase(), which feeds the MCU watchdog with that
+    phase's budget and starts a pulse on the hardware watchdog trigger; the
+    pulse ends at a later poll() or phase() once it has lasted long enough,
+    so nothing sleeps for it. A stalled phase is caught within its budget.
+
+    The MCU watchdog raises WatchDogTimeout, and the running code file is
+    set to reload on an uncaught error, so a stall comes back as a soft
+    reload with sleep_memory intact. The phase in progress is kept there
+    and reported by previous() on the next run.
+"""
+# seconds each phase may take before the MCU watchdog fires
+BUDGETS = {
+    "boot": 30,
+    "init": 15,
+    "sensors": 20,
+    "wifi": 30,
+    "broker": 30,
+    "health": 10,
+    "publish": 20,
+    "upload_wait": 20,
+    "shutdown": 20,
+}
+# in wake order, the index is what gets recorded and published
+PHASES = ("boot", "init", "sensors", "wifi", "broker", "health", "publish", "upload_wait", "shutdown")
+MAX_RELOADS = 3            # stalls in a row before giving up until the next wake
+
+# sleep_memory: magic, phase index, in progress, stalls in a row, seconds since arming
+LAYOUT = "<HBBBf"
+MAGIC = 0x5744
+MEMORY_BEGIN = 0
+MEMORY_SIZE = struct.calcsize(LAYOUT)
+IDLE = 255
+
+budgets = dict(BUDGETS)
+wdt = None
+trigger = None
+pulse_length = 0.2
+pulse_started = None
+armed_at = 0.0
+reloads = 0
+current = None
+
+
+def record(index, running):
+    elapsed = time.monotonic() - armed_at
+    alarm.sleep_memory[MEMORY_BEGIN:MEMORY_BEGIN + MEMORY_SIZE] = struct.pack(LAYOUT, MAGIC, index, running, reloads, elapsed)
+
+
+def previous():
+    """ (phase, seconds into the wake, stalls in a row) if the last run stalled, else None """
+    global reloads
+    magic, index, running, count, elapsed = struct.unpack(LAYOUT, bytes(alarm.sleep_memory[MEMORY_BEGIN:MEMORY_BEGIN + MEMORY_SIZE]))
+    if magic != MAGIC or not running:
+        reloads = 0
+        return None
+    reloads = count + 1
+    return (PHASES[index] if index < len(PHASES) else "unknown", elapsed, reloads)
+
+
+def init(trigger_pin=None, overrides=None, pulse=0.2, code_file=None):
+    """ Arm the MCU watchdog, reload code_file (None for code.py) on an uncaught WatchDogTimeout """
+    global wdt, trigger, pulse_length, armed_at
+    if overrides:
+        budgets.update(overrides)
+    trigger = trigger_pin
+    pulse_length = pulse
+    armed_at = time.monotonic()
+    supervisor.set_next_code_file(code_file, reload_on_error=True)
+    wdt = microcontroller.watchdog
+    wdt.timeout = budgets["boot"]
+    wdt.mode = watchdog.WatchDogMode.RAISE
+    return wdt
+
+
+def poll(now=None):
+    """ End a hardware trigger pulse that has lasted long enough """
+    global pulse_started
+    if pulse_started is None:
+        return
+    if now is None:
+        now = time.monotonic()
+    if now - pulse_started >= pulse_length:
+        trigger.value = True
+        pulse_started = None
+
+
+def next_change():
+    """ Seconds until poll() has a pulse to end """
+    if pulse_started is None:
+        return 3600.0
+    return max(0.0, pulse_started + pulse_length - time.monotonic())
+
+
+def phase(name):
+    """ Feed both watchdogs and give the new phase its own deadline """
+    global current, pulse_started
+    current = name
+    if wdt is not None:
+        wdt.timeout = budgets.get(name, budgets["boot"])
+        wdt.feed()
+    if trigger is not None:
+        poll()
+        if pulse_started is None:
+            # take trigger low ... retrigger the hardware watchdog
+            trigger.value = False
+            pulse_started = time.monotonic()
+    record(PHASES.index(name) if name in PHASES else IDLE, 1)
+
+
+def extend(seconds):
+    """ A longer deadline for the current phase, e.g. a pause longer than its budget """
+    if wdt is not None:
+        wdt.timeout = seconds
+        wdt.feed()
+
+
+def done():
+    """ The wake finished: stop the MCU watchdog before sleeping and clear the record """
+    global wdt
+    if trigger is not None and pulse_started is not None:
+        trigger.value = True
+    if wdt is not None:
+        wdt.mode = None
+        wdt = None
+    record(IDLE, 0)
@@ -0,0 +1,417 @@
+'''
+   Stand-ins for the CircuitPython modules and Adafruit drivers the mod_*
+   modules import, so they run on the host under the benchmarks.
+
+   install() puts them in sys.modules before leak_detector_scripts is
+   imported. busio.I2C is a bus that answers every transaction; mod_i2c
+   wraps it as on the board, so its counters see the same transactions.
+   Each driver stand-in issues the transactions its Adafruit driver issues
+   for a property read, its wait loops polling once, and returns readings
+   that wander a little, so every call does the same work. The BME680
+   driver reuses a reading for 1/refresh_rate seconds; here that window is
+   timed by clock, which only advance() moves. AnalogIn counts its
+   conversions. MQTTClient frames a publish the way adafruit_minimqtt does
+   and keeps only the byte count. supervisor.reload() raises Reload with
+   the code file the next run would start from.
+'''
+import struct
+import sys
+import types
+
+ADDRESSES = (0x38, 0x40, 0x44, 0x57, 0x68, 0x76, 0x77)
+# small readings offsets the stand-ins cycle through
+NOISE = (0.0, 0.12, -0.07, 0.31, -0.22, 0.05, -0.14, 0.26, -0.3, 0.09, 0.18, -0.02, -0.25, 0.2, 0.03, -0.11)
+
+clock = 0.0
+conversions = 0
+next_code_file = None
+
+
+def advance(seconds):
+    global clock
+    clock += seconds
+
+
+class Noise:
+    def __init__(self):
+        self.at = 0
+
+    def next(self, base, scale=1.0):
+        self.at = (self.at + 1) % len(NOISE)
+        return base + NOISE[self.at] * scale
+
+
+# ---- board, busio, digitalio, analogio, microcontroller, supervisor
+
+class Pin:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return "board.{}".format(self.name)
+
+
+def board_pin(name):
+    if name.startswith("__"):
+        raise AttributeError(name)
+    return Pin(name)
+
+
+class I2C:
+    """ busio.I2C, every device in ADDRESSES answers and reads back zeros """
+    def __init__(self, scl, sda, frequency=100000, timeout=255):
+        self.frequency = frequency
+
+    def try_lock(self):
+        return True
+
+    def unlock(self):
+        pass
+
+    def scan(self):
+        return list(ADDRESSES)
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        pass
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        pass
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *, out_start=0, out_end=None, in_start=0, in_end=None):
+        pass
+
+    def deinit(self):
+        pass
+
+
+class DigitalInOut:
+    def __init__(self, pin):
+        self.pin = pin
+        self.value = False
+        self.direction = None
+
+    def switch_to_input(self, pull=None):
+        pass
+
+    def switch_to_output(self, value=False, drive_mode=None):
+        self.value = value
+
+    def deinit(self):
+        pass
+
+
+class AnalogIn:
+    """ 16-bit readings per pin, each value read is a conversion """
+    RAW = {"A1": 21000, "A2": 43000, "A3": 30000}
+
+    def __init__(self, pin):
+        self.raw = self.RAW.get(pin.name, 32768)
+
+    @property
+    def value(self):
+        global conversions
+        conversions += 1
+        return self.raw
+
+    def deinit(self):
+        pass
+
+
+class Processor:
+    temperature = 41.5
+
+
+class Reload(Exception):
+    """ The end of a run that supervisor.reload() asked for """
+
+
+def set_next_code_file(filename, *, reload_on_error=False, reload_on_success=False, sticky_on_error=False,
+                       sticky_on_success=False, sticky_on_reload=False):
+    global next_code_file
+    next_code_file = filename
+
+
+def reload():
+    raise Reload(next_code_file)
+
+
+# ---- Adafruit drivers
+
+class Device:
+    """ The adafruit_bus_device I2CDevice calls the drivers make """
+    def __init__(self, i2c, address):
+        self.i2c = i2c
+        self.address = address
+
+    def __enter__(self):
+        self.i2c.try_lock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.i2c.unlock()
+
+    def write(self, buffer):
+        self.i2c.writeto(self.address, buffer)
+
+    def readinto(self, buffer):
+        self.i2c.readfrom_into(self.address, buffer)
+
+    def write_then_readinto(self, out_buffer, in_buffer):
+        self.i2c.writeto_then_readfrom(self.address, out_buffer, in_buffer)
+
+
+class AHTx0:
+    def __init__(self, i2c, address=0x38):
+        self.device = Device(i2c, address)
+        self.buffer = bytearray(6)
+        self.noise = Noise()
+        with self.device as device:
+            device.write(b"\xbe\x08\x00")       # calibrate
+            device.readinto(self.buffer[:1])
+
+    def _readdata(self):
+        # trigger, one busy poll, the six data bytes
+        with self.device as device:
+            device.write(b"\xac\x33\x00")
+            device.readinto(self.buffer[:1])
+            device.readinto(self.buffer)
+
+    @property
+    def temperature(self):
+        self._readdata()
+        return self.noise.next(21.0)
+
+    @property
+    def relative_humidity(self):
+        self._readdata()
+        return self.noise.next(48.0, 2.0)
+
+
+class SHT4x:
+    def __init__(self, i2c, address=0x44):
+        self.device = Device(i2c, address)
+        self.buffer = bytearray(6)
+        self.noise = Noise()
+        self.mode = SHT4X_MODE.NOHEAT_HIGHPRECISION
+
+    @property
+    def measurements(self):
+        with self.device as device:
+            device.write(bytes((self.mode,)))
+            device.readinto(self.buffer)
+        return self.noise.next(21.3), self.noise.next(47.0, 2.0)
+
+
+class BME280:
+    """ adafruit_bme280.advanced in forced mode, as the node runs it """
+    CHIP_ADDRESS = 0x76
+
+    def __init__(self, i2c, address=0x77):
+        if address != self.CHIP_ADDRESS:
+            raise RuntimeError("Failed to find BME280! Chip ID 0x61")
+        self.device = Device(i2c, address)
+        self.buffer = bytearray(3)
+        self.noise = Noise()
+        self.sea_level_pressure = 1013.25
+        self.overscan_temperature = 1
+        self.overscan_humidity = 1
+        self.overscan_pressure = 1
+
+    def _register(self, register, length):
+        with self.device as device:
+            device.write_then_readinto(bytes((register,)), self.buffer[:length])
+
+    def _read_temperature(self):
+        # forced mode: start a measurement, poll status once, read the raw temperature
+        with self.device as device:
+            device.write(b"\xf4\x25")
+        self._register(0xF3, 1)
+        self._register(0xFA, 3)
+
+    @property
+    def temperature(self):
+        self._read_temperature()
+        return self.noise.next(21.6)
+
+    @property
+    def pressure(self):
+        self._read_temperature()
+        self._register(0xF7, 3)
+        return self.noise.next(1009.0, 0.5)
+
+    @property
+    def relative_humidity(self):
+        self._read_temperature()
+        self._register(0xFD, 2)
+        return self.noise.next(46.0, 2.0)
+
+
+class BME680:
+    CHIP_ADDRESS = 0x77
+
+    def __init__(self, i2c, address=0x77, refresh_rate=10):
+        if address != self.CHIP_ADDRESS:
+            raise RuntimeError("Failed to find BME680! Chip ID 0x60")
+        self.device = Device(i2c, address)
+        self.buffer = bytearray(17)
+        self.noise = Noise()
+        self.sea_level_pressure = 1013.25
+        self.temperature_oversample = 8
+        self.humidity_oversample = 2
+        self.pressure_oversample = 4
+        self._min_refresh_time = 1 / refresh_rate
+        self._last_reading = None
+
+    def _perform_reading(self):
+        if self._last_reading is not None and clock - self._last_reading < self._min_refresh_time:
+            return
+        self._last_reading = clock
+        # gas on, read ctrl_meas, forced mode, one new data poll, the 17 data bytes
+        with self.device as device:
+            device.write(b"\x71\x10")
+            device.write_then_readinto(b"\x74", self.buffer[:1])
+            device.write(b"\x74\x55")
+            device.write_then_readinto(b"\x1d", self.buffer[:1])
+            device.write_then_readinto(b"\x1d", self.buffer)
+
+    @property
+    def temperature(self):
+        self._perform_reading()
+        return self.noise.next(22.0)
+
+    @property
+    def pressure(self):
+        self._perform_reading()
+        return self.noise.next(1009.2, 0.5)
+
+    @property
+    def relative_humidity(self):
+        self._perform_reading()
+        return self.noise.next(45.0, 2.0)
+
+    @property
+    def gas(self):
+        self._perform_reading()
+        return int(self.noise.next(51000.0, 1000.0))
+
+
+class INA260:
+    def __init__(self, i2c, address=0x40):
+        self.device = Device(i2c, address)
+        self.buffer = bytearray(2)
+        self.noise = Noise()
+
+    def _register(self, register):
+        with self.device as device:
+            device.write_then_readinto(bytes((register,)), self.buffer)
+
+    @property
+    def voltage(self):
+        self._register(0x02)
+        return self.noise.next(4.02, 0.01)
+
+    @property
+    def current(self):
+        self._register(0x01)
+        return self.noise.next(62.0, 5.0)
+
+    @property
+    def power(self):
+        self._register(0x03)
+        return self.noise.next(250.0, 20.0)
+
+
+class EEPROM:
+    """ adafruit_24lc32.EEPROM_I2C, the 4 kB kept in memory """
+    def __init__(self, i2c, address=0x57):
+        self._i2c = Memory(i2c, address)
+
+
+class Memory(Device):
+    def __init__(self, i2c, address):
+        super().__init__(i2c, address)
+        self.memory = bytearray(b"\xff" * 4096)
+
+    def write(self, buffer):
+        super().write(buffer)
+        if len(buffer) > 2:
+            address = (buffer[0] << 8) | buffer[1]
+            self.memory[address:address + len(buffer) - 2] = buffer[2:]
+
+    def write_then_readinto(self, out_buffer, in_buffer):
+        super().write_then_readinto(out_buffer, in_buffer)
+        address = (out_buffer[0] << 8) | out_buffer[1]
+        in_buffer[:] = self.memory[address:address + len(in_buffer)]
+
+
+class SHT4X_MODE:
+    NOHEAT_HIGHPRECISION = 0xFD
+    NOHEAT_MEDPRECISION = 0xF6
+    NOHEAT_LOWPRECISION = 0xE0
+
+
+# ---- MQTT
+
+class MQTTClient:
+    """ adafruit_minimqtt's publish framing, into a byte count instead of a socket """
+    def __init__(self):
+        self.published = 0
+        self.sent = 0
+        self.connected = True
+
+    def is_connected(self):
+        return self.connected
+
+    def publish(self, topic, msg, retain=False, qos=0):
+        if isinstance(msg, (int, float)):
+            msg = str(msg).encode("ascii")
+        elif isinstance(msg, str):
+            msg = msg.encode("utf-8")
+        topic_bytes = topic.encode("utf-8")
+        fixed = bytearray([0x30 | (qos << 1) | retain])
+        variable = bytearray(struct.pack(">H", len(topic_bytes)))
+        variable.extend(topic_bytes)
+        if qos > 0:
+            variable.extend(struct.pack(">H", self.published & 0xFFFF))
+        remaining = len(variable) + len(msg)
+        while True:
+            byte = remaining & 0x7F
+            remaining >>= 7
+            fixed.append(byte | 0x80 if remaining else byte)
+            if not remaining:
+                break
+        self.sent += len(fixed) + len(variable) + len(msg)
+        self.published += 1
+
+
+# ---- sys.modules
+
+def module(name, **attributes):
+    made = types.ModuleType(name)
+    made.__dict__.update(attributes)
+    sys.modules[name] = made
+    return made
+
+
+def install():
+    """ Register the stand-ins under the names the device code imports """
+    module("board", __getattr__=board_pin)
+    module("busio", I2C=I2C)
+    module("digitalio", DigitalInOut=DigitalInOut,
+           Direction=types.SimpleNamespace(INPUT=0, OUTPUT=1),
+           Pull=types.SimpleNamespace(UP=1, DOWN=2),
+           DriveMode=types.SimpleNamespace(PUSH_PULL=0, OPEN_DRAIN=1))
+    module("analogio", AnalogIn=AnalogIn)
+    module("supervisor", set_next_code_file=set_next_code_file, reload=reload)
+    module("microcontroller", nvm=bytearray(64), cpu=Processor(), reset=lambda: None)
+    module("adafruit_ahtx0", AHTx0=AHTx0)
+    module("adafruit_sht4x", SHT4x=SHT4x, Mode=SHT4X_MODE)
+    advanced = module("adafruit_bme280.advanced", Adafruit_BME280_I2C=BME280,
+                      **{"OVERSCAN_X{}".format(times): code for code, times in enumerate((1, 2, 4, 8, 16), 1)})
+    module("adafruit_bme280", advanced=advanced)
+    module("adafruit_bme680", Adafruit_BME680_I2C=BME680)
+    module("adafruit_ina260", INA260=INA260,
+           AveragingCount=types.SimpleNamespace(COUNT_1=0, COUNT_4=1, COUNT_16=2),
+           ConversionTime=types.SimpleNamespace(TIME_140_us=0, TIME_1_1_ms=4),
+           Mode=types.SimpleNamespace(SHUTDOWN=0, TRIGGERED=3, CONTINUOUS=7))
+    module("adafruit_24lc32", EEPROM_I2C=EEPROM)
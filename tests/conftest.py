@@ -0,0 +1,245 @@
+'''
+   Wake cycle benchmarks: time, allocations and bus transactions per call
+
+   The bench fixture runs a piece of the wake cycle against the stand-ins
+   in circuitpython.py and records, for one call:
+
+   time_us       best mean over REPEATS timed loops, perf_counter
+   ratio         time_us over a fixed reference workload timed along with
+                 it, so the baseline carries over to another machine running
+                 the same Python and a busy moment slows both
+   alloc_bytes   bytes allocated in the call, the traced memory's growth
+                 from line to line summed (tracemalloc with a line tracer);
+                 what CircuitPython leaves for the collector, which CPython
+                 frees at once
+   peak_bytes    peak traced memory above the start of the call
+   transactions  I2C transactions counted by mod_i2c (or the count given)
+
+   and checks them against tests/bench_baseline.json. A ratio more than
+   --bench-time-threshold over the baseline, either byte count more than
+   --bench-alloc-threshold (and ALLOC_SLACK bytes) over, or any extra
+   transaction fails the test; a slow time is measured once more before
+   it counts. Host CPython is not the board's CircuitPython, so the
+   numbers are for catching changes, not for sizing. A test without a
+   baseline entry is reported and passes.
+
+   python -m pytest tests
+   python -m pytest tests --bench-save      write the run as the new baseline
+'''
+import array
+import json
+import os
+import sys
+import time
+import tracemalloc
+import types
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# appended: the device code.py must not shadow the standard library code module
+sys.path.append(os.path.join(HERE, "..", "leak_detector_scripts"))
+
+import circuitpython  # noqa: E402
+
+circuitpython.install()
+
+import mod_i2c  # noqa: E402
+import mod_aht20  # noqa: E402
+import mod_sht40  # noqa: E402
+import mod_bme280  # noqa: E402
+import mod_bme680  # noqa: E402
+import mod_ina260  # noqa: E402
+import mod_24lc32  # noqa: E402
+
+BASELINE = os.path.join(HERE, "bench_baseline.json")
+REPEATS = 5
+MIN_LOOP = 0.01         # seconds each timed loop runs at least
+ALLOC_SLACK = 64        # bytes of allocation growth always allowed
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("bench", "wake cycle benchmarks")
+    group.addoption("--bench-save", action="store_true", help="write this run's results to the baseline file")
+    group.addoption("--bench-baseline", default=BASELINE, help="baseline file, default tests/bench_baseline.json")
+    group.addoption("--bench-time-threshold", type=float, default=0.5,
+                    help="allowed slowdown against the baseline as a fraction, default 0.5")
+    group.addoption("--bench-alloc-threshold", type=float, default=0.1,
+                    help="allowed allocation growth against the baseline as a fraction, default 0.1")
+
+
+def reference():
+    """ A fixed mix of float math, array stores and formatting, the unit times are measured in """
+    values = array.array('f', [0.0] * 40)
+    for i in range(200):
+        values[i % 40] = (9.0/5.0)*i + 32.0
+    for i in range(20):
+        "{}/{}".format("qtpy/42", i).encode()
+
+
+def loop_time(fn):
+    """ Seconds per call, the best of REPEATS loops each at least MIN_LOOP long """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_LOOP:
+            break
+        number *= 2
+    best = elapsed / number
+    for _ in range(REPEATS - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def transactions():
+    return sum(bus["transactions"] for bus in mod_i2c.stats().values())
+
+
+def allocated(fn):
+    """ Bytes fn allocates, freed or not: every rise of the traced memory between two events
+
+        Tracing makes a frame object for each call, which the call would
+        not have had; its size is taken off at the call event.
+    """
+    # grown, last; in an array so the tracer keeps no int objects of its own alive
+    state = array.array('q', [0, tracemalloc.get_traced_memory()[0]])
+
+    def trace(frame, event, arg):
+        current = tracemalloc.get_traced_memory()[0]
+        rise = current - state[1]
+        if event == "call":
+            rise -= sys.getsizeof(frame)
+        if rise > 0:
+            state[0] += rise
+        state[1] = current
+        return trace
+    sys.settrace(trace)
+    try:
+        fn()
+    finally:
+        sys.settrace(None)
+    return state[0] + max(0, tracemalloc.get_traced_memory()[0] - state[1])
+
+
+def timing(fn):
+    """ (seconds per call, ratio to the reference) """
+    seconds = loop_time(fn)
+    return seconds, seconds / loop_time(reference)
+
+
+def measure(fn, count):
+    fn()
+    before = count()
+    fn()
+    used = count() - before
+    peaks = []
+    churn = []
+    tracemalloc.start()
+    try:
+        for _ in range(3):
+            start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            fn()
+            peaks.append(tracemalloc.get_traced_memory()[1] - start)
+            churn.append(allocated(fn))
+    finally:
+        tracemalloc.stop()
+    seconds, ratio = timing(fn)
+    return {"time_us": round(seconds * 1e6, 3), "ratio": round(ratio, 4),
+            "alloc_bytes": min(churn), "peak_bytes": min(peaks), "transactions": used}
+
+
+def regressions(result, base, time_threshold, alloc_threshold):
+    found = []
+    if result["ratio"] > base["ratio"] * (1 + time_threshold):
+        found.append("time {:.1f} us is {:.0%} of the baseline".format(
+            result["time_us"], result["ratio"] / base["ratio"]))
+    for key, what in (("alloc_bytes", "allocated"), ("peak_bytes", "peak")):
+        if result[key] > base[key] * (1 + alloc_threshold) + ALLOC_SLACK:
+            found.append("{} {} bytes, baseline {}".format(what, result[key], base[key]))
+    if result["transactions"] > base["transactions"]:
+        found.append("{} bus transactions, baseline {}".format(result["transactions"], base["transactions"]))
+    return found
+
+
+class Session:
+    def __init__(self, config):
+        self.config = config
+        self.path = config.getoption("--bench-baseline")
+        self.results = {}
+        self.baseline = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.baseline = json.load(f).get("results", {})
+
+
+@pytest.fixture(scope="session")
+def node():
+    """ The buses and drivers, found the way code.py finds them """
+    i2c_board, i2c_qwiic = mod_i2c.init()
+    return types.SimpleNamespace(
+        i2c_board=i2c_board, i2c_qwiic=i2c_qwiic,
+        aht20=mod_aht20.init(i2c_board, i2c_qwiic), sht40=mod_sht40.init(i2c_board, i2c_qwiic),
+        bme280=mod_bme280.init(i2c_board, i2c_qwiic), bme680=mod_bme680.init(i2c_board, i2c_qwiic),
+        ina260=mod_ina260.init(i2c_board, i2c_qwiic), eeprom=mod_24lc32.init(i2c_board, i2c_qwiic))
+
+
+@pytest.fixture(scope="session")
+def bench_session(request):
+    session = Session(request.config)
+    request.config._bench = session
+    return session
+
+
+@pytest.fixture
+def bench(request, bench_session):
+    """ bench(fn, count=None): measure fn() and check it against the baseline; returns the result """
+    def run(fn, count=None):
+        name = request.node.name
+        result = measure(fn, count or transactions)
+        bench_session.results[name] = result
+        base = bench_session.baseline.get(name)
+        if base is not None and not request.config.getoption("--bench-save"):
+            thresholds = (request.config.getoption("--bench-time-threshold"),
+                          request.config.getoption("--bench-alloc-threshold"))
+            found = regressions(result, base, *thresholds)
+            if found and result["ratio"] > base["ratio"] * (1 + thresholds[0]):
+                seconds, ratio = timing(fn)
+                if ratio < result["ratio"]:
+                    result.update(time_us=round(seconds * 1e6, 3), ratio=round(ratio, 4))
+                    found = regressions(result, base, *thresholds)
+            if found:
+                pytest.fail("{} regressed: {}".format(name, "; ".join(found)), pytrace=False)
+        return result
+    return run
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    session = getattr(config, "_bench", None)
+    if session is None or not session.results:
+        return
+    write = terminalreporter.write_line
+    terminalreporter.section("wake cycle benchmarks")
+    write("{:<28} {:>9} {:>7} {:>8} {:>6} {:>5}  {}".format("", "us", "ratio", "alloc", "peak", "bus", "baseline"))
+    for name, result in sorted(session.results.items()):
+        base = session.baseline.get(name)
+        against = "new" if base is None else "{:.0%} time, {:+d} bytes, {:+d} bus".format(
+            result["ratio"] / base["ratio"], result["alloc_bytes"] - base["alloc_bytes"],
+            result["transactions"] - base["transactions"])
+        write("{:<28} {:>9.2f} {:>7.2f} {:>8} {:>6} {:>5}  {}".format(
+            name, result["time_us"], result["ratio"], result["alloc_bytes"], result["peak_bytes"],
+            result["transactions"], against))
+    if config.getoption("--bench-save"):
+        saved = dict(session.baseline)
+        saved.update(session.results)
+        with open(session.path, "w") as f:
+            json.dump({"python": sys.version.split()[0], "reference_us": round(loop_time(reference) * 1e6, 3),
+                       "results": saved}, f, indent=1, sort_keys=True)
+            f.write("\n")
+        write("baseline written to {}".format(session.path))
@@ -0,0 +1,119 @@
+''' mod_analog on a simulated ADC: power rails, pin lifetimes, unknown models '''
+import pytest
+
+import mod_analog
+import mod_power
+
+# two probes on one rail, one on another, one unpowered
+PINS = {"soil": ("A3", "probes"), "leak": ("A0", "probes"), "tank": ("A2", "tank"), "battery": ("A1", None)}
+RAILS = {"probes": ("D18", 2.0), "tank": ("D8", 0.5)}
+RAW = {"A0": 1000, "A1": 21000, "A2": 30000, "A3": 43000}
+
+
+class Node:
+    """ The ADC and the enable pins, logging what happens in order """
+    def __init__(self):
+        self.events = []
+        self.open = set()
+
+    def analog(self, pin):
+        node = self
+
+        class AnalogIn:
+            def __init__(self):
+                node.events.append(("open", pin.name))
+                node.open.add(pin.name)
+
+            @property
+            def value(self):
+                assert pin.name in node.open
+                node.events.append(("read", pin.name))
+                return RAW[pin.name]
+
+            def deinit(self):
+                node.events.append(("deinit", pin.name))
+                node.open.discard(pin.name)
+        return AnalogIn()
+
+    def power(self, pin):
+        node = self
+
+        class Enable:
+            def __init__(self):
+                self.state = False
+
+            @property
+            def value(self):
+                return self.state
+
+            @value.setter
+            def value(self, state):
+                self.state = state
+                node.events.append(("on" if state else "off", pin.name))
+
+            def deinit(self):
+                node.events.append(("release", pin.name))
+        return Enable()
+
+    def sleep(self, seconds):
+        self.events.append(("settle", seconds))
+
+
+@pytest.fixture
+def node(monkeypatch):
+    monkeypatch.setitem(mod_analog.PINS, "bench", PINS)
+    monkeypatch.setitem(mod_analog.RAILS, "bench", RAILS)
+    monkeypatch.setattr(mod_power, "domains", {})
+    simulated = Node()
+    yield simulated
+    mod_analog.deinit()
+
+
+def init(node, names):
+    return mod_analog.init("bench", names, node.analog, node.power, node.sleep)
+
+
+def test_probes_sharing_a_rail_read_in_one_power_window(node):
+    assert init(node, ("soil", "leak", "tank", "battery", "bff")) == ["soil", "leak", "tank", "battery"]
+    raws = mod_analog.read_all()
+    assert raws == {"soil": 43000, "leak": 1000, "tank": 30000, "battery": 21000}
+    events = node.events
+    assert events.count(("on", "D18")) == 1 and events.count(("settle", 2.0)) == 1
+    window = events[events.index(("on", "D18")):events.index(("off", "D18"))]
+    assert ("read", "A3") in window and ("read", "A0") in window and ("read", "A2") not in window
+    assert events.index(("off", "D18")) < events.index(("on", "D8"))
+    assert not mod_power.is_on("probes") and not mod_power.is_on("tank")
+
+
+def test_each_channel_is_released_after_sampling(node):
+    init(node, ("soil", "battery"))
+    assert mod_analog.read("soil", samples=4) == 43000
+    assert node.events.count(("read", "A3")) == 4
+    assert node.events[-2:] == [("deinit", "A3"), ("off", "D18")]
+    mod_analog.read_all()
+    assert not node.open
+    assert [event for event in node.events if event[0] == "open"] == [("open", "A3"), ("open", "A3"), ("open", "A1")]
+
+
+def test_rail_goes_off_when_a_read_fails(node):
+    init(node, ("soil",))
+    RAW.pop("A3")
+    try:
+        with pytest.raises(KeyError):
+            mod_analog.read_all()
+    finally:
+        RAW["A3"] = 43000
+    assert node.events[-2:] == [("deinit", "A3"), ("off", "D18")]
+
+
+def test_deinit_releases_the_enable_pins(node):
+    init(node, ("soil", "tank"))
+    mod_analog.deinit()
+    assert ("release", "D18") in node.events and ("release", "D8") in node.events
+    assert mod_analog.read_all() == {}
+
+
+def test_unknown_model_is_an_error(node):
+    with pytest.raises(ValueError):
+        mod_analog.init("pico", ("soil",), node.analog, node.power, node.sleep)
+    assert mod_analog.read_all() == {}
@@ -0,0 +1,36 @@
+''' The EEPROM store on the stand-in 24LC32: the read at boot and a one-entry write-back '''
+import pytest
+
+import mod_calibration
+import mod_kvstore
+import mod_transport
+
+
+@pytest.fixture
+def store(node):
+    """ A store holding what a node keeps: the calibrations, the RTC flag, a LoRa sequence number """
+    mod_kvstore.init(node.eeprom)
+    mod_calibration.load()
+    for name in mod_calibration.DEFAULTS:
+        mod_calibration.save(name)
+    mod_kvstore.put("rtc_set", "<B", 1)
+    mod_kvstore.put(mod_transport.SEQ_KEY, "<B", 0)
+    mod_kvstore.flush()
+    yield
+    mod_kvstore.init()
+
+
+def test_kvstore_load(bench, store):
+    assert mod_kvstore.load() == len(mod_calibration.DEFAULTS) + 2
+    bench(mod_kvstore.load)
+
+
+def test_kvstore_flush(bench, store):
+    count = [0]
+
+    def bump():
+        count[0] = (count[0] + 1) & 0xFF
+        mod_kvstore.put(mod_transport.SEQ_KEY, "<B", count[0])
+        return mod_kvstore.flush()
+    assert bump() == 1
+    bench(bump)
@@ -0,0 +1,72 @@
+''' The publish phase: code.py's publish_to_broker over the record, the LoRa frame, the stats record '''
+import ast
+import os
+import time
+
+import circuitpython
+import microcontroller
+import mod_frame
+import mod_log
+import mod_record
+import mod_sampling
+
+CODE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "leak_detector_scripts", "code.py")
+
+
+def code_functions(namespace, *names):
+    """ The named top level functions of code.py, defined in namespace; the script itself is not run """
+    with open(CODE) as f:
+        tree = ast.parse(f.read(), CODE)
+    wanted = [node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name in names]
+    assert sorted(node.name for node in wanted) == sorted(names)
+    exec(compile(ast.Module(body=wanted, type_ignores=[]), CODE, "exec"), namespace)
+    return namespace
+
+
+def full_record():
+    mod_record.clear()
+    for slot in range(len(mod_record.values)):
+        mod_record.values[slot] = slot * 1.5 + 0.25
+    mod_record.set_prefix("qtpy/42")
+
+
+def test_publish_to_broker(bench):
+    client = circuitpython.MQTTClient()
+    code = code_functions({"mod_log": mod_log, "time": time, "microcontroller": microcontroller,
+                           "mqtt_client": client, "do_send_to_broker": True, "reset_wait_time": 0,
+                           "sleep_time": 300, "deep_sleep": lambda seconds: None},
+                          "my_print", "publish_to_broker")
+    mod_log.init(None, "info", "info")
+    full_record()
+
+    def publish():
+        # the readings, then the cycle's own numbers at the end of the wake
+        mod_record.publish(code["publish_to_broker"], 0, mod_record.INA260_PEAK)
+        mod_record.publish(code["publish_to_broker"], mod_record.INA260_PEAK)
+    before = client.published
+    publish()
+    assert client.published - before == len(mod_record.TOPICS)
+    bench(publish)
+
+
+def test_frame_encode(bench):
+    full_record()
+    frame, dropped = mod_frame.encode("qtpy", 42, 7)
+    assert len(frame) <= mod_frame.MAX_FRAME
+    bench(lambda: mod_frame.encode("qtpy", 42, 7))
+
+
+def test_frame_decode(bench):
+    full_record()
+    frame = mod_frame.encode("qtpy", 42, 7)[0]
+    assert mod_frame.decode(frame)[:3] == ("qtpy", 42, 7)
+    bench(lambda: mod_frame.decode(frame))
+
+
+def test_sampling_stats(bench):
+    mod_sampling.init(5)
+    for sample in range(5):
+        for slot in range(mod_record.AHT20_TEMP, mod_record.BME680_GAS + 1):
+            mod_sampling.add(slot, 20.0 + slot + 0.1 * sample)
+    assert len(mod_sampling.as_json()) > 2
+    bench(mod_sampling.as_json)
@@ -0,0 +1,87 @@
+''' The sensors phase: each driver read into the record, the assembly of them, the analog pass '''
+import pytest
+
+import circuitpython
+import mod_aht20
+import mod_analog
+import mod_battery_voltage
+import mod_bme280
+import mod_bme680
+import mod_calibration
+import mod_ina260
+import mod_kvstore
+import mod_record
+import mod_sampling
+import mod_sht40
+import mod_soil_probe
+
+
+def test_aht20_read(bench, node):
+    bench(lambda: mod_aht20.read(node.aht20))
+    assert mod_record.is_set(mod_record.AHT20_TEMP) and mod_record.is_set(mod_record.AHT20_HUM)
+
+
+def test_sht40_read(bench, node):
+    bench(lambda: mod_sht40.read(node.sht40))
+    assert mod_record.is_set(mod_record.SHT40_TEMP)
+
+
+def test_bme280_read(bench, node):
+    bench(lambda: mod_bme280.read(node.bme280))
+    assert mod_record.is_set(mod_record.BME280_ALT)
+
+
+def test_bme680_read(bench, node):
+    def read():
+        # a reading of its own, not the one the driver keeps for 1/refresh_rate seconds
+        circuitpython.advance(1.0)
+        mod_bme680.read(node.bme680, -1.5)
+    bench(read)
+    assert mod_record.is_set(mod_record.BME680_GAS)
+
+
+def test_ina260_read(bench, node):
+    bench(lambda: mod_ina260.read(node.ina260))
+    assert mod_record.is_set(mod_record.INA260_POWER)
+
+
+def sensors(node, burst):
+    """ code.py's sensors phase with every sensor found, then the rest of the burst as pause() takes it """
+    circuitpython.advance(60.0)
+    mod_record.clear()
+    mod_sampling.init(burst)
+    mod_sampling.add_sampler(lambda: mod_aht20.read(node.aht20), (mod_record.AHT20_TEMP, mod_record.AHT20_HUM))
+    mod_sampling.add_sampler(lambda: mod_sht40.read(node.sht40), (mod_record.SHT40_TEMP, mod_record.SHT40_HUM))
+    mod_sampling.add_sampler(lambda: mod_bme280.read(node.bme280),
+                             (mod_record.BME280_TEMP, mod_record.BME280_HUM, mod_record.BME280_PRES, mod_record.BME280_ALT))
+    mod_sampling.add_sampler(lambda: mod_bme680.read(node.bme680, -1.5),
+                             (mod_record.BME680_TEMP, mod_record.BME680_HUM, mod_record.BME680_PRES,
+                              mod_record.BME680_ALT, mod_record.BME680_GAS))
+    mod_sampling.sample()
+    for _ in range(burst - 1):
+        circuitpython.advance(mod_sampling.INTERVAL)
+        mod_sampling.sample()
+    return mod_sampling.taken
+
+
+@pytest.mark.parametrize("burst", [1, 5])
+def test_sensors(bench, node, burst):
+    bench(lambda: sensors(node, burst))
+    assert mod_sampling.taken == burst
+    assert all(mod_record.is_set(slot) for slot in range(mod_record.AHT20_TEMP, mod_record.BME680_GAS + 1))
+
+
+def test_analog(bench):
+    # no EEPROM store: the default curves, as on a node without calibration
+    mod_kvstore.init()
+    mod_calibration.load()
+    mod_analog.init("qtpy", ("soil", "battery", "bff"), power_factory=circuitpython.DigitalInOut, sleep_fn=lambda seconds: None)
+
+    def read():
+        raws = mod_analog.read_all()
+        mod_soil_probe.read(raws[mod_soil_probe.CHANNEL])
+        mod_battery_voltage.read(raws[mod_battery_voltage.CHANNEL])
+        mod_record.values[mod_record.BFF_VOLTAGE] = mod_calibration.lookup("bff", raws["bff"])
+    bench(read, lambda: circuitpython.conversions)
+    assert mod_record.is_set(mod_record.SOIL_MOISTURE) and mod_record.is_set(mod_record.BATTERY_VOLTAGE)
+    mod_analog.deinit()
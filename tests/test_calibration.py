@@ -0,0 +1,45 @@
+''' Guided calibration of an analog channel, the console answers scripted '''
+import pytest
+
+import mod_calibration
+import mod_kvstore
+
+
+@pytest.fixture
+def defaults():
+    mod_kvstore.init()
+    mod_calibration.load()
+    yield
+    mod_calibration.load()
+
+
+def calibrate(name, raw, answers, degree=0):
+    answers = list(answers)
+    return mod_calibration.calibrate(name, lambda: raw, degree, lambda prompt: answers.pop(0))
+
+
+def test_single_point_offsets_where_the_curve_is_zero(defaults):
+    # past the wet end of the soil curve, where it reads 0 %
+    raw = 50000
+    assert mod_calibration.lookup("soil", raw) == 0.0
+    (kind, data, vref), saved = calibrate("soil", raw, ("", "5", ""))
+    assert kind == mod_calibration.PWL and saved == "no EEPROM for the calibration"
+    assert [y for x, y in data] == pytest.approx([105.0, 5.0])
+    assert mod_calibration.lookup("soil", raw) == pytest.approx(5.0)
+
+
+def test_single_point_offsets_a_polynomial(defaults):
+    raw = 40000
+    before = mod_calibration.lookup("bff", raw)
+    (kind, data, vref), saved = calibrate("bff", raw, ("", str(before + 0.25), ""))
+    assert data[1] == mod_calibration.DEFAULTS["bff"][1][1]
+    assert mod_calibration.lookup("bff", raw) == pytest.approx(before + 0.25, abs=1e-3)
+
+
+def test_two_points_replace_the_curve(defaults):
+    # on table steps, so the table holds the points exactly
+    raws = iter((20480, 44800))
+    answers = iter(("", "0", "100", ""))
+    mod_calibration.calibrate("soil", lambda: next(raws), 0, lambda prompt: next(answers))
+    assert mod_calibration.lookup("soil", 20480) == pytest.approx(0.0, abs=1e-3)
+    assert mod_calibration.lookup("soil", 44800) == pytest.approx(100.0, abs=1e-3)
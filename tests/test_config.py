@@ -0,0 +1,47 @@
+''' The config snapshot in the EEPROM store '''
+import re
+
+import mod_config
+import mod_kvstore
+
+# format codes CircuitPython's struct accepts, after an optional byte order prefix
+CIRCUITPYTHON_CODES = "bBxhHiIlLqQsPfd"
+
+
+def circuitpython_format(fmt):
+    return re.fullmatch("[@<>!]?(\\d*[{}])*".format(CIRCUITPYTHON_CODES), fmt) is not None
+
+
+def test_snapshot_format_is_circuitpython_struct():
+    assert circuitpython_format(mod_config.FORMAT)
+    assert circuitpython_format(mod_config.SNAPSHOT)
+    assert not circuitpython_format("<?")
+
+
+def region():
+    """ read_region and write_page over a bytearray, as mod_kvstore allows """
+    memory = bytearray(b"\xff" * mod_kvstore.REGION_END)
+
+    def read(begin, length):
+        return bytes(memory[begin:begin + length])
+
+    def write(address, data):
+        memory[address:address + len(data)] = data
+        return 1
+    return read, write
+
+
+def test_snapshot_round_trip_keeps_bools():
+    read, write = region()
+    mod_kvstore.init(read_region=read, write_page=write)
+    try:
+        values, errors = mod_config.load()
+        assert mod_config.source == "settings.toml" and not errors
+        mod_kvstore.flush()
+        mod_kvstore.load()
+        cached, _ = mod_config.load()
+        assert mod_config.source == "eeprom"
+        assert cached == values
+        assert all(type(cached[key]) is bool for key, kind, _, _ in mod_config.SCHEMA if kind == "b")
+    finally:
+        mod_kvstore.init()
@@ -0,0 +1,40 @@
+''' The INA260 power profile over a wake longer than its sample buffer '''
+import mod_ina260
+import mod_record
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+def test_profile_covers_the_whole_wake(node, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(mod_ina260.time, "monotonic", clock.monotonic)
+    mod_ina260.start_profile(node.ina260, size=64)
+    for phase, seconds in (("sensors", 1.0), ("upload_wait", 5.0), ("shutdown", 1.0)):
+        mod_ina260.mark(node.ina260, phase)
+        end = clock.now + seconds
+        while clock.now < end:
+            clock.now += mod_ina260.base_interval
+            mod_ina260.sample(node.ina260)
+    assert mod_ina260.profile_count <= 64
+    assert mod_ina260.profile_time[mod_ina260.profile_count - 1] > 6.9
+    phases = mod_ina260.summary()
+    assert all(phases[name] > 0 for name in ("sensors", "upload_wait", "shutdown"))
+    assert [first for _, first in mod_ina260.profile_phases] == sorted(first for _, first in mod_ina260.profile_phases)
+
+
+def test_mean_current_is_time_weighted(monkeypatch):
+    # 1 s at 100 mA, then two quick samples at 10 mA: the mean is near 100, not near 40
+    for name, value in (("profile_current", [100.0, 100.0, 10.0, 10.0]), ("profile_voltage", [4.0] * 4),
+                        ("profile_time", [0.0, 1.0, 1.01, 1.02])):
+        monkeypatch.setattr(mod_ina260, name, value)
+    monkeypatch.setattr(mod_ina260, "profile_count", 4)
+    monkeypatch.setattr(mod_ina260, "profile_peak", 100.0)
+    monkeypatch.setattr(mod_ina260, "profile_phases", [("sensors", 0)])
+    mod_ina260.summary()
+    assert 90 < mod_record.values[mod_record.INA260_MEAN] < 100
@@ -0,0 +1,112 @@
+''' backend/ingest.py into standins.MemoryWriter: decoding, malformed publishes, rollups '''
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import fleet  # noqa: E402
+import ingest  # noqa: E402
+import standins  # noqa: E402
+
+T0 = 1_699_999_200    # on a 5 minute and an hour boundary
+
+
+@pytest.fixture
+def writer():
+    return standins.MemoryWriter()
+
+
+def ingested(writer, messages, rollup_at=None):
+    ingestor = ingest.Ingestor(writer, batch_size=100, flush_interval=0.01)
+    ingestor.start()
+    try:
+        for topic, payload, now in messages:
+            ingestor.ingest(topic, payload, now)
+        if rollup_at is not None:
+            ingestor.rollup(rollup_at)
+    finally:
+        ingestor.stop()
+    return ingestor
+
+
+def test_plain_and_batch_payloads_become_lines(writer):
+    batch = fleet.encode_batch({"AHT20/Temperature": 70.5, "SHT40/Humidity": 41.0}, T0 + 5)
+    ingestor = ingested(writer, [("qtpy/42/AHT20/Temperature", b"70.25", T0), ("qtpy/42/batch", batch.encode(), T0)])
+    assert ingestor.stats["readings"] == 3 and ingestor.stats["written"] == 3
+    assert "AHT20,model=qtpy,node=42 Temperature=70.25 {}".format(T0) in writer.lines
+    assert "SHT40,model=qtpy,node=42 Humidity=41.0 {}".format(T0 + 5) in writer.lines
+
+
+@pytest.mark.parametrize("topic, payload", [
+    ("qtpy/42/diag", b"[1, 2, 3]"),
+    ("qtpy/42/stats", b'{"AHT20/Temperature": 70.5}'),
+    ("qtpy/42/batch", b'{"ts": "yesterday", "AHT20/Temperature": 70.5}'),
+    ("qtpy/42/batch", b'["AHT20/Temperature", 70.5]'),
+    ("qtpy/42/lp", b"AHT20 Temperature=warm"),
+    ("qtpy/42/batch", b"\xff\xfe not json"),
+])
+def test_malformed_publish_is_counted_not_raised(writer, topic, payload):
+    ingestor = ingested(writer, [(topic, payload, T0), ("qtpy/42/AHT20/Temperature", b"70.25", T0)])
+    assert ingestor.stats["malformed"] == 1
+    assert writer.lines == ["AHT20,model=qtpy,node=42 Temperature=70.25 {}".format(T0)]
+
+
+def test_values_that_are_not_numbers_are_left_out(writer):
+    messages = [("qtpy/42/batch", b'{"AHT20/Temperature": null, "SHT40/Humidity": 41.0}', T0),
+                ("qtpy/42/stats", b'{"AHT20/Temperature": [70.5, null, 71.0, NaN, 5]}', T0),
+                ("qtpy/42/AHT20/Temperature", b"nan", T0)]
+    ingestor = ingested(writer, messages)
+    assert ingestor.stats["malformed"] == 0
+    assert sorted(writer.lines) == sorted(["SHT40,model=qtpy,node=42 Humidity=41.0 {}".format(T0),
+                                           "AHT20,model=qtpy,node=42 Temperature_max=71.0 {}".format(T0),
+                                           "AHT20,model=qtpy,node=42 Temperature_n=5.0 {}".format(T0)])
+
+
+def test_fleet_control_topics_are_not_readings(writer):
+    ingestor = ingested(writer, [("qtpy/ota/manifest", b'{"version": "1.2"}', T0),
+                                 ("qtpy/ota/chunks/00ff/0", b"MTIz", T0),
+                                 ("qtpy/config", b"42", T0), ("qtpy/42/config", b"42", T0)])
+    assert ingestor.stats["readings"] == 0 and ingestor.stats["malformed"] == 0 and not writer.lines
+
+
+def test_paho_callback_survives_a_malformed_publish(writer):
+    ingestor = ingest.Ingestor(writer)
+    ingestor.on_message(None, None, standins.MemoryMessage("qtpy/42/diag", b"[1]"))
+    ingestor.on_message(None, None, standins.MemoryMessage("qtpy/42/AHT20/Temperature", b"70.25"))
+    assert ingestor.stats["malformed"] == 1 and ingestor.stats["readings"] == 1
+
+
+def test_rollups_close_buckets_per_level(writer):
+    messages = [("qtpy/42/AHT20/Temperature", str(70.0 + i).encode(), T0 + 60 * i) for i in range(10)]
+    ingestor = ingested(writer, messages, rollup_at=T0 + 300)
+    rolled = [line for line in writer.lines if line.startswith("AHT20_5m")]
+    assert rolled == ["AHT20_5m,model=qtpy,node=42 Temperature_mean=72.0,Temperature_min=70.0,"
+                      "Temperature_max=74.0,Temperature_count=5.0 {}".format(T0)]
+    assert ingestor.stats["rollups"] == 1
+
+
+def test_closed_hour_flushes_with_no_closed_5m_bucket(writer):
+    ingestor = ingest.Ingestor(writer)
+    ingestor.ingest("qtpy/42/AHT20/Temperature", b"70.0", T0)
+    ingestor.rollup(T0 + 300)
+    # the 5m level has nothing closed at the next rollup, the hour it fed into has
+    assert ingestor.rollup(T0 + 3600) == 2
+    lines = [ingestor.lines.get_nowait() for _ in range(ingestor.lines.qsize())]
+    assert any(line.startswith("AHT20_1h,") for line in lines)
+
+
+def test_failed_write_is_retried(writer):
+    writer.fail_times = 1
+    ingestor = ingest.Ingestor(writer, flush_interval=0.01)
+    ingestor.start()
+    try:
+        ingestor.ingest("qtpy/42/AHT20/Temperature", b"70.25", T0)
+        deadline = time.monotonic() + 5
+        while not ingestor.stats["written"] and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        ingestor.stop()
+    assert ingestor.stats["write_errors"] == 1 and writer.batches == 1 and len(writer.lines) == 1
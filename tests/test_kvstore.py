@@ -0,0 +1,115 @@
+''' mod_kvstore on a bytearray region: CRCs, formats, page write-back, the legacy image '''
+import struct
+
+import pytest
+
+import mod_kvstore
+
+BEGIN = mod_kvstore.REGION_BEGIN
+PAGE = mod_kvstore.PAGE_SIZE
+
+
+class Region:
+    """ read_region and write_page over a bytearray, logging page writes and failing on request """
+    def __init__(self):
+        self.memory = bytearray(b"\xff" * mod_kvstore.REGION_END)
+        self.writes = []
+        self.fail_at = set()
+
+    def read(self, begin, length):
+        return bytes(self.memory[begin:begin + length])
+
+    def write(self, address, data):
+        if address in self.fail_at:
+            self.fail_at.discard(address)
+            raise OSError("no ACK at {}".format(address))
+        assert address % PAGE == 0 and len(data) == PAGE
+        self.memory[address:address + len(data)] = data
+        self.writes.append(address)
+        return 1
+
+
+@pytest.fixture
+def region():
+    chip = Region()
+    mod_kvstore.init(read_region=chip.read, write_page=chip.write)
+    yield chip
+    mod_kvstore.init()
+
+
+def stored(region, entries):
+    for key, fmt, value in entries:
+        mod_kvstore.put(key, fmt, value)
+    mod_kvstore.flush()
+    del region.writes[:]
+
+
+def value_at(region, key):
+    """ Where the value of key's entry is in memory """
+    start = region.memory.index(struct.pack(mod_kvstore.ENTRY, len(key), 2) + key.encode(), BEGIN)
+    return start + struct.calcsize(mod_kvstore.ENTRY) + len(key) + 2
+
+
+def pages(region, key, fmt):
+    """ The page addresses holding key's value and CRC """
+    at = value_at(region, key)
+    return sorted(set(BEGIN + (address - BEGIN) // PAGE * PAGE for address in range(at, at + struct.calcsize(fmt) + 2)))
+
+
+def test_corrupted_crc_drops_only_that_entry(region):
+    stored(region, [("first", "<H", 1), ("second", "<H", 2), ("third", "<H", 3)])
+    region.memory[value_at(region, "second")] ^= 0xFF
+    assert mod_kvstore.load() == 2
+    assert mod_kvstore.get("first") == (1,) and mod_kvstore.get("third") == (3,)
+    assert mod_kvstore.get("second") is None
+
+
+def test_format_mismatch_is_missing(region):
+    stored(region, [("seq", "<B", 7)])
+    mod_kvstore.load()
+    assert mod_kvstore.get("seq", "<B") == (7,) and mod_kvstore.get("seq") == (7,)
+    assert mod_kvstore.get("seq", "<H") is None
+
+
+def test_flush_writes_only_the_changed_aligned_pages(region):
+    stored(region, [("key{}".format(i), "<I", i) for i in range(12)])
+    assert mod_kvstore.flush() == 0 and region.writes == []
+    mod_kvstore.put("key11", "<I", 1234)
+    changed = pages(region, "key11", "<I")
+    assert mod_kvstore.flush() == len(changed)
+    assert region.writes == changed
+    mod_kvstore.load()
+    assert mod_kvstore.get("key11") == (1234,) and mod_kvstore.get("key0") == (0,)
+
+
+def test_failed_page_is_written_at_the_next_flush(region):
+    stored(region, [("key{}".format(i), "<I", i) for i in range(12)])
+    mod_kvstore.put("key0", "<I", 100)
+    mod_kvstore.put("key11", "<I", 111)
+    first = pages(region, "key0", "<I")
+    last = pages(region, "key11", "<I")
+    assert first[-1] < last[0]
+    region.fail_at.add(last[0])
+    with pytest.raises(OSError):
+        mod_kvstore.flush()
+    assert region.writes == first
+    # the pages written before the failure are not written again
+    assert mod_kvstore.flush() == len(last)
+    assert region.writes == first + last
+    mod_kvstore.load()
+    assert mod_kvstore.get("key0") == (100,) and mod_kvstore.get("key11") == (111,)
+
+
+def test_legacy_rtc_flag_at_4000_migrates_once(region):
+    region.memory[4000:4007] = b"KFRANKS"
+    mod_kvstore.init(read_region=region.read, write_page=region.write)
+    assert mod_kvstore.get("rtc_set", "<B") is None
+    assert mod_kvstore.legacy(4000, 7) == b"KFRANKS"
+    assert mod_kvstore.legacy(BEGIN - 1, 7) is None and mod_kvstore.legacy(4090, 7) is None
+    # what code.py does with the flag it found
+    mod_kvstore.put("rtc_set", "<B", 1)
+    mod_kvstore.flush()
+    assert mod_kvstore.legacy(4000, 7) is None
+    assert mod_kvstore.load() == 1
+    assert mod_kvstore.get("rtc_set", "<B") == (1,) and mod_kvstore.legacy(4000, 7) is None
+
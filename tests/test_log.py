@@ -0,0 +1,65 @@
+''' mod_log's sinks, and the PROFILE record backend/energy_model.py reads back from the SD log '''
+import os
+import sys
+
+import pytest
+
+import mod_log
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import energy_model  # noqa: E402
+
+
+class FileLogger:
+    """ adafruit_logging's Logger with a FileHandler: a level check, then one line per record """
+    def __init__(self, path):
+        self.path = path
+        self.level = 0
+
+    def setLevel(self, level):
+        self.level = level
+
+    def log(self, level, message):
+        if level >= self.level:
+            with open(self.path, "a") as f:
+                f.write("{}: {}\n".format(level, message))
+
+
+@pytest.fixture
+def sd_log(tmp_path):
+    path = str(tmp_path / "testlog.log")
+    yield path, FileLogger(path)
+    mod_log.init(None, "info", "info")
+
+
+def lines(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return f.read().splitlines()
+
+
+def test_sd_level_filters_log(sd_log):
+    path, logger = sd_log
+    mod_log.init(logger, "none", "warning")
+    mod_log.log(mod_log.INFO, "wake {}", 1)
+    mod_log.log(mod_log.WARNING, "low battery {}", 11.2)
+    assert [line.split(": ", 1)[1] for line in lines(path)] == ["WARNING: low battery 11.2"]
+
+
+@pytest.mark.parametrize("sd_level", ["debug", "info", "warning", "error"])
+def test_profile_reaches_the_sd_log_at_any_level(sd_log, sd_level):
+    path, logger = sd_log
+    mod_log.init(logger, "none", sd_level)
+    profile = {"phases": {"boot": 1.5, "wifi": 3.25}, "sleep_time": 300, "powerdown_method": "TPL5110"}
+    mod_log.record("PROFILE: {}", profile)
+    found = energy_model.load_profiles(path)
+    assert found == [dict(profile, name="wake 1")]
+
+
+def test_profile_respects_a_disabled_sd_log(sd_log, capsys):
+    path, logger = sd_log
+    mod_log.init(logger, "warning", "none")
+    mod_log.record("PROFILE: {}", {})
+    assert lines(path) == [] and capsys.readouterr().out == ""
@@ -0,0 +1,62 @@
+''' backend/logship.py reassembly: chunks in place, and topics that try to write elsewhere '''
+import os
+import struct
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import logship  # noqa: E402
+import mod_logship  # noqa: E402
+import standins  # noqa: E402
+
+
+def chunk(seq, offset, data):
+    return struct.pack(mod_logship.HEADER, seq, offset) + data
+
+
+def test_chunks_land_at_their_offsets(tmp_path):
+    reassembler = logship.Reassembler(str(tmp_path))
+    reassembler.handle("qtpy/42/logship/testlog.log", chunk(0, 0, b"first "))
+    reassembler.handle("qtpy/42/logship/testlog.log", chunk(1, 6, b"second"))
+    reassembler.handle("qtpy/42/logship/testlog.log", chunk(1, 6, b"second"))
+    assert (tmp_path / "qtpy" / "42" / "testlog.log").read_bytes() == b"first second"
+    assert reassembler.chunks == 2 and reassembler.duplicates == 1
+
+
+@pytest.mark.parametrize("topic", [
+    "../../logship/evil",
+    "qtpy/../logship/evil",
+    "./42/logship/evil",
+    "/42/logship/evil",
+    "qtpy//logship/evil",
+    "qtpy/42/logship/../../../evil",
+    "qtpy/42/logship//etc/evil",
+])
+def test_topics_outside_out_are_refused(tmp_path, topic):
+    out = tmp_path / "out"
+    reassembler = logship.Reassembler(str(out))
+    assert reassembler.path_for(topic) is None
+    assert reassembler.handle(topic, chunk(0, 0, b"payload")) is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_a_link_out_of_out_is_refused(tmp_path):
+    out = tmp_path / "out"
+    (out / "qtpy").mkdir(parents=True)
+    (tmp_path / "elsewhere").mkdir()
+    os.symlink(str(tmp_path / "elsewhere"), str(out / "qtpy" / "42"))
+    assert logship.Reassembler(str(out)).path_for("qtpy/42/logship/testlog.log") is None
+
+
+def test_write_error_does_not_escape_the_callback(tmp_path):
+    out = tmp_path / "out"
+    out.mkdir()
+    # a file where the node's directory should be
+    (out / "qtpy").write_bytes(b"")
+    reassembler = logship.Reassembler(str(out))
+    reassembler.on_message(None, None, standins.MemoryMessage("qtpy/42/logship/testlog.log", chunk(0, 0, b"data")))
+    assert reassembler.errors == 1
+    reassembler.on_message(None, None, standins.MemoryMessage("esp32/7/logship/testlog.log", chunk(0, 0, b"data")))
+    assert reassembler.chunks == 1
@@ -0,0 +1,58 @@
+''' backend/lora_gateway.py on standins.RadioLink: the round trip, lost and repeated frames '''
+import os
+import random
+import sys
+
+import pytest
+
+import mod_frame
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import lora_gateway  # noqa: E402
+import standins  # noqa: E402
+
+MODEL = "qtpy"
+
+
+@pytest.fixture
+def gateway():
+    return lora_gateway.Gateway(standins.MemoryClient(standins.MemoryBroker()))
+
+
+@pytest.mark.parametrize("loss", [0.0, 0.2])
+def test_round_trip_within_a_step_and_lost_frames_counted(gateway, loss):
+    rng = random.Random(3)
+    link = standins.RadioLink(loss, seed=3)
+    originals = {}
+    delivered = {}
+    for wake in range(30):
+        for node in range(1, 6):
+            originals[(node, wake)] = lora_gateway.simulated_record(rng, node)
+            frame, dropped = mod_frame.encode(MODEL, node, wake, originals[(node, wake)])
+            lost = link.lost
+            link.send(frame)
+            if link.lost == lost:
+                delivered.setdefault(node, []).append(wake)
+        while link.frames:
+            model, node, readings = gateway.handle(link.receive(), link.last_rssi)
+            wake = gateway.last_seq[(model, node)]
+            assert readings
+            for slot, value in readings.items():
+                assert abs(value - originals[(node, wake)][slot]) <= mod_frame.QUANTA[slot][1]
+    # the gateway sees the gaps between frames that arrived, not losses after a node's last one
+    expected = sum(wakes[-1] - wakes[0] + 1 - len(wakes) for wakes in delivered.values())
+    assert gateway.lost == expected and gateway.frames == link.sent - link.lost
+    assert (loss == 0) == (expected == 0)
+
+
+def test_repeated_frame_is_not_counted_lost(gateway):
+    values = lora_gateway.simulated_record(random.Random(1), 7)
+    first, _ = mod_frame.encode(MODEL, 7, 41, values)
+    assert gateway.handle(first, -90.0) is not None
+    published = gateway.published
+    assert gateway.handle(first, -91.0) is None
+    assert gateway.duplicates == 1 and gateway.lost == 0 and gateway.published == published
+    following, _ = mod_frame.encode(MODEL, 7, 43, values)
+    assert gateway.handle(following, -90.0) is not None
+    assert gateway.lost == 1 and gateway.frames == 2
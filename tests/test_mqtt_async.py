@@ -0,0 +1,34 @@
+''' backend/mqtt_async.py against the asyncio stand-in broker '''
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import mqtt_async  # noqa: E402
+import standins  # noqa: E402
+
+
+def test_listening_client_keeps_its_session_alive():
+    async def run():
+        broker = standins.AsyncBroker()
+        port = await broker.start()
+        received = []
+        monitor = mqtt_async.Client("monitor", keep_alive=1)
+        monitor.on_message = lambda topic, payload: received.append((topic, payload))
+        await monitor.connect("127.0.0.1", port)
+        await monitor.subscribe("qtpy/+/AHT20/#")
+        # only receiving for longer than the keep-alive
+        await asyncio.sleep(1.2)
+        node = mqtt_async.Client("node", keep_alive=0)
+        await node.connect("127.0.0.1", port)
+        await node.publish("qtpy/42/AHT20/Temperature", "70.25", qos=1)
+        await asyncio.sleep(0.1)
+        pings = (monitor.pings, node.pings)
+        await node.disconnect()
+        await monitor.disconnect()
+        await broker.stop()
+        return pings, received
+    (monitor_pings, node_pings), received = asyncio.run(run())
+    assert monitor_pings >= 2 and node_pings == 0
+    assert received == [("qtpy/42/AHT20/Temperature", b"70.25")]
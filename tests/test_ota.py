@@ -0,0 +1,209 @@
+''' OTA updates end to end: backend/ota_publish.py on the stand-in broker, mod_ota on a card in tmp_path '''
+import json
+import os
+import sys
+
+import pytest
+
+import circuitpython
+import mod_ota
+import mod_sdindex
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import ota_publish  # noqa: E402
+import standins  # noqa: E402
+
+MODEL = "qtpy"
+CHUNK_SIZE = 16
+RUNNING = {"mod_a.py": "A = 1\n", "mod_b.py": "B = 'the module running on CIRCUITPY'\n",
+           "code.py": "import mod_a\n"}
+
+
+@pytest.fixture
+def card(tmp_path, monkeypatch):
+    """ CIRCUITPY and the SD card in tmp_path, mod_ota fresh from a power on """
+    circuitpy = tmp_path / "circuitpy"
+    circuitpy.mkdir()
+    for name, text in RUNNING.items():
+        (circuitpy / name).write_text(text)
+    sd = tmp_path / "sd"
+    sd.mkdir()
+    monkeypatch.setattr(mod_ota, "CIRCUITPY", str(circuitpy) + "/")
+    monkeypatch.setattr(mod_ota, "OTA_ROOT", str(sd / "ota"))
+    monkeypatch.setattr(mod_ota, "STAGE", str(sd / "ota" / "stage"))
+    monkeypatch.setattr(mod_ota, "STATE_PATH", str(sd / "ota" / "state.json"))
+    monkeypatch.setattr(mod_sdindex, "ROOT", str(sd))
+    monkeypatch.setattr(mod_sdindex, "INDEX_PATH", str(sd / "index.json"))
+    monkeypatch.setattr(sys, "path", list(sys.path))
+    mod_sdindex.load()
+    power_on()
+    broker = standins.MemoryBroker()
+    yield broker, tmp_path
+    power_on()
+
+
+def power_on():
+    mod_ota.state.update(active=None, previous=None, pending=False, trials=0, failed=None)
+    mod_ota.manifest = None
+    mod_ota.needed = {}
+
+
+def boot(reset_code=0, running_file=None):
+    """ A new run from what the card holds: activate() as code.py calls it """
+    power_on()
+    return mod_ota.activate(reset_code, running_file or mod_ota.CIRCUITPY + "code.py")
+
+
+def publish(broker, tmp_path, version, files, clear_previous=False):
+    """ The files of a version, written out and published as the host does """
+    source = tmp_path / "host" / version
+    source.mkdir(parents=True)
+    for name, text in files.items():
+        (source / name).write_text(text)
+    host = standins.MemoryClient(broker)
+    paths = sorted(str(source / name) for name in files)
+    return ota_publish.publish_update(host, MODEL, version, paths, CHUNK_SIZE, clear_previous=clear_previous, wait=0)
+
+
+def check(broker):
+    """ The node's broker session: code.py's message callback routing OTA traffic to mod_ota """
+    node = standins.MemoryClient(broker)
+
+    def on_message(client, userdata, message):
+        if message.topic.endswith("/manifest"):
+            mod_ota.on_manifest(MODEL, message.payload)
+        else:
+            mod_ota.on_chunk(message.topic, message.payload)
+    node.on_message = on_message
+    try:
+        return mod_ota.check(node, MODEL, 1.0)
+    finally:
+        node.disconnect()
+
+
+def installed(version):
+    return sorted(os.listdir(mod_ota.version_dir(version)))
+
+
+def test_manifest_fetches_only_changed_files(card):
+    broker, tmp_path = card
+    files = dict(RUNNING, **{"mod_a.py": "A = 2  # a line long enough for several chunks\n"})
+    chunks, sent = publish(broker, tmp_path, "1.1", files)
+    assert sorted(sent) == sorted(files) and chunks > len(files)
+    assert check(broker) == "version 1.1 staged, active from the next boot"
+    assert installed("1.1") == ["mod_a.py"]
+    assert mod_ota.read_state()["active"] == "1.1" and mod_ota.state["pending"]
+    assert not os.path.exists(mod_ota.STAGE)
+    assert mod_ota.version_dir("1.1") + "/mod_a.py" in mod_sdindex.files
+
+
+def test_delta_keeps_the_files_of_the_previous_version(card):
+    broker, tmp_path = card
+    first = dict(RUNNING, **{"mod_a.py": "A = 2\n"})
+    publish(broker, tmp_path, "1.1", first)
+    check(broker)
+    assert boot() == "1.1"
+    mod_ota.mark_good()
+    second = dict(first, **{"mod_b.py": "B = 'changed in 1.2'\n"})
+    chunks, sent = publish(broker, tmp_path, "1.2", second)
+    assert sent == ["mod_b.py"]
+    assert check(broker).startswith("version 1.2 staged")
+    assert list(mod_ota.needed) == ["mod_b.py"]
+    assert installed("1.2") == ["mod_a.py", "mod_b.py"]
+    assert mod_ota.state["previous"] == "1.1"
+
+
+@pytest.mark.parametrize("clear_previous", [False, True])
+def test_node_two_versions_behind_gets_every_changed_file(card, clear_previous):
+    broker, tmp_path = card
+    first = dict(RUNNING, **{"mod_a.py": "A = 2  # new in 1.1, kept by 1.2\n"})
+    publish(broker, tmp_path, "1.1", first, clear_previous)
+    # the node sleeps through 1.1
+    second = dict(first, **{"mod_b.py": "B = 'changed in 1.2'\n"})
+    chunks, sent = publish(broker, tmp_path, "1.2", second, clear_previous)
+    assert sent == ["mod_b.py"]
+    assert check(broker).startswith("version 1.2 staged")
+    assert sorted(mod_ota.needed) == ["mod_a.py", "mod_b.py"]
+    assert installed("1.2") == ["mod_a.py", "mod_b.py"]
+
+
+def test_cleared_chunks_are_only_those_no_version_lists(card):
+    broker, tmp_path = card
+    publish(broker, tmp_path, "1.1", dict(RUNNING, **{"mod_a.py": "A = 2\n"}))
+    publish(broker, tmp_path, "1.2", dict(RUNNING, **{"mod_a.py": "A = 3\n"}), clear_previous=True)
+    hashes = set(topic.split("/")[3] for topic in broker.retained if "/chunks/" in topic)
+    manifest = json.loads(broker.retained["{}/ota/manifest".format(MODEL)])
+    assert hashes == set(entry["sha256"] for entry in manifest["files"].values())
+
+
+def test_missing_chunks_wait_for_a_later_wake(card):
+    broker, tmp_path = card
+    publish(broker, tmp_path, "1.1", dict(RUNNING, **{"mod_a.py": "A = 3  # spread over chunks\n"}))
+    manifest = json.loads(broker.retained["{}/ota/manifest".format(MODEL)])
+    broker.retained.pop(ota_publish.chunk_topic(MODEL, manifest["files"]["mod_a.py"]["sha256"], 1))
+    assert check(broker) == "1 chunks still missing for 1.1"
+    assert mod_ota.read_state()["active"] is None
+
+
+def test_trial_boot_counts_once(card):
+    broker, tmp_path = card
+    publish(broker, tmp_path, "1.1", dict(RUNNING, **{"mod_a.py": "A = 2\n"}))
+    check(broker)
+    assert boot() == "1.1"
+    assert sys.path[0] == mod_ota.version_dir("1.1")
+    assert mod_ota.state["trials"] == 1
+    boot()
+    assert mod_ota.read_state()["trials"] == 2
+    mod_ota.mark_good()
+    boot()
+    assert not mod_ota.read_state()["pending"] and mod_ota.state["trials"] == 0
+
+
+def test_shipped_code_py_counts_its_trial_once(card):
+    broker, tmp_path = card
+    publish(broker, tmp_path, "1.1", dict(RUNNING, **{"code.py": "import mod_b\n"}))
+    check(broker)
+    shipped = mod_ota.version_dir("1.1") + "/code.py"
+    with pytest.raises(circuitpython.Reload) as reloaded:
+        boot()
+    assert reloaded.value.args[0] == shipped
+    assert mod_ota.read_state()["trials"] == 0
+    assert boot(running_file=shipped) == "1.1"
+    assert mod_ota.read_state()["trials"] == 1
+
+
+def test_watchdog_reset_rolls_back(card):
+    broker, tmp_path = card
+    publish(broker, tmp_path, "1.1", dict(RUNNING, **{"code.py": "import mod_b\n"}))
+    check(broker)
+    shipped = mod_ota.version_dir("1.1") + "/code.py"
+    with pytest.raises(circuitpython.Reload) as reloaded:
+        boot(mod_ota.RESET_WATCHDOG, shipped)
+    assert reloaded.value.args[0] == mod_ota.CIRCUITPY + "code.py"
+    state = mod_ota.read_state()
+    assert state["active"] is None and state["failed"] == "1.1" and not state["pending"]
+    assert boot() is None
+    # the failed version is not fetched again
+    assert check(broker) == "no update"
+
+
+def test_too_many_trials_roll_back(card):
+    broker, tmp_path = card
+    publish(broker, tmp_path, "1.1", dict(RUNNING, **{"mod_a.py": "A = 2\n"}))
+    check(broker)
+    for _ in range(mod_ota.MAX_TRIALS):
+        assert boot() == "1.1"
+    assert boot() is None
+    assert mod_ota.read_state()["failed"] == "1.1"
+
+
+def test_stale_version_directory_is_replaced(card):
+    broker, tmp_path = card
+    stale = mod_ota.version_dir("1.1")
+    os.makedirs(stale + "/old")
+    with open(stale + "/old/mod_a.py", "w") as f:
+        f.write("A = 0\n")
+    publish(broker, tmp_path, "1.1", dict(RUNNING, **{"mod_a.py": "A = 2\n"}))
+    assert check(broker).startswith("version 1.1 staged")
+    assert installed("1.1") == ["mod_a.py"]